@@ -1,4 +1,6 @@
 from .problem import Problem
+from .simulate import Simulation
 from .solution import Solution
+from . import trace
 
-__all__ = 'Problem', 'Solution'
+__all__ = 'Problem', 'Simulation', 'Solution', 'trace'
@@ -0,0 +1,189 @@
+'''Cheap bounds on the weighted compute time of any schedule.
+
+A layer costs its command's time times the largest weight of the images
+that use it. Every used command has to run at least once, in a layer
+holding the heaviest image that needs it, which gives command_bound.
+
+Call the images that run command c I(c). If c runs only once, every image
+in I(c) builds on that one layer. If commands a and b both run once, an
+image running both builds one of their layers on top of the other, so
+I(a) and I(b) are nested. Commands whose image sets cross, meaning they
+overlap but neither contains the other, can't both run once. At least
+one of each crossing pair, and at least two of any three pairwise
+crossing commands, run again, each extra run costing at least the
+command's time times the smallest weight of its images. Which commands
+run again is a vertex cover of the crossing graph, so any packing of its
+edges and triangles bounds the extra cost from below. lower_bound packs
+greedily; lp_bound solves the cover's LP relaxation instead, which is at
+least as tight, given scipy.
+
+upper_bound runs the greedy heuristics, so a gap is available for every
+instance without running an exact solver.
+'''
+from . import trace
+from .layers import LayerTree
+
+
+def _image_masks(problem):
+    '''Maps each command to a bitmask of the images that run it.'''
+    masks = {}
+    for k, cmds in enumerate(problem.images.values()):
+        for c in cmds:
+            masks[c] = masks.get(c, 0) | (1 << k)
+    return masks
+
+
+def _weights(problem):
+    '''Maps each command to the (smallest, largest) weight of its images.'''
+    weights = {}
+    for img, cmds in problem.images.items():
+        w = problem.weights[img]
+        for c in cmds:
+            lo, hi = weights.get(c, (w, w))
+            weights[c] = min(lo, w), max(hi, w)
+    return weights
+
+
+def command_bound(problem):
+    '''Returns the cost of running every used command once.'''
+    return sum(problem.commands[c] * hi for c, (_, hi) in _weights(problem).items())
+
+
+def crossing(problem):
+    '''Returns (graph, costs) of commands whose image sets cross.
+
+    graph maps each command to the set of commands it crosses, and costs
+    maps commands to the least a second run of them can cost.'''
+    masks = _image_masks(problem)
+    costs = {c: problem.commands[c] * lo for c, (lo, _) in _weights(problem).items()}
+
+    graph = {}
+    cmds = sorted(c for c in masks if costs[c] > 0)
+    for k, a in enumerate(cmds):
+        ma = masks[a]
+        for b in cmds[k+1:]:
+            mb = masks[b]
+            both = ma & mb
+            if both and both != ma and both != mb:
+                graph.setdefault(a, set()).add(b)
+                graph.setdefault(b, set()).add(a)
+    return graph, costs
+
+
+def _packing(graph, costs, triples=True):
+    '''Returns the value of a greedy packing of triangles and edges.
+
+    Each triangle or edge takes as much as all its commands have left. A
+    triangle counts twice what it takes, since two of its commands run
+    again.'''
+    left = {c: costs[c] for c in graph}
+    edges = sorted(
+        ((a, b) for a in graph for b in graph[a] if a < b),
+        key=lambda e: (-min(costs[e[0]], costs[e[1]]), e)
+    )
+
+    value = 0
+    if triples:
+        for a, b in edges:
+            if not left[a] or not left[b]:
+                continue
+            common = [c for c in graph[a] & graph[b] if left[c]]
+            if not common:
+                continue
+            c = max(common, key=lambda c: (left[c], c))
+            take = min(left[a], left[b], left[c])
+            for x in (a, b, c):
+                left[x] -= take
+            value += 2 * take
+
+    for a, b in edges:
+        take = min(left[a], left[b])
+        if take:
+            left[a] -= take
+            left[b] -= take
+            value += take
+
+    return value
+
+
+def lower_bound(problem, triples=True):
+    '''Returns a lower bound on the weighted compute time of any schedule.
+
+    The bound is cached on the problem, which is fine as long as its
+    command times don't change.'''
+    key = '_lower_bound_triples' if triples else '_lower_bound_pairs'
+    try:
+        return getattr(problem, key)
+    except AttributeError:
+        with trace.phase('bounds.lower'):
+            graph, costs = crossing(problem)
+            bound = command_bound(problem) + _packing(graph, costs, triples)
+        setattr(problem, key, bound)
+        return bound
+
+
+def lp_bound(problem):
+    '''Returns command_bound plus the LP relaxation of the crossing cover.
+
+    This needs scipy, and raises ImportError without it.'''
+    from scipy.optimize import linprog
+    from scipy.sparse import coo_matrix
+
+    with trace.phase('bounds.lp'):
+        graph, costs = crossing(problem)
+        cmds = sorted(graph)
+        if not cmds:
+            return command_bound(problem)
+        index = {c: k for k, c in enumerate(cmds)}
+
+        # Cover constraints as -x_a - x_b <= -1 and -x_a - x_b - x_c <= -2.
+        rows, cols, rhs = [], [], []
+        for a in cmds:
+            for b in graph[a]:
+                if a >= b:
+                    continue
+                r = len(rhs)
+                rows.extend([r, r])
+                cols.extend([index[a], index[b]])
+                rhs.append(-1.0)
+                for c in graph[a] & graph[b]:
+                    if c > b:
+                        r = len(rhs)
+                        rows.extend([r, r, r])
+                        cols.extend([index[a], index[b], index[c]])
+                        rhs.append(-2.0)
+
+        A = coo_matrix(([-1.0] * len(rows), (rows, cols)), shape=(len(rhs), len(cmds)))
+        args = [costs[c] for c in cmds], A.tocsr(), rhs
+        try:
+            result = linprog(*args, bounds=(0, 1), method='highs')
+        except ValueError:
+            # scipy before 1.6 has no HiGHS.
+            result = linprog(
+                *args, bounds=(0, 1), method='interior-point', options={'sparse': True}
+            )
+        if not result.success:
+            raise ValueError('crossing cover LP failed: %s' % result.message)
+        return command_bound(problem) + result.fun
+
+
+def upper_bound(problem):
+    '''Returns (weighted compute time, schedule) of the best greedy schedule.'''
+    from .solvers.most_common import MostCommonHeuristic
+    from .solvers.most_time import MostTimeHeuristic
+
+    with trace.phase('bounds.upper'):
+        best = None
+        for solverclass in (MostCommonHeuristic, MostTimeHeuristic):
+            schedule = solverclass().solve(problem, lambda schedule: None)
+            value = LayerTree(problem, schedule).weighted_time
+            if best is None or value < best[0]:
+                best = value, schedule
+        return best
+
+
+def gap(value, bound):
+    '''Returns the relative gap between a value and a lower bound on it.'''
+    if value == 0:
+        return 0.0
+    return max(0.0, (value - bound) / float(value))
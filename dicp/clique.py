@@ -1,42 +1,195 @@
-class Clique(object):
-    NEXT_ID = 1
+from weakref import WeakValueDictionary
+
+
+class CliqueIndex(object):
+    '''Bit positions of a problem's images and commands, in sorted order.
 
-    def __init__(self, problem, images, commands, parent=None):
+    Cliques of a problem are interned here, so building the same clique
+    twice gives back the same object.'''
+
+    def __init__(self, problem):
         self.problem = problem
-        self.images = tuple(sorted(images))
-        self.commands = tuple(sorted(commands))
-        self.images_set = set(self.images)
-        self.commands_set = set(self.commands)
-        self.parent = parent
-
-        self.remaining = {}
-        for i in self.images:
-            if parent:
-                cmds = parent.remaining[i] - self.commands_set
-            else:
-                cmds = set(self.problem.images[i]) - self.commands_set
-            if cmds:
-                self.remaining[i] = cmds
+        self.image_names = sorted(problem.images)
+        self.command_names = sorted(problem.commands)
+        self.image_bits = {i: 1 << k for k, i in enumerate(self.image_names)}
+        self.command_bits = {c: 1 << k for k, c in enumerate(self.command_names)}
+        self.times = [problem.commands[c] for c in self.command_names]
+        self.image_masks = {
+            self.image_bits[i]: self.command_mask(cmds) for i, cmds in problem.images.items()
+        }
+        self.interned = WeakValueDictionary()
+        self.next_id = 1
+
+    @staticmethod
+    def of(problem):
+        '''Returns the index of a problem, building it the first time.'''
+        try:
+            return problem._clique_index
+        except AttributeError:
+            problem._clique_index = CliqueIndex(problem)
+            return problem._clique_index
+
+    def image_mask(self, images):
+        mask = 0
+        for i in images:
+            mask |= self.image_bits[i]
+        return mask
+
+    def command_mask(self, commands):
+        mask = 0
+        for c in commands:
+            mask |= self.command_bits[c]
+        return mask
+
 
-        self.remaining_commands = set()
-        for cmds in self.remaining.values():
-            self.remaining_commands = self.remaining_commands.union(cmds)
+def bits(mask):
+    '''Yields the positions of the set bits of mask, lowest first.'''
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
 
-        self.id = Clique.NEXT_ID
-        Clique.NEXT_ID += 1
+
+class Clique(object):
+    '''A set of images that share a set of commands, below an optional parent.
+
+    Images and commands are stored as bitmasks over the problem's
+    CliqueIndex. Identical cliques are interned, and the hash and cost are
+    computed once. The images, commands and remaining properties, the last
+    giving the commands each image still has to run after this clique and
+    its ancestors, are decoded from the masks the first time they are
+    asked for and kept, so hot loops can read them freely. They are
+    shared, so callers must not modify them.
+    '''
+    __slots__ = (
+        'index', 'image_mask', 'command_mask', 'parent', 'id', 'cost', '_hash',
+        '_remaining', '_images', '_commands', '_images_set', '_commands_set',
+        '_remaining_names', '_remaining_commands', '__weakref__'
+    )
+
+    def __new__(cls, problem, images, commands, parent=None):
+        index = CliqueIndex.of(problem)
+        image_mask = index.image_mask(images)
+        command_mask = index.command_mask(commands)
+
+        key = (image_mask, command_mask, parent)
+        clique = index.interned.get(key)
+        if clique is not None:
+            return clique
+
+        clique = object.__new__(cls)
+        clique.index = index
+        clique.image_mask = image_mask
+        clique.command_mask = command_mask
+        clique.parent = parent
+        clique.id = index.next_id
+        clique.cost = sum(index.times[k] for k in bits(command_mask))
+        clique._hash = hash(key)
+        clique._remaining = None
+        clique._images = clique._commands = None
+        clique._images_set = clique._commands_set = None
+        clique._remaining_names = clique._remaining_commands = None
+        index.next_id += 1
+
+        index.interned[key] = clique
+        return clique
 
     @property
-    def cost(self):
-        return sum(self.problem.commands[c] for c in self.commands)
+    def problem(self):
+        return self.index.problem
+
+    @property
+    def images(self):
+        if self._images is None:
+            names = self.index.image_names
+            self._images = tuple(names[k] for k in bits(self.image_mask))
+        return self._images
+
+    @property
+    def commands(self):
+        if self._commands is None:
+            names = self.index.command_names
+            self._commands = tuple(names[k] for k in bits(self.command_mask))
+        return self._commands
+
+    @property
+    def images_set(self):
+        if self._images_set is None:
+            self._images_set = frozenset(self.images)
+        return self._images_set
+
+    @property
+    def commands_set(self):
+        if self._commands_set is None:
+            self._commands_set = frozenset(self.commands)
+        return self._commands_set
 
     @property
     def size(self):
         return len(self.images) * len(self.commands)
 
+    def remaining_masks(self):
+        '''Maps image bits to masks of commands they still have to run.'''
+        if self._remaining is None:
+            if self.parent is not None:
+                above = self.parent.remaining_masks()
+            else:
+                above = self.index.image_masks
+
+            self._remaining = {}
+            mask = self.image_mask
+            while mask:
+                bit = mask & -mask
+                mask ^= bit
+                rest = above.get(bit, 0) & ~self.command_mask
+                if rest:
+                    self._remaining[bit] = rest
+        return self._remaining
+
+    @property
+    def remaining(self):
+        '''Maps images to the sets of commands they still have to run.'''
+        if self._remaining_names is None:
+            index = self.index
+            names = index.command_names
+            self._remaining_names = {
+                index.image_names[bit.bit_length() - 1]: frozenset(names[k] for k in bits(rest))
+                for bit, rest in self.remaining_masks().items()
+            }
+        return self._remaining_names
+
+    @property
+    def remaining_commands(self):
+        if self._remaining_commands is None:
+            mask = 0
+            for rest in self.remaining_masks().values():
+                mask |= rest
+            names = self.index.command_names
+            self._remaining_commands = frozenset(names[k] for k in bits(mask))
+        return self._remaining_commands
+
     def __hash__(self):
-        return hash((self.images, self.commands, hash(self.parent)))
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, Clique):
+            return NotImplemented
+        return (
+            self.image_mask == other.image_mask and self.command_mask == other.command_mask and
+            self.parent == other.parent and self.index is other.index
+        )
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
 
     def __cmp__(self, other):
+        if other is None:
+            return 1
         return cmp(self.parent, other.parent) or cmp(self.images, other.images) or cmp(self.commands, other.commands)
 
     def __str__(self):
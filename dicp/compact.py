@@ -0,0 +1,395 @@
+'''Compact binary DICP instances that can be memory-mapped with NumPy.
+
+A compact instance is a single file laid out as:
+
+    magic       8 bytes, DICPBIN1
+    header      json describing each array, padded with spaces
+    arrays      each starting on a 64 byte boundary
+
+The header maps array names to their dtype, length and byte offset.
+Every compact file contains these arrays:
+
+    command_names    utf-8 command keys, concatenated in sorted order
+    command_offsets  where each key starts and ends in command_names
+    times            command times, indexed by command id
+    image_names      utf-8 image keys, concatenated in sorted order
+    image_offsets    where each key starts and ends in image_names
+    indptr           CSR row pointers: image k runs the commands in
+    indices          indices[indptr[k]:indptr[k+1]], in order
+
+Instances with rebuild weights, change rates or layer sizes also have:
+
+    weights          rebuild weight of each image
+    changes          change probability, indexed by command id
+    sizes            layer bytes, indexed by command id
+'''
+from .problem import MAGIC, Problem, is_compact
+from collections import OrderedDict
+import json
+import numpy as np
+import shutil
+
+HEADER_SIZE = 4096  # including the magic
+ALIGN = 64
+
+ARRAYS = (
+    ('command_names', np.uint8),
+    ('command_offsets', np.int64),
+    ('times', np.int64),
+    ('image_names', np.uint8),
+    ('image_offsets', np.int64),
+    ('indptr', np.int64),
+    ('indices', np.int32)
+)
+
+# Left out of files whose problems don't use them.
+OPTIONAL_ARRAYS = (
+    ('weights', np.float64),
+    ('changes', np.float64),
+    ('sizes', np.int64)
+)
+
+
+def encode_names(names):
+    '''Returns (utf-8 blob, offsets) arrays for a sequence of names.'''
+    encoded = [n.encode('utf-8') for n in names]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+
+def decode_names(blob, offsets):
+    '''Inverse of encode_names. Returns a list of unicode names.'''
+    data = blob.tobytes()
+    bounds = offsets.tolist()
+    return [data[a:b].decode('utf-8') for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+class CompactWriter(object):
+    '''Writes a compact instance whose array lengths are known up front.
+
+    Arrays can be written in chunks, in any order, so very large instances
+    can be streamed to disk without holding them in memory. Optional
+    arrays are only written if lengths has them.'''
+
+    def __init__(self, path, lengths):
+        self.layout = OrderedDict()
+        offset = HEADER_SIZE
+        optional = tuple(a for a in OPTIONAL_ARRAYS if a[0] in lengths)
+        for name, dtype in ARRAYS + optional:
+            dtype = np.dtype(dtype)
+            length = int(lengths[name])
+            self.layout[name] = {
+                'dtype': dtype.newbyteorder('<').str,
+                'length': length,
+                'offset': offset
+            }
+            offset += length * dtype.itemsize
+            offset += -offset % ALIGN
+
+        header = json.dumps(self.layout).encode('utf-8')
+        if len(MAGIC) + len(header) > HEADER_SIZE:
+            raise ValueError('compact header too large')
+
+        self.fp = open(path, 'wb')
+        self.fp.write(MAGIC)
+        self.fp.write(header.ljust(HEADER_SIZE - len(MAGIC)))
+        self.fp.truncate(offset)
+        self.written = {name: 0 for name in self.layout}
+
+    def write(self, name, data):
+        '''Appends data to the named array.'''
+        spec = self.layout[name]
+        data = np.ascontiguousarray(data, dtype=spec['dtype'])
+        if self.written[name] + len(data) > spec['length']:
+            raise ValueError('too much data for %s' % name)
+
+        self.fp.seek(spec['offset'] + self.written[name] * data.itemsize)
+        self.fp.write(data.tobytes())
+        self.written[name] += len(data)
+
+    def close(self):
+        for name, spec in self.layout.items():
+            if self.written[name] != spec['length']:
+                raise ValueError('%s is incomplete' % name)
+        self.fp.close()
+
+
+def write(path, command_names, times, image_names, indptr, indices,
+          weights=None, changes=None, sizes=None):
+    '''Writes arrays describing an instance to a compact file.
+
+    Names must already be sorted; indices refer to positions in
+    command_names. weights, changes and sizes are optional.'''
+    cmd_blob, cmd_offsets = encode_names(command_names)
+    img_blob, img_offsets = encode_names(image_names)
+    arrays = {
+        'command_names': cmd_blob,
+        'command_offsets': cmd_offsets,
+        'times': times,
+        'image_names': img_blob,
+        'image_offsets': img_offsets,
+        'indptr': indptr,
+        'indices': indices
+    }
+    for name, data in (('weights', weights), ('changes', changes), ('sizes', sizes)):
+        if data is not None:
+            arrays[name] = data
+
+    writer = CompactWriter(path, {n: len(a) for n, a in arrays.items()})
+    for name, data in arrays.items():
+        writer.write(name, data)
+    writer.close()
+
+
+def save(problem, path):
+    '''Saves any Problem as a compact instance.'''
+    cmd_ids = {c: j for j, c in enumerate(problem.commands)}
+
+    indptr = np.zeros(len(problem.images) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(cmds) for cmds in problem.images.values()])
+    indices = np.fromiter(
+        (cmd_ids[c] for cmds in problem.images.values() for c in cmds),
+        dtype=np.int32, count=indptr[-1]
+    )
+
+    write(
+        path, list(problem.commands), list(problem.commands.values()),
+        list(problem.images), indptr, indices,
+        weights=list(problem.weights.values()) if problem.weighted else None,
+        changes=list(problem.changes.values()) if problem.changing else None,
+        sizes=list(problem.sizes.values()) if problem.sized else None
+    )
+
+
+def _map(path):
+    with open(path, 'rb') as fp:
+        if fp.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a compact instance' % path)
+        layout = json.loads(fp.read(HEADER_SIZE - len(MAGIC)).decode('utf-8'))
+
+    arrays = {}
+    for name, spec in layout.items():
+        if spec['length']:
+            arrays[name] = np.memmap(
+                path, dtype=spec['dtype'], mode='r',
+                offset=spec['offset'], shape=(spec['length'],)
+            )
+        else:
+            arrays[name] = np.zeros(0, dtype=spec['dtype'])
+    return arrays
+
+
+class CompactProblem(Problem):
+    '''Problem backed by a memory-mapped compact instance.
+
+    The raw arrays are available as times, indptr and indices. The
+    images, commands and images_by_command dicts are only built when
+    something asks for them.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.arrays = arrays = _map(path)
+        self.times = arrays['times']
+        self.indptr = arrays['indptr']
+        self.indices = arrays['indices']
+
+    def _by_command(self, name, default):
+        '''Maps used commands to values from an optional per-command array.'''
+        if name not in self.arrays:
+            return OrderedDict((c, default) for c in self.commands)
+        values = self.arrays[name].tolist()
+        names = self.command_names
+        return OrderedDict((names[j], values[j]) for j in np.flatnonzero(self.used).tolist())
+
+    @property
+    def weights(self):
+        '''Property mapping images to rebuild weights, 1 unless stored.'''
+        try:
+            return self._weights
+        except AttributeError:
+            if 'weights' in self.arrays:
+                values = self.arrays['weights'].tolist()
+            else:
+                values = [1] * self.num_images
+            self._weights = OrderedDict(zip(self.image_names, values))
+            return self._weights
+
+    @property
+    def weighted(self):
+        return 'weights' in self.arrays and bool((self.arrays['weights'] != 1).any())
+
+    @property
+    def changes(self):
+        '''Property mapping commands to change probabilities, 0 unless stored.'''
+        try:
+            return self._changes
+        except AttributeError:
+            self._changes = self._by_command('changes', 0.0)
+            return self._changes
+
+    @property
+    def changing(self):
+        return 'changes' in self.arrays and bool(self.arrays['changes'][self.used].any())
+
+    @property
+    def sizes(self):
+        '''Property mapping commands to output sizes, 0 unless stored.'''
+        try:
+            return self._sizes
+        except AttributeError:
+            self._sizes = self._by_command('sizes', 0)
+            return self._sizes
+
+    @property
+    def sized(self):
+        return 'sizes' in self.arrays and bool(self.arrays['sizes'][self.used].any())
+
+    @property
+    def weighted_time(self):
+        '''Property giving the weighted compute time if no commands are shared.'''
+        if 'weights' not in self.arrays:
+            return self.total_time
+        try:
+            return self._weighted_time
+        except AttributeError:
+            if len(self.indices):
+                per_pair = np.repeat(self.arrays['weights'], np.diff(self.indptr))
+                self._weighted_time = float((per_pair * self.times[self.indices]).sum())
+            else:
+                self._weighted_time = 0
+            return self._weighted_time
+
+    @property
+    def num_images(self):
+        return len(self.indptr) - 1
+
+    @property
+    def command_names(self):
+        '''Property listing command names by command id.'''
+        try:
+            return self._command_names
+        except AttributeError:
+            self._command_names = decode_names(
+                self.arrays['command_names'], self.arrays['command_offsets']
+            )
+            return self._command_names
+
+    @property
+    def image_names(self):
+        '''Property listing image names in order.'''
+        try:
+            return self._image_names
+        except AttributeError:
+            self._image_names = decode_names(
+                self.arrays['image_names'], self.arrays['image_offsets']
+            )
+            return self._image_names
+
+    @property
+    def used(self):
+        '''Property giving a boolean array of commands used by any image.'''
+        try:
+            return self._used
+        except AttributeError:
+            self._used = np.bincount(self.indices, minlength=len(self.times)) > 0
+            return self._used
+
+    @property
+    def images(self):
+        '''Property mapping image names to their command lists.'''
+        try:
+            return self._images
+        except AttributeError:
+            names = self.command_names
+            indptr = self.indptr.tolist()
+            self._images = OrderedDict()
+            for k, img in enumerate(self.image_names):
+                ids = self.indices[indptr[k]:indptr[k+1]].tolist()
+                self._images[img] = [names[j] for j in ids]
+            return self._images
+
+    @property
+    def commands(self):
+        '''Property mapping used command names to their times.'''
+        try:
+            return self._commands
+        except AttributeError:
+            names = self.command_names
+            times = self.times.tolist()
+            self._commands = OrderedDict(
+                (names[j], times[j]) for j in np.flatnonzero(self.used).tolist()
+            )
+            return self._commands
+
+    @property
+    def images_by_command(self):
+        '''Property mapping command names to the images using them.'''
+        try:
+            return self._images_by_command
+        except AttributeError:
+            self._images_by_command = OrderedDict((c, set()) for c in self.commands)
+            for i, cmds in self.images.items():
+                for c in cmds:
+                    self._images_by_command[c].add(i)
+            return self._images_by_command
+
+    @property
+    def total_time(self):
+        '''Property giving the compute time if no commands are shared.'''
+        try:
+            return self._total_time
+        except AttributeError:
+            self._total_time = int(self.times[self.indices].sum()) if len(self.indices) else 0
+            return self._total_time
+
+    def save(self, path):
+        '''Saves the instance to a json file without building any dicts.'''
+        if self.weighted or self.changing or self.sized:
+            # These are written from the dicts.
+            return Problem.save(self, path)
+
+        cmd_names = self.command_names
+        indptr = self.indptr.tolist()
+        used = np.flatnonzero(self.used).tolist()
+        times = self.times.tolist()
+
+        with open(path, 'w') as fp:
+            fp.write('{\n')
+            fp.write('    "images": {\n')
+            for k, img in enumerate(self.image_names):
+                end = '\n' if k == self.num_images - 1 else ',\n'
+                cmds = [cmd_names[j] for j in self.indices[indptr[k]:indptr[k+1]].tolist()]
+                fp.write('        %s: %s%s' % (json.dumps(img), json.dumps(cmds), end))
+            fp.write('    },\n')
+
+            fp.write('    "commands": {\n')
+            for n, j in enumerate(used):
+                end = '\n' if n == len(used) - 1 else ',\n'
+                fp.write('        %s: %d%s' % (json.dumps(cmd_names[j]), times[j], end))
+            fp.write('    }\n')
+            fp.write('}\n')
+
+    def update_times(self, times):
+        ids = {c: j for j, c in enumerate(self.command_names)}
+        if self.times is self.arrays['times']:
+            self.times = np.array(self.times)  # the mapping is read-only
+        for c, t in times.items():
+            j = ids.get(c)
+            if j is not None:
+                self.times[j] = t
+        for cached in ('_commands', '_total_time', '_weighted_time', '_lower_bound_triples',
+                       '_lower_bound_pairs'):
+            self.__dict__.pop(cached, None)
+
+    def save_compact(self, path):
+        if self.times is self.arrays['times']:
+            shutil.copyfile(self.path, path)
+        else:
+            save(self, path)
+
+
+def load(path):
+    '''Loads a compact instance without building any dicts.'''
+    return CompactProblem(path)
@@ -0,0 +1,269 @@
+'''Runs a schedule as real layered builds, without a Docker daemon.
+
+Every layer of the schedule's prefix tree is a snapshot directory: a copy
+of its parent's snapshot in which the layer's command has been run as a
+shell step. Layers are stored in a content-addressed cache under a key
+hashed from the parent's key and the command, so a layer already built
+by an earlier run, with the same commands below it, is a cache hit.
+
+Layers whose parents are built are run concurrently on a pool of
+workers, so independent branches of the tree build in parallel.
+'''
+from . import trace
+from .layers import LayerTree
+from Queue import Queue
+from threading import Thread
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+
+ROOT_KEY = ''
+
+
+def layer_key(parent_key, command):
+    '''Returns the cache key of running command on top of parent_key.'''
+    return hashlib.sha1(('%s\0%s' % (parent_key, command)).encode('utf-8')).hexdigest()
+
+
+class LayerCache(object):
+    '''Content-addressed store of layer snapshots.
+
+    Each layer lives in <path>/<key[:2]>/<key>, holding its snapshot in fs,
+    the output of its command in log and how it was built in meta.json.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def dir(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def snapshot(self, key):
+        return os.path.join(self.dir(key), 'fs')
+
+    def meta(self, key):
+        '''Returns the metadata of a cached layer, or None if not cached.'''
+        try:
+            with open(os.path.join(self.dir(key), 'meta.json')) as fp:
+                return json.load(fp)
+        except IOError:
+            return None
+
+    def build(self, key, parent_key, command, script, shell='/bin/sh'):
+        '''Builds a layer into the cache and returns its metadata.
+
+        The layer is assembled in a temporary directory and moved into place
+        once its command succeeds, so a cached layer is always complete.'''
+        tmp = os.path.join(self.path, 'tmp', '%s.%d' % (key, os.getpid()))
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+
+        fs = os.path.join(tmp, 'fs')
+        if parent_key == ROOT_KEY:
+            os.makedirs(fs)
+        else:
+            shutil.copytree(self.snapshot(parent_key), fs, symlinks=True)
+
+        env = dict(os.environ, DICP_LAYER=key)
+        start = time.time()
+        with open(os.path.join(tmp, 'log'), 'w') as log:
+            returncode = subprocess.call(
+                [shell, '-c', script], cwd=fs, env=env, stdout=log, stderr=subprocess.STDOUT
+            )
+        seconds = time.time() - start
+
+        meta = {
+            'command': command,
+            'parent': parent_key,
+            'script': script,
+            'seconds': seconds,
+            'returncode': returncode
+        }
+        if returncode != 0:
+            shutil.rmtree(tmp)
+            return meta
+
+        with open(os.path.join(tmp, 'meta.json'), 'w') as fp:
+            json.dump(meta, fp)
+
+        dest = self.dir(key)
+        if not os.path.exists(os.path.dirname(dest)):
+            try:
+                os.makedirs(os.path.dirname(dest))
+            except OSError:
+                pass  # created by a concurrent build
+        try:
+            os.rename(tmp, dest)
+        except OSError:
+            # Another build of the same layer got there first.
+            shutil.rmtree(tmp)
+        return meta
+
+
+class LayerRun(object):
+    '''What happened to one layer during an execution'''
+
+    def __init__(self, layer, key, command):
+        self.layer = layer
+        self.key = key
+        self.command = command
+        self.hit = False
+        self.seconds = 0.0         # time spent running the command
+        self.cached_seconds = 0.0  # build time saved by a cache hit
+        self.start = None          # seconds since the execution started
+        self.finish = None
+        self.returncode = None
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.error is None and self.returncode in (None, 0)
+
+
+class Execution(object):
+    '''Results of executing a schedule, one LayerRun per layer of its tree'''
+
+    def __init__(self, tree, runs, wall_time):
+        self.tree = tree
+        self.runs = runs
+        self.wall_time = wall_time
+
+    @property
+    def hits(self):
+        return sum(1 for r in self.runs if r.hit)
+
+    @property
+    def misses(self):
+        return sum(1 for r in self.runs if r.finish is not None and not r.hit)
+
+    @property
+    def build_time(self):
+        '''Seconds spent running commands, over all workers.'''
+        return sum(r.seconds for r in self.runs)
+
+    @property
+    def failed(self):
+        '''Layers whose commands failed. Layers above them are not run.'''
+        return [r for r in self.runs if r.finish is not None and not r.ok]
+
+    def stats(self):
+        '''Returns (# of layers, # of cache hits, wall-clock and build seconds)'''
+        return len(self.runs), self.hits, self.wall_time, self.build_time
+
+    def to_dict(self):
+        return {
+            'layers': len(self.runs),
+            'hits': self.hits,
+            'misses': self.misses,
+            'failed': len(self.failed),
+            'wall_time': self.wall_time,
+            'build_time': self.build_time,
+            'runs': [{
+                'layer': r.layer,
+                'parent': self.tree.parent[r.layer],
+                'key': r.key,
+                'command': r.command,
+                'hit': r.hit,
+                'seconds': r.seconds,
+                'cached_seconds': r.cached_seconds,
+                'start': r.start,
+                'finish': r.finish,
+                'returncode': r.returncode,
+                'error': r.error
+            } for r in self.runs]
+        }
+
+
+class Executor(object):
+    '''Executes schedules as layered builds on a pool of workers.
+
+    script maps command names to the shell text to run for them. Commands
+    it doesn't contain are run as written.
+    '''
+
+    def __init__(self, cache, workers=1, script=None, shell='/bin/sh'):
+        if workers < 1:
+            raise ValueError('need at least one worker')
+        if not isinstance(cache, LayerCache):
+            cache = LayerCache(cache)
+        self.cache = cache
+        self.workers = workers
+        self.script = script or {}
+        self.shell = shell
+
+    def run(self, problem, schedule):
+        '''Builds every layer of schedule and returns an Execution.'''
+        with trace.phase('execute', workers=self.workers):
+            return self._run(LayerTree(problem, schedule))
+
+    def _run(self, tree):
+        keys = []
+        for layer in range(len(tree)):
+            parent = tree.parent[layer]
+            parent_key = ROOT_KEY if parent is None else keys[parent]
+            keys.append(layer_key(parent_key, tree.command[layer]))
+
+        runs = [LayerRun(l, keys[l], tree.command[l]) for l in range(len(tree))]
+        start = time.time()
+
+        todo = Queue()
+        done = Queue()
+
+        def work():
+            while True:
+                layer = todo.get()
+                if layer is None:
+                    return
+                run = runs[layer]
+                parent = tree.parent[layer]
+                parent_key = ROOT_KEY if parent is None else keys[parent]
+                run.start = time.time() - start
+                try:
+                    self._build(run, parent_key)
+                except Exception, e:
+                    run.error = str(e)
+                run.finish = time.time() - start
+                done.put(layer)
+
+        threads = [Thread(target=work) for _ in range(self.workers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        pending = 0
+        for layer in tree.roots:
+            todo.put(layer)
+            pending += 1
+
+        while pending:
+            layer = done.get()
+            pending -= 1
+            if not runs[layer].ok:
+                continue
+            for child in tree.children[layer]:
+                todo.put(child)
+                pending += 1
+
+        for t in threads:
+            todo.put(None)
+        for t in threads:
+            t.join()
+
+        return Execution(tree, runs, time.time() - start)
+
+    def _build(self, run, parent_key):
+        meta = self.cache.meta(run.key)
+        if meta is not None:
+            run.hit = True
+            run.cached_seconds = meta['seconds']
+            trace.count('cache.hits')
+            return
+
+        trace.count('cache.misses')
+        script = self.script.get(run.command, run.command)
+        meta = self.cache.build(run.key, parent_key, run.command, script, self.shell)
+        run.seconds = meta['seconds']
+        run.returncode = meta['returncode']
@@ -0,0 +1,116 @@
+'''Hierarchical instance families that look like real Docker fleets.
+
+Commands come from four tiers with separate pools: base stacks, language
+runtimes, frameworks and application specific tails. Each base has its
+own runtimes and each runtime its own frameworks, so an image is built
+by walking down that tree:
+
+    base -> runtime -> framework (optional) -> app tail
+
+Within a tier, stacks draw their commands from a shared pool. The
+overlap setting shrinks the pools so stacks share more commands, and
+command popularity in every pool follows a Zipf distribution.
+'''
+from .generate import command_times, sample_commands, stream
+from collections import OrderedDict
+import numpy as np
+
+# Relative time scale of each tier. Base layers install system packages
+# and are slow; application steps are comparatively quick.
+TIER_TIME_SCALE = 2.0, 1.5, 1.0, 0.5
+
+# Curated benchmark families. Each is generated at several image counts.
+FAMILIES = OrderedDict([
+    ('few-stacks', dict(bases=2, runtimes=2, frameworks=2, overlap=0.1)),
+    ('polyglot', dict(bases=4, runtimes=4, frameworks=3, overlap=0.3)),
+    ('monorepo', dict(bases=1, runtimes=2, frameworks=6, overlap=0.6, tail_size=3)),
+    ('long-tail', dict(bases=3, runtimes=3, frameworks=3, tail_size=15, zipf=1.5)),
+    ('dense-overlap', dict(bases=3, runtimes=3, frameworks=4, overlap=0.8, zipf=0.8))
+])
+FAMILY_SIZES = 10, 25, 50, 250, 1000
+
+
+def zipf_weights(n, s):
+    '''Probability of each of n ranked items under a Zipf law with exponent s.'''
+    w = 1.0 / np.arange(1, n+1) ** s
+    return w / w.sum()
+
+
+def _stacks(rng, num_stacks, size, overlap, zipf):
+    '''Returns (ptr, ids, pool size) for num_stacks stacks of size commands.'''
+    pool = max(size, int(np.ceil(num_stacks * size * (1.0 - overlap))))
+    sizes = np.repeat(size, num_stacks)
+    ids = sample_commands(rng, sizes, pool, zipf_weights(pool, zipf))
+    ptr = np.concatenate([[0], np.cumsum(sizes)])
+    return ptr, ids, pool
+
+
+def _gather(ptr, ids, choice):
+    '''Returns (row, command ids) of the stacks chosen for each row.'''
+    lens = ptr[choice+1] - ptr[choice]
+    row = np.repeat(np.arange(len(choice)), lens)
+    offs = np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens)
+    return row, ids[np.repeat(ptr[choice], lens) + offs]
+
+
+def generate_hierarchical(path, num_images, bases=3, runtimes=3, frameworks=4,
+                          stack_sizes=(8, 6, 5), tail_size=6, framework_prob=0.7,
+                          overlap=0.3, zipf=1.1, max_time=100, seed=None):
+    '''Generates a hierarchical DICP instance straight to a file.
+
+    There are bases base stacks, runtimes runtimes per base and frameworks
+    frameworks per runtime, with stack_sizes commands at each of those
+    tiers. An image uses a framework with probability framework_prob and
+    adds a geometric number of app commands with mean tail_size. overlap
+    is in [0, 1) and zipf is the popularity exponent for every choice.'''
+    rng = np.random.RandomState(seed)
+    counts = bases, bases * runtimes, bases * runtimes * frameworks
+
+    # Stacks for each tier, and the offset of each tier's pool in the
+    # overall command numbering.
+    tiers = [_stacks(rng, n, size, overlap, zipf) for n, size in zip(counts, stack_sizes)]
+    app_pool = max(tail_size, int(np.ceil(num_images * tail_size * (1.0 - overlap) / 4.0)))
+    pools = [pool for _, _, pool in tiers] + [app_pool]
+    offsets = np.concatenate([[0], np.cumsum(pools)])
+
+    times = np.concatenate([
+        command_times(rng, pool, max(1, int(max_time * scale)), 'lognormal')
+        for pool, scale in zip(pools, TIER_TIME_SCALE)
+    ])
+
+    # Walk down the tree for each image.
+    base = rng.choice(bases, num_images, p=zipf_weights(bases, zipf))
+    runtime = base * runtimes + rng.choice(runtimes, num_images, p=zipf_weights(runtimes, zipf))
+    framework = runtime * frameworks + rng.choice(frameworks, num_images, p=zipf_weights(frameworks, zipf))
+    framework[rng.random_sample(num_images) >= framework_prob] = -1
+    tails = np.minimum(rng.geometric(1.0 / max(tail_size, 1), num_images), app_pool)
+
+    choices = base, runtime, framework
+    sizes = tails.copy()
+    for (ptr, _, _), choice in zip(tiers, choices):
+        chosen = choice >= 0
+        sizes[chosen] += (ptr[choice[chosen]+1] - ptr[choice[chosen]])
+
+    app_weights = zipf_weights(app_pool, zipf)
+    num_cmds = offsets[-1]
+
+    def sampler(start, stop):
+        rows, ids = [], []
+        for t, ((ptr, stack_ids, _), choice) in enumerate(zip(tiers, choices)):
+            choice = choice[start:stop]
+            chosen = np.flatnonzero(choice >= 0)
+            row, cmds = _gather(ptr, stack_ids, choice[chosen])
+            rows.append(chosen[row])
+            ids.append(cmds + offsets[t])
+
+        tail = tails[start:stop]
+        rows.append(np.repeat(np.arange(stop - start), tail))
+        ids.append(sample_commands(rng, tail, app_pool, app_weights) + offsets[3])
+
+        # Tier pools are disjoint, so sorting by row and command gives each
+        # image's commands in order with no duplicates.
+        keys = np.concatenate(rows).astype(np.int64) * num_cmds + np.concatenate(ids)
+        keys.sort()
+        return keys % num_cmds
+
+    stream(path, times, sizes, sampler)
@@ -0,0 +1,282 @@
+'''Vectorized, seedable generation of large DICP instances.
+
+Instances are produced directly as CSR arrays, a chunk of images at a
+time, and streamed to disk as json or compact files. Only the per-image
+set sizes are held in memory for the whole instance, so memory stays
+bounded no matter how many images are generated. Time grows with the
+number of commands drawn, and images with more than a quarter of the
+commands also draw a random key for every command. A million images
+over 100 commands take a few seconds in either format. Over 1000
+commands they draw about 250M ids and a random key for nearly 500M
+more, which takes 15 to 20 seconds, mostly in the random draws. The
+compact format is the one to use at that size, since the json file
+alone is over 2GB.
+
+Output is fully determined by the seed and the other arguments.
+'''
+from . import compact
+from .problem import Problem
+from collections import OrderedDict
+import numpy as np
+
+TIME_DISTRIBUTIONS = 'exponential', 'uniform', 'lognormal', 'constant'
+SIZE_DISTRIBUTIONS = 'poisson', 'uniform', 'geometric', 'constant'
+
+# Number of command draws made at once when sampling image contents.
+CHUNK_NNZ = 1 << 20
+
+
+def command_times(rng, num_cmds, max_time, dist='exponential'):
+    '''Draws an integer time >= 1 for each command.'''
+    if dist == 'exponential':
+        times = np.ceil(rng.exponential(max_time, num_cmds))
+    elif dist == 'uniform':
+        times = rng.randint(1, max_time + 1, num_cmds)
+    elif dist == 'lognormal':
+        # Median of max_time with a long right tail.
+        times = np.ceil(rng.lognormal(np.log(max_time), 1.0, num_cmds))
+    elif dist == 'constant':
+        times = np.repeat(max_time, num_cmds)
+    else:
+        raise ValueError('unknown time distribution: %s' % dist)
+
+    return np.maximum(times, 1).astype(np.int64)
+
+
+def image_sizes(rng, num_images, num_cmds, mean_size=None, dist='poisson'):
+    '''Draws the number of commands in each image, between 1 and num_cmds.'''
+    if mean_size is None:
+        mean_size = num_cmds / 4.0
+
+    if dist == 'poisson':
+        sizes = rng.poisson(mean_size, num_images)
+    elif dist == 'uniform':
+        sizes = rng.randint(1, int(2 * mean_size) + 1, num_images)
+    elif dist == 'geometric':
+        sizes = rng.geometric(1.0 / max(mean_size, 1.0), num_images)
+    elif dist == 'constant':
+        sizes = np.repeat(int(round(mean_size)), num_images)
+    else:
+        raise ValueError('unknown size distribution: %s' % dist)
+
+    return np.clip(sizes, 1, num_cmds).astype(np.int64)
+
+
+def sample_commands(rng, sizes, num_cmds, weights=None):
+    '''Samples distinct commands for each image without replacement.
+
+    Returns a flat array of command ids, sorted within each image, with
+    sizes[k] ids for image k. Commands are drawn in proportion to weights
+    if it is given, and uniformly otherwise.'''
+    sizes = np.asarray(sizes, dtype=np.int64)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64)
+        weights = weights / weights.sum()
+
+    indices = np.empty(sizes.sum(), dtype=np.int32)
+    starts = np.concatenate([[0], np.cumsum(sizes)])
+
+    # Rejection sampling is fast when images are small relative to the
+    # command pool. Big images draw random keys over the whole pool and
+    # keep the commands with the largest ones.
+    dense = sizes * 4 > num_cmds
+    if dense.any():
+        rows = np.flatnonzero(dense)
+        per_chunk = max(1, CHUNK_NNZ // num_cmds)
+        for a in range(0, len(rows), per_chunk):
+            chunk = rows[a:a+per_chunk]
+            keys = rng.random_sample((len(chunk), num_cmds))
+            if weights is not None:
+                # Efraimidis-Spirakis keys for weighted sampling.
+                with np.errstate(divide='ignore'):
+                    keys = np.log(keys) / weights
+
+            # Keep each row's commands with keys at least its sizes[r]-th
+            # largest. Those thresholds are among the largest sizes.max()
+            # keys of the row, so only they need sorting.
+            size = sizes[chunk]
+            m = size.max()
+            if m < num_cmds:
+                top = np.partition(keys, num_cmds - m, axis=1)[:, num_cmds-m:]
+            else:
+                top = keys.copy()
+            top.sort(axis=1)
+            threshold = top[np.arange(len(chunk)), m - size]
+            keep = keys >= threshold[:, None]
+
+            # Commands come out of flatnonzero in order, row by row. It is
+            # much faster than a two dimensional nonzero.
+            c = np.flatnonzero(keep) % num_cmds
+            counts = np.count_nonzero(keep, axis=1)
+            if (counts == size).all():
+                pos = np.repeat(starts[chunk] - np.cumsum(counts) + counts, counts)
+                indices[pos + np.arange(len(c))] = c
+                continue
+
+            # Tied keys, e.g. from zero weights, need an exact ordering.
+            order = np.argsort(-keys, axis=1, kind='mergesort')
+            for r, k in zip(chunk, order):
+                indices[starts[r]:starts[r+1]] = np.sort(k[:sizes[r]])
+
+    sparse = np.flatnonzero(~dense)
+    if len(sparse):
+        # Sorting row * num_cmds + command orders commands within rows
+        # and puts duplicates next to each other, which are then redrawn.
+        row = np.repeat(np.arange(len(sparse), dtype=np.int64), sizes[sparse])
+        keys = row * num_cmds + _draw(rng, len(row), num_cmds, weights)
+        keys.sort()
+        while True:
+            dup = np.flatnonzero(keys[1:] == keys[:-1]) + 1
+            if not len(dup):
+                break
+            keys[dup] = row[dup] * num_cmds + _draw(rng, len(dup), num_cmds, weights)
+            # Keys are almost sorted after a redraw, which a stable sort
+            # handles several times faster than the default quicksort.
+            keys.sort(kind='mergesort')
+        vals = keys - row * num_cmds
+
+        # Scatter the sorted rows back into their CSR positions.
+        sparse_starts = np.concatenate([[0], np.cumsum(sizes[sparse])])
+        pos = np.arange(len(row)) - sparse_starts[row] + starts[sparse][row]
+        indices[pos] = vals
+
+    return indices
+
+
+def _draw(rng, n, num_cmds, weights):
+    if weights is None:
+        return rng.randint(0, num_cmds, n)
+    return rng.choice(num_cmds, n, p=weights)
+
+
+def _names(n):
+    '''Zero padded names 1..n as a fixed width bytes array.'''
+    width = len(str(n))
+    return np.char.zfill(np.arange(1, n+1).astype('S%d' % width), width), width
+
+
+def chunks(sizes, sampler):
+    '''Yields (first image, command ids) for bounded slices of images.
+
+    sampler(start, stop) must return the flat command ids for images start
+    up to stop, in order, with sizes[k] ids for image k.'''
+    bounds = np.concatenate([[0], np.cumsum(sizes)])
+    start = 0
+    while start < len(sizes):
+        stop = np.searchsorted(bounds, bounds[start] + CHUNK_NNZ, side='right') - 1
+        stop = min(max(stop, start + 1), len(sizes))
+        yield start, sampler(start, stop)
+        start = stop
+
+
+def stream(path, times, sizes, sampler):
+    '''Writes an instance to path, one chunk of images at a time.
+
+    Commands and images are named with zero padded integers. The output
+    is json if path ends with .json and a compact file otherwise.'''
+    if path.endswith('.json'):
+        _stream_json(path, times, sizes, sampler)
+    else:
+        _stream_compact(path, times, sizes, sampler)
+
+
+def _stream_json(path, times, sizes, sampler):
+    cmd_names, width = _names(len(times))
+    img_names, _ = _names(len(sizes))
+
+    # Every command id takes the same number of characters in an image's
+    # list, so a chunk's lists are slices of one fixed width string.
+    entries = np.char.add(np.char.add(b'"', cmd_names), b'", ')
+    step = width + 4
+    bounds = np.concatenate([[0], np.cumsum(sizes)])
+    cmd_names = [n.decode('ascii') for n in cmd_names]
+    img_names = [n.decode('ascii') for n in img_names]
+
+    # Commands that no image uses are dropped, just like Problem does.
+    used = np.zeros(len(times), dtype=bool)
+
+    with open(path, 'w') as fp:
+        fp.write('{\n')
+        fp.write('    "images": {\n')
+        for start, ids in chunks(sizes, sampler):
+            used[ids] = True
+            text = entries[ids].tobytes().decode('ascii')
+            stop = start + np.searchsorted(bounds[start:], bounds[start] + len(ids))
+            offsets = ((bounds[start:stop+1] - bounds[start]) * step).tolist()
+            lines = [
+                '        "%s": [%s],\n' % (img_names[k], text[offsets[n]:offsets[n+1]-2])
+                for n, k in enumerate(range(start, stop))
+            ]
+            if stop == len(sizes):
+                lines[-1] = lines[-1][:-2] + '\n'
+            fp.write(''.join(lines))
+        fp.write('    },\n')
+
+        fp.write('    "commands": {\n')
+        used = np.flatnonzero(used).tolist()
+        for n, j in enumerate(used):
+            end = '\n' if n == len(used) - 1 else ',\n'
+            fp.write('        "%s": %d%s' % (cmd_names[j], times[j], end))
+        fp.write('    }\n')
+        fp.write('}\n')
+
+
+def _stream_compact(path, times, sizes, sampler):
+    cmd_names, cmd_width = _names(len(times))
+    img_names, img_width = _names(len(sizes))
+
+    writer = compact.CompactWriter(path, {
+        'command_names': len(times) * cmd_width,
+        'command_offsets': len(times) + 1,
+        'times': len(times),
+        'image_names': len(sizes) * img_width,
+        'image_offsets': len(sizes) + 1,
+        'indptr': len(sizes) + 1,
+        'indices': sizes.sum()
+    })
+
+    writer.write('command_names', np.frombuffer(cmd_names.tobytes(), dtype=np.uint8))
+    writer.write('command_offsets', np.arange(len(times) + 1) * cmd_width)
+    writer.write('times', times)
+    writer.write('image_names', np.frombuffer(img_names.tobytes(), dtype=np.uint8))
+    writer.write('image_offsets', np.arange(len(sizes) + 1) * img_width)
+    writer.write('indptr', np.concatenate([[0], np.cumsum(sizes)]))
+    for _, ids in chunks(sizes, sampler):
+        writer.write('indices', ids)
+    writer.close()
+
+
+def generate(path, num_images, num_cmds, max_time=100, mean_size=None,
+             times='exponential', sizes='poisson', seed=None):
+    '''Generates a random instance of the DICP straight to a file.
+
+    Each image draws its commands uniformly without replacement, with
+    set sizes and command times from the named distributions.'''
+    rng = np.random.RandomState(seed)
+    cmd_times = command_times(rng, num_cmds, max_time, times)
+    img_sizes = image_sizes(rng, num_images, num_cmds, mean_size, sizes)
+    stream(path, cmd_times, img_sizes, lambda a, b: sample_commands(rng, img_sizes[a:b], num_cmds))
+
+
+def generate_problem(num_images, num_cmds, max_time=100, mean_size=None,
+                     times='exponential', sizes='poisson', seed=None):
+    '''Same as generate, but returns an in-memory Problem.'''
+    rng = np.random.RandomState(seed)
+    cmd_times = command_times(rng, num_cmds, max_time, times)
+    img_sizes = image_sizes(rng, num_images, num_cmds, mean_size, sizes)
+    ids = np.concatenate([
+        c for _, c in chunks(img_sizes, lambda a, b: sample_commands(rng, img_sizes[a:b], num_cmds))
+    ])
+
+    cmd_names, _ = _names(num_cmds)
+    cmd_names = [n.decode('ascii') for n in cmd_names]
+    img_names, _ = _names(num_images)
+    bounds = np.concatenate([[0], np.cumsum(img_sizes)]).tolist()
+
+    commands = OrderedDict(zip(cmd_names, cmd_times.tolist()))
+    names = [cmd_names[j] for j in ids.tolist()]
+    images = OrderedDict(
+        (img.decode('ascii'), names[bounds[k]:bounds[k+1]]) for k, img in enumerate(img_names)
+    )
+
+    return Problem(commands, images)
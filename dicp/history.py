@@ -0,0 +1,226 @@
+'''Measured command durations, kept as running estimates.
+
+A TimingHistory reads build logs one line at a time and keeps, for each
+command, an exponentially weighted moving average of its duration and
+streaming estimates of a few quantiles. Quantiles use the P-square
+algorithm (Jain & Chlamtac, 1985), which tracks each one with five
+markers instead of storing samples, so the index stays small no matter
+how many builds it has seen.
+
+Log lines are either json objects with "command" and "seconds" keys, or
+a command and its duration in seconds separated by a tab. json lines
+marked as cache hits ("hit": true) didn't run their command and are
+skipped, as are lines that can't be read.
+'''
+import json
+import os
+
+HISTORY_VERSION = 1
+DEFAULT_ALPHA = 0.2
+QUANTILES = 0.5, 0.9
+
+
+def _quantile(samples, p):
+    '''Exact quantile of a few sorted samples, by linear interpolation.'''
+    pos = p * (len(samples) - 1)
+    lo = int(pos)
+    hi = min(lo + 1, len(samples) - 1)
+    return samples[lo] + (pos - lo) * (samples[hi] - samples[lo])
+
+
+def _p2_update(q, n, count, p, x):
+    '''Adds observation number count (from 1) to P-square markers q and n.
+
+    q holds marker heights and n their 0-based positions. Until there are
+    five observations, q is just the sorted samples.'''
+    if count <= 5:
+        q[count-1] = x
+        q[:count] = sorted(q[:count])
+        return
+
+    if x < q[0]:
+        q[0] = x
+        k = 0
+    elif x >= q[4]:
+        q[4] = x
+        k = 3
+    else:
+        k = 0
+        while x >= q[k+1]:
+            k += 1
+
+    for i in range(k+1, 5):
+        n[i] += 1
+
+    desired = (0.0, p / 2, p, (1 + p) / 2, 1.0)
+    for i in (1, 2, 3):
+        d = (count - 1) * desired[i] - n[i]
+        if (d >= 1 and n[i+1] - n[i] > 1) or (d <= -1 and n[i-1] - n[i] < -1):
+            d = 1 if d > 0 else -1
+
+            # Piecewise parabolic prediction, or linear if that's not monotone.
+            qi = q[i] + d / float(n[i+1] - n[i-1]) * (
+                (n[i] - n[i-1] + d) * (q[i+1] - q[i]) / float(n[i+1] - n[i]) +
+                (n[i+1] - n[i] - d) * (q[i] - q[i-1]) / float(n[i] - n[i-1])
+            )
+            if not q[i-1] < qi < q[i+1]:
+                qi = q[i] + d * (q[i+d] - q[i]) / float(n[i+d] - n[i])
+
+            q[i] = qi
+            n[i] += d
+
+
+def _p2_estimate(q, n, count, p):
+    '''Quantile p from P-square markers q and n after count observations.
+
+    The middle marker only reaches the quantile's position after the
+    markers have been adjusted a few times, so this interpolates between
+    the markers around where the quantile should be instead.'''
+    pos = (count - 1) * p
+    for i in range(1, 5):
+        if pos <= n[i] or i == 4:
+            if n[i] == n[i-1]:
+                return q[i]
+            f = min(1.0, max(0.0, (pos - n[i-1]) / float(n[i] - n[i-1])))
+            return q[i-1] + f * (q[i] - q[i-1])
+
+
+class TimingHistory(object):
+    '''Running duration estimates per command, stored in a json index.
+
+    Each command's record is a flat list: its observation count, EWMA,
+    then five marker heights and five marker positions per quantile.
+    '''
+
+    def __init__(self, path=None, alpha=DEFAULT_ALPHA, quantiles=QUANTILES):
+        self.path = path
+        self.alpha = alpha
+        self.quantiles = tuple(quantiles)
+        self.records = {}
+
+        if path is not None and os.path.exists(path):
+            with open(path) as fp:
+                data = json.load(fp)
+            if data.get('version') == HISTORY_VERSION:
+                self.alpha = data['alpha']
+                self.quantiles = tuple(data['quantiles'])
+                self.records = data['commands']
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, command):
+        return command in self.records
+
+    def observe(self, command, seconds):
+        '''Adds one measured duration of command.'''
+        rec = self.records.get(command)
+        if rec is None:
+            rec = [0, seconds]
+            for p in self.quantiles:
+                rec.extend([0.0] * 5)
+                rec.extend([0, 1, 2, 3, 4])
+            self.records[command] = rec
+
+        rec[0] += 1
+        rec[1] += self.alpha * (seconds - rec[1])
+        for k, p in enumerate(self.quantiles):
+            start = 2 + 10 * k
+            q = rec[start:start+5]
+            n = rec[start+5:start+10]
+            _p2_update(q, n, rec[0], p, float(seconds))
+            rec[start:start+10] = q + n
+
+    def ingest(self, lines):
+        '''Reads durations from log lines. Returns how many were used.'''
+        used = 0
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+
+            if line.startswith('{'):
+                try:
+                    entry = json.loads(line)
+                    if entry.get('hit'):
+                        continue
+                    command, seconds = entry['command'], float(entry['seconds'])
+                except (ValueError, KeyError, TypeError):
+                    continue
+            else:
+                parts = line.rsplit('\t', 1)
+                if len(parts) != 2:
+                    continue
+                try:
+                    command, seconds = parts[0], float(parts[1])
+                except ValueError:
+                    continue
+
+            if seconds >= 0:
+                self.observe(command, seconds)
+                used += 1
+
+        return used
+
+    def ingest_file(self, path):
+        with open(path) as fp:
+            return self.ingest(fp)
+
+    def count(self, command):
+        rec = self.records.get(command)
+        return 0 if rec is None else rec[0]
+
+    def estimate(self, command, stat='ewma'):
+        '''Returns the estimated duration of command, or None if unseen.
+
+        stat is 'ewma' or a tracked quantile written as 'p50', 'p90', etc.'''
+        rec = self.records.get(command)
+        if rec is None:
+            return None
+        if stat == 'ewma':
+            return rec[1]
+
+        try:
+            k = [int(round(p * 100)) for p in self.quantiles].index(int(stat.lstrip('p')))
+        except ValueError:
+            raise ValueError('unknown statistic: %s' % stat)
+
+        start = 2 + 10 * k
+        if rec[0] <= 5:
+            # The markers are still just the sorted samples.
+            return _quantile(rec[start:start+rec[0]], self.quantiles[k])
+        return _p2_estimate(rec[start:start+5], rec[start+5:start+10], rec[0], self.quantiles[k])
+
+    def times(self, commands=None, stat='ewma', scale=1.0, min_count=1):
+        '''Maps commands to integer times from their estimates.
+
+        Estimates are multiplied by scale, e.g. to go from seconds to the
+        units of an instance. Commands seen fewer than min_count times are
+        left out.'''
+        if commands is None:
+            commands = self.records
+        times = {}
+        for c in commands:
+            if self.count(c) >= max(1, min_count):
+                times[c] = max(1, int(round(self.estimate(c, stat) * scale)))
+        return times
+
+    def apply(self, problem, stat='ewma', scale=1.0, min_count=1):
+        '''Updates problem's command times from the history.
+
+        Returns the number of commands whose times were replaced.'''
+        times = self.times(problem.commands, stat, scale, min_count)
+        problem.update_times(times)
+        return len(times)
+
+    def save(self, path=None):
+        path = path or self.path
+        tmp = '%s.tmp' % path
+        with open(tmp, 'w') as fp:
+            json.dump({
+                'version': HISTORY_VERSION,
+                'alpha': self.alpha,
+                'quantiles': list(self.quantiles),
+                'commands': self.records
+            }, fp, separators=(',', ':'))
+        os.rename(tmp, path)
@@ -0,0 +1,282 @@
+'''Builds a DICP instance from a directory tree of Dockerfiles.
+
+Each Dockerfile becomes an image. The RUN, COPY, ADD and ENV instructions
+of its final build stage are normalized into canonical command keys, so
+the same step written slightly differently in two files is recognized
+as one command. FROM and other instructions are not commands. COPY and
+ADD from the build context also carry the Dockerfile's directory, as
+the same step copies different files in different contexts.
+
+Parsed files are cached by content hash. A cache file also remembers
+each path's size and modification time, so files that haven't changed
+are neither read nor parsed again. Files that do need parsing are spread
+over a process pool when there are enough of them.
+'''
+from .problem import Problem
+from multiprocessing import Pool
+from pipes import quote
+import hashlib
+import json
+import os
+import re
+
+COMMANDS = 'RUN', 'COPY', 'ADD', 'ENV'
+CACHE_VERSION = 3
+
+# Below this many files to parse, a process pool costs more than it saves.
+MIN_POOL_FILES = 64
+
+_DOCKERFILE = re.compile(r'^(Dockerfile(\..+)?|.+\.[Dd]ockerfile)$')
+
+
+def is_dockerfile(name):
+    return bool(_DOCKERFILE.match(name))
+
+
+def find_dockerfiles(root):
+    '''Returns sorted paths of Dockerfiles under root, skipping dot dirs.'''
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for name in filenames:
+            if is_dockerfile(name):
+                paths.append(os.path.join(dirpath, name))
+    return sorted(paths)
+
+
+def _lines(text):
+    '''Yields logical lines, joining continuations and dropping comments.'''
+    current = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            # Comments and blank lines don't end a continued instruction.
+            continue
+        if stripped.endswith('\\'):
+            current.append(stripped[:-1].strip())
+            continue
+        current.append(stripped)
+        yield ' '.join(p for p in current if p)
+        current = []
+    if current:
+        yield ' '.join(p for p in current if p)
+
+
+def _words(args):
+    '''Splits args on whitespace outside quotes, keeping quotes and escapes.'''
+    words = []
+    word = []
+    quoted = None
+    escaped = False
+    for ch in args:
+        if escaped:
+            escaped = False
+        elif ch == '\\' and quoted != "'":
+            escaped = True
+        elif quoted:
+            if ch == quoted:
+                quoted = None
+        elif ch in '"\'':
+            quoted = ch
+        elif ch.isspace():
+            if word:
+                words.append(''.join(word))
+                word = []
+            continue
+        word.append(ch)
+    if word:
+        words.append(''.join(word))
+    return words
+
+
+def _exec_form(args):
+    '''Returns a json exec form like ["a", "b"] in canonical json, or None.
+
+    Exec form keeps its arguments apart, so it is never the same command
+    as a shell form with the same words.'''
+    if not args.startswith('['):
+        return None
+    try:
+        parts = json.loads(args)
+    except ValueError:
+        return None
+    if not isinstance(parts, list) or not all(isinstance(p, type(u'')) for p in parts):
+        return None
+    return json.dumps(parts)
+
+
+def _env(args):
+    '''Normalizes both ENV forms to space separated key=value pairs.'''
+    words = _words(args)
+    if words and '=' not in words[0]:
+        # Legacy form: ENV key value with spaces
+        rest = args.split(None, 1)[1:]
+        value = ' '.join(_words(rest[0])) if rest else ''
+        return '%s=%s' % (words[0], quote(value))
+    return ' '.join(words)
+
+
+def normalize(instruction, args):
+    '''Returns the canonical command key for an instruction.
+
+    Whitespace is collapsed outside of quotes only, and quotes are kept,
+    so steps that differ in what they run get different keys.'''
+    instruction = instruction.upper()
+    if instruction == 'ENV':
+        args = _env(args)
+    else:
+        args = _exec_form(args) or ' '.join(_words(args))
+    return '%s %s' % (instruction, args)
+
+
+def parse(text):
+    '''Returns canonical command keys for the final stage of a Dockerfile.'''
+    commands = []
+    for line in _lines(text):
+        parts = line.split(None, 1)
+        instruction = parts[0].upper()
+        args = parts[1] if len(parts) > 1 else ''
+
+        if instruction == 'FROM':
+            commands = []  # a new build stage
+        elif instruction in COMMANDS:
+            commands.append(normalize(instruction, args))
+
+    # An image only runs each distinct command once.
+    seen = set()
+    return [c for c in commands if not (c in seen or seen.add(c))]
+
+
+def _reads_context(command):
+    '''True if a COPY or ADD key copies files from the build context.'''
+    instruction, _, args = command.partition(' ')
+    if instruction not in ('COPY', 'ADD'):
+        return False
+
+    words = json.loads(args) if args.startswith('[') else _words(args)
+    if any(w.startswith('--from') for w in words):
+        return False  # copies from another stage or image
+    sources = [w for w in words if not w.startswith('--')][:-1]
+    return not all(re.match(r'^[a-z]+://', s) for s in sources)
+
+
+def in_context(commands, context):
+    '''Suffixes COPY and ADD keys that read the build context with it.'''
+    return [
+        '%s @%s' % (c, context) if _reads_context(c) else c
+        for c in commands
+    ]
+
+
+def _context(root, path):
+    '''Directory of a Dockerfile relative to root, with / separators.'''
+    return os.path.relpath(os.path.dirname(path), root).replace(os.sep, '/')
+
+
+def _parse_file(path):
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    digest = hashlib.sha1(data).hexdigest()
+    return path, digest, parse(data.decode('utf-8', 'replace'))
+
+
+class ParseCache(object):
+    '''Parsed commands keyed by content hash, plus a stat index by path'''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.files = {}   # path -> [size, mtime, digest]
+        self.parsed = {}  # digest -> commands
+
+        if path is not None and os.path.exists(path):
+            with open(path) as fp:
+                data = json.load(fp)
+            if data.get('version') == CACHE_VERSION:
+                self.files = data['files']
+                self.parsed = data['parsed']
+
+    def lookup(self, path):
+        '''Returns cached commands for path if it hasn't changed, or None.'''
+        entry = self.files.get(path)
+        if entry is None:
+            return None
+        st = os.stat(path)
+        if [st.st_size, st.st_mtime] != entry[:2]:
+            return None
+        return self.parsed.get(entry[2])
+
+    def store(self, path, digest, commands):
+        st = os.stat(path)
+        self.files[path] = [st.st_size, st.st_mtime, digest]
+        self.parsed[digest] = commands
+
+    def save(self, paths):
+        '''Writes the cache, keeping only entries for paths.'''
+        if self.path is None:
+            return
+        files = {p: self.files[p] for p in paths if p in self.files}
+        digests = set(entry[2] for entry in files.values())
+        parsed = {d: c for d, c in self.parsed.items() if d in digests}
+
+        tmp = '%s.tmp' % self.path
+        with open(tmp, 'w') as fp:
+            json.dump({'version': CACHE_VERSION, 'files': files, 'parsed': parsed}, fp)
+        os.rename(tmp, self.path)
+
+
+def parse_tree(root, cache=None, processes=None):
+    '''Maps each Dockerfile path under root to its canonical commands.
+
+    Parses are cached by content alone, so the build context is added to
+    COPY and ADD keys after looking them up.'''
+    if not isinstance(cache, ParseCache):
+        cache = ParseCache(cache)
+
+    paths = find_dockerfiles(root)
+    result = {}
+    todo = []
+    for path in paths:
+        commands = cache.lookup(path)
+        if commands is None:
+            todo.append(path)
+        else:
+            result[path] = in_context(commands, _context(root, path))
+
+    if len(todo) >= MIN_POOL_FILES and processes != 1:
+        pool = Pool(processes)
+        try:
+            parsed = pool.map(_parse_file, todo, chunksize=16)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        parsed = [_parse_file(path) for path in todo]
+
+    for path, digest, commands in parsed:
+        cache.store(path, digest, commands)
+        result[path] = in_context(commands, _context(root, path))
+
+    if todo:
+        cache.save(paths)
+    return result
+
+
+def ingest(root, cache=None, times=None, default_time=1, processes=None):
+    '''Builds a Problem from the Dockerfiles under root.
+
+    Images are named by their path relative to root. times maps command
+    keys to durations, e.g. from a timing history; commands it doesn't
+    know take default_time.'''
+    parsed = parse_tree(root, cache, processes)
+    times = times or {}
+
+    images = {}
+    commands = {}
+    for path, cmds in parsed.items():
+        if not cmds:
+            continue
+        images[os.path.relpath(path, root)] = cmds
+        for c in cmds:
+            commands[c] = times.get(c, default_time)
+
+    return Problem(commands, images)
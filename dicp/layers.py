@@ -0,0 +1,126 @@
+def split(schedule, nodes):
+    '''Splits a schedule by the build node each image is assigned to.
+
+    Returns a dict of node to the schedule of images built there.'''
+    parts = {}
+    for img, cmds in schedule.items():
+        parts.setdefault(nodes[img], {})[img] = cmds
+    return parts
+
+
+class LayerTree(object):
+    '''Prefix tree of the layers a schedule builds.
+
+    Every distinct command prefix in the schedule is a layer, numbered in
+    the order they are first seen, so a layer's parent always has a
+    smaller number. Layers are stored in parallel lists:
+
+        parent[l]    parent layer, or None for a first command
+        command[l]   the command that builds the layer
+        time[l]      the time that command takes, or 0 if the layer is cached
+        children[l]  layers directly on top of this one
+        weight[l]    rebuild weight of the heaviest image using the layer
+        change[l]    probability the layer's command changes in a commit
+        size[l]      bytes the layer takes on disk
+
+    images maps each image to the layers it runs, in order. cache is an
+    optional WarmCache of layers that are already built.
+    '''
+
+    def __init__(self, problem, schedule, cache=None):
+        self.parent = []
+        self.command = []
+        self.time = []
+        self.children = []
+        self.weight = []
+        self.change = []
+        self.size = []
+        self.roots = []
+        self.images = {}
+
+        index = {}  # (parent, command) -> layer
+        weights = getattr(problem, 'weights', {})
+        changes = getattr(problem, 'changes', {})
+        sizes = getattr(problem, 'sizes', {})
+        for img, cmds in sorted(schedule.items()):
+            w = weights.get(img, 1)
+            path = []
+            parent = None
+            for k, c in enumerate(cmds):
+                layer = index.get((parent, c))
+                if layer is None:
+                    layer = index[parent, c] = len(self.parent)
+                    self.parent.append(parent)
+                    self.command.append(c)
+                    if cache is not None and cmds[:k+1] in cache:
+                        self.time.append(0)
+                    else:
+                        self.time.append(problem.commands[c])
+                    self.children.append([])
+                    self.weight.append(w)
+                    self.change.append(changes.get(c, 0.0))
+                    self.size.append(sizes.get(c, 0))
+                    if parent is None:
+                        self.roots.append(layer)
+                    else:
+                        self.children[parent].append(layer)
+                elif self.weight[layer] < w:
+                    self.weight[layer] = w
+                path.append(layer)
+                parent = layer
+            self.images[img] = path
+
+    def __len__(self):
+        return len(self.parent)
+
+    @property
+    def total_time(self):
+        '''Time to build every layer once.'''
+        return sum(self.time)
+
+    @property
+    def weighted_time(self):
+        '''Time to rebuild every layer as often as its images are rebuilt.'''
+        return sum(t * w for t, w in zip(self.time, self.weight))
+
+    @property
+    def storage(self):
+        '''Bytes needed to keep every layer cached.'''
+        return sum(self.size)
+
+    def rebuild_probabilities(self):
+        '''Probability each layer is invalidated by a commit.
+
+        Commands change independently, and a change invalidates the layer
+        that runs the command and every layer above it.'''
+        keep = []
+        for layer in range(len(self)):
+            k = 1.0 - self.change[layer]
+            p = self.parent[layer]
+            if p is not None:
+                k *= keep[p]
+            keep.append(k)
+        return [1.0 - k for k in keep]
+
+    def expected_rebuild_time(self):
+        '''Expected weighted time to rebuild invalidated layers after a commit.'''
+        return sum(
+            t * w * r for t, w, r in zip(self.time, self.weight, self.rebuild_probabilities())
+        )
+
+    def prefix(self, layer):
+        '''Returns the commands that build layer, from the bottom up.'''
+        cmds = []
+        while layer is not None:
+            cmds.append(self.command[layer])
+            layer = self.parent[layer]
+        return cmds[::-1]
+
+    def bottom_levels(self):
+        '''Longest time from the start of each layer to the end of a leaf.'''
+        level = list(self.time)
+        for layer in reversed(range(len(self))):
+            p = self.parent[layer]
+            if p is not None:
+                level[p] = max(level[p], self.time[p] + level[layer])
+        return level
@@ -0,0 +1,116 @@
+'''Sequencing image builds for builders with a finite LRU layer cache.
+
+A schedule says which layers images share, but a builder only reuses a
+shared layer if it is still cached when the next image that needs it is
+built. Builders evict the least recently used layers once their cache is
+full, so the order images are built in decides how often shared layers
+have to be built again.
+
+sequence() orders builds by a depth first traversal of the schedule's
+prefix tree, so images sharing long prefixes are built back to back and
+a subtree's layers are never needed again once it has been left.
+LRUSimulation replays a build order against an LRU cache and counts
+hits, misses and the time spent rebuilding evicted layers.
+'''
+from .layers import LayerTree
+from collections import OrderedDict
+
+
+def sequence(problem, schedule, tree=None):
+    '''Returns images in depth first order of the schedule's prefix tree.
+
+    Children are visited heaviest subtree first. Images with no commands
+    come first.'''
+    tree = tree or LayerTree(problem, schedule)
+
+    ends = [[] for _ in range(len(tree))]
+    order = []
+    for img, path in sorted(tree.images.items()):
+        if path:
+            ends[path[-1]].append(img)
+        else:
+            order.append(img)
+
+    # Total build time of each layer's subtree.
+    weight = list(tree.time)
+    for layer in reversed(range(len(tree))):
+        p = tree.parent[layer]
+        if p is not None:
+            weight[p] += weight[layer]
+
+    heaviest = lambda layers: sorted(layers, key=lambda l: (-weight[l], l))
+    stack = heaviest(tree.roots)[::-1]
+    while stack:
+        layer = stack.pop()
+        order.extend(ends[layer])
+        stack.extend(heaviest(tree.children[layer])[::-1])
+
+    return order
+
+
+class LRUSimulation(object):
+    '''Builds images in order on a builder with an LRU layer cache.
+
+    capacity is counted in layers, or in bytes of layer output if units is
+    'bytes'. Building an image walks its layers from the bottom up. A
+    cached layer is a hit and becomes most recently used. Once a layer
+    misses, it and every layer above it in the image are built again,
+    since Docker only reuses a layer on top of the exact parent it was
+    built on. A miss on a layer built earlier in the sequence is a rebuild
+    caused by eviction.
+    '''
+
+    def __init__(self, problem, schedule, order, capacity, units='layers', tree=None):
+        if units not in ('layers', 'bytes'):
+            raise ValueError('units must be layers or bytes')
+
+        self.tree = tree = tree or LayerTree(problem, schedule)
+        self.capacity = capacity
+        self.units = units
+
+        size = tree.size if units == 'bytes' else [1] * len(tree)
+        cache = OrderedDict()  # layer -> None, least recently used first
+        built = set()
+        used = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.build_time = 0      # time spent running commands
+        self.recompute_time = 0  # part of that spent on evicted layers
+        self.evictions = 0
+
+        for img in order:
+            missed = False
+            for layer in tree.images[img]:
+                if not missed and layer in cache:
+                    self.hits += 1
+                    del cache[layer]
+                    cache[layer] = None
+                    continue
+
+                missed = True
+                self.misses += 1
+                self.build_time += tree.time[layer]
+                if layer in built:
+                    self.rebuilds += 1
+                    self.recompute_time += tree.time[layer]
+                built.add(layer)
+
+                if layer in cache:
+                    # Rebuilt on top of a rebuilt parent: replaces the old copy.
+                    del cache[layer]
+                    used -= size[layer]
+
+                while cache and used + size[layer] > capacity:
+                    evicted, _ = cache.popitem(last=False)
+                    used -= size[evicted]
+                    self.evictions += 1
+
+                if size[layer] <= capacity:
+                    cache[layer] = None
+                    used += size[layer]
+
+    def stats(self):
+        '''Returns (hits, misses, time spent rebuilding evicted layers).'''
+        return self.hits, self.misses, self.recompute_time
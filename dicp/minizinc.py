@@ -0,0 +1,199 @@
+'''Exporting problems as MiniZinc models and reading back CP solutions.
+
+Each image k gets an array xk of command indexes, its build order. For
+each pair of images that share commands, yj_k[s] is true if images j and
+k run the same first s commands. An image's layer at stage s is free if
+it shares that prefix with an image earlier in the model, so the model
+maximizes the time saved that way and compute time is the total time of
+every image's commands less what is saved. Images are numbered by
+descending rebuild weight, so a shared layer is always charged at the
+weight of the first image that builds it and the objective is exact for
+weighted problems too.
+
+To help search, the model also:
+
+    * Fixes commands no other image runs to the end of their image, in
+      command order. Building them earlier only ends shared prefixes.
+    * Gives images with the same commands and weight the same order.
+    * States that shared prefixes only grow by shared commands and that
+      a prefix shared at stage s is shared at every stage below it.
+
+MiniZinc flattens the model for a particular solver, so FlatZinc output
+comes from running `minizinc -c` on the exported file. Solver output is
+read back as a Solution, so CP solvers can be compared with the solvers
+in dicp.solvers.
+'''
+from .solution import Solution
+from datetime import timedelta
+import re
+
+SOLUTION_SEPARATOR = '----------'
+UNSATISFIABLE = '=====UNSATISFIABLE====='
+ELAPSED = re.compile(r'^%\s*time elapsed:\s*([0-9.]+)\s*s')
+ASSIGNMENT = re.compile(r'^x(\d+)\s*=\s*\[([^\]]*)\]')
+
+
+class MiniZincModel(object):
+    '''A problem numbered for export to MiniZinc.
+
+    The same problem always gets the same numbering, so solver output for
+    a model exported earlier can be read with a new MiniZincModel.
+    '''
+
+    def __init__(self, problem):
+        self.problem = problem
+        weight = problem.weights
+        self.images = sorted(problem.images, key=lambda i: (-weight.get(i, 1), i))
+        self.commands = sorted(problem.commands)
+        self.command_index = {c: k for k, c in enumerate(self.commands, 1)}
+
+        users = {}
+        for img, cmds in problem.images.items():
+            for c in cmds:
+                users[c] = users.get(c, 0) + 1
+
+        # Commands no other image runs go last, so they aren't ordered.
+        self.private = {
+            img: sorted(c for c in cmds if users[c] == 1) for img, cmds in problem.images.items()
+        }
+
+    def _values(self):
+        '''Returns the MiniZinc number type and a formatter for values.'''
+        values = list(self.problem.commands.values()) + list(self.problem.weights.values())
+        if all(float(v).is_integer() for v in values):
+            return 'int', lambda v: '%d' % v
+        return 'float', lambda v: repr(float(v))
+
+    def write(self, fp):
+        '''Writes the model to the open file fp, one declaration at a time.'''
+        problem = self.problem
+        num, fmt = self._values()
+        cmd = self.command_index
+
+        fp.write('include "all_different.mzn";\n\n')
+        fp.write('array[1..%d] of %s: t = [%s];\n\n' % (
+            len(self.commands), num, ', '.join(fmt(problem.commands[c]) for c in self.commands)
+        ))
+
+        cmd_sets = [frozenset(problem.images[img]) for img in self.images]
+        total = 0
+        for k, img in enumerate(self.images, 1):
+            cmds = problem.images[img]
+            total += problem.weights.get(img, 1) * sum(problem.commands[c] for c in cmds)
+
+            fp.write('array[1..%d] of var {%s}: x%d;\n' % (
+                len(cmds), ', '.join(str(cmd[c]) for c in sorted(cmds, key=cmd.get)), k
+            ))
+            fp.write('constraint all_different(x%d);\n' % k)
+            private = self.private[img]
+            for s, c in enumerate(private, len(cmds) - len(private) + 1):
+                fp.write('constraint x%d[%d] = %d;\n' % (k, s, cmd[c]))
+
+        fp.write('\n')
+        saved = []
+        for k, img in enumerate(self.images, 1):
+            weight = problem.weights.get(img, 1)
+            prefixes = []  # (partner, length of longest possible shared prefix)
+
+            for j in range(1, k):
+                other = self.images[j-1]
+                shared = cmd_sets[j-1] & cmd_sets[k-1]
+                if not shared:
+                    continue
+
+                if cmd_sets[j-1] == cmd_sets[k-1] and problem.weights.get(other, 1) == weight:
+                    fp.write('constraint x%d = x%d;\n' % (j, k))
+
+                l = len(shared)
+                y = 'y%d_%d' % (j, k)
+                fp.write('array[1..%d] of var bool: %s;\n' % (l, y))
+                fp.write('constraint %s[1] = (x%d[1] == x%d[1]);\n' % (y, j, k))
+                if l > 1:
+                    fp.write('constraint forall(s in 2..%d)(%s[s] = (%s[s-1] /\\ x%d[s] == x%d[s]));\n' % (
+                        l, y, y, j, k
+                    ))
+                fp.write('constraint forall(s in 1..%d)(%s[s] -> x%d[s] in {%s});\n' % (
+                    l, y, k, ', '.join(str(cmd[c]) for c in sorted(shared, key=cmd.get))
+                ))
+                prefixes.append((j, l))
+
+            if not prefixes:
+                continue
+
+            # rk[s] is true if image k shares its first s commands with an
+            # earlier image, so its layer at stage s is already built.
+            r = 'r%d' % k
+            depth = max(l for _, l in prefixes)
+            fp.write('array[1..%d] of var bool: %s;\n' % (depth, r))
+            for s in range(1, depth + 1):
+                fp.write('constraint %s[%d] = (%s);\n' % (
+                    r, s, ' \\/ '.join('y%d_%d[%d]' % (j, k, s) for j, l in prefixes if l >= s)
+                ))
+            if depth > 1:
+                fp.write('constraint forall(s in 2..%d)(%s[s] -> %s[s-1]);\n' % (depth, r, r))
+
+            term = 'sum(s in 1..%d)(t[x%d[s]] * bool2%s(%s[s]))' % (depth, k, num, r)
+            if weight != 1:
+                term = '%s * %s' % (fmt(weight), term)
+            saved.append(term)
+            fp.write('\n')
+
+        fp.write('var %s: saved = %s;\n' % (num, '\n    + '.join(saved) if saved else fmt(0)))
+        fp.write('%s: total = %s;\n' % (num, fmt(total)))
+        fp.write('solve maximize saved;\n\n')
+
+        shows = ['"z = ", show(total - saved), "\\n"']
+        shows.extend('"x%d = ", show(x%d), "\\n"' % (k, k) for k in range(1, len(self.images) + 1))
+        fp.write('output [\n    %s\n];\n' % ',\n    '.join(shows))
+
+    def save(self, path):
+        with open(path, 'w') as fp:
+            self.write(fp)
+
+    def schedule(self, lines):
+        '''Reads the last solution in MiniZinc output as a schedule.
+
+        Returns (schedule, elapsed seconds or None), or (None, elapsed) if
+        the output has no solution.'''
+        last, current = None, {}
+        elapsed = None
+        for line in lines:
+            line = line.strip()
+            if line == UNSATISFIABLE:
+                raise ValueError('model is unsatisfiable')
+
+            match = ELAPSED.match(line)
+            if match:
+                elapsed = float(match.group(1))
+                continue
+
+            if line == SOLUTION_SEPARATOR:
+                last, current = current, {}
+                continue
+
+            match = ASSIGNMENT.match(line)
+            if match:
+                values = match.group(2).split(',')
+                current[int(match.group(1))] = [self.commands[int(v) - 1] for v in values if v.strip()]
+
+        if not last:
+            return None, elapsed
+
+        schedule = {}
+        for k, img in enumerate(self.images, 1):
+            if k not in last:
+                raise ValueError('no order for image %s (x%d)' % (img, k))
+            schedule[img] = last[k]
+        return schedule, elapsed
+
+    def solution(self, path, elapsed=None):
+        '''Returns the last solution in a MiniZinc output file, or None.
+
+        elapsed defaults to the time MiniZinc reports with --output-time.'''
+        with open(path) as fp:
+            schedule, reported = self.schedule(fp)
+        if schedule is None:
+            return None
+        if elapsed is None:
+            elapsed = reported if reported is not None else 0.0
+        return Solution(self.problem, schedule, timedelta(seconds=elapsed))
@@ -0,0 +1,102 @@
+from .layers import LayerTree, split
+from .simulate import Simulation
+
+
+class Objective(object):
+    '''Scores schedules for the solvers. Lower is better.
+
+    By default the score is total compute time, weighted by how often
+    images are rebuilt. With incremental set, it is instead the expected
+    time to rebuild after a commit, given how often each command changes.
+    Given a number of parallel workers, it becomes a weighted mix of
+    compute time and the makespan of a list-scheduled build on that many
+    workers:
+
+        (1 - makespan_weight) * compute + makespan_weight * makespan
+
+    makespan_weight defaults to 1 when workers is given. If builders hold
+    a WarmCache, its layers take no time and the cache's churn penalty is
+    added for every image whose order changes.
+
+    storage_weight adds that much per byte of cached layers to the score.
+    Given a budget in bytes, scores become (bytes over budget, score)
+    pairs, so any schedule that fits beats every one that doesn't.
+
+    If nodes maps images to build nodes that don't share a cache, each
+    node builds its own layers, and compute time is summed over nodes.
+    balance then mixes in the load of the busiest node:
+
+        (1 - balance) * compute + balance * # of nodes * max node compute
+
+    and the makespan is that of the slowest node, each node having the
+    given number of workers.
+    '''
+
+    def __init__(self, workers=None, makespan_weight=None, incremental=False,
+                 budget=None, storage_weight=None, cache=None, nodes=None, balance=0):
+        self.workers = int(workers) if workers is not None else None
+        if makespan_weight is None:
+            makespan_weight = 1.0 if workers is not None else 0.0
+        self.makespan_weight = float(makespan_weight)
+        self.incremental = bool(incremental)
+        self.budget = float(budget) if budget is not None else None
+        self.storage_weight = float(storage_weight or 0)
+        self.cache = cache
+        self.nodes = nodes
+        self.balance = float(balance)
+
+        if self.makespan_weight and self.workers is None:
+            raise ValueError('makespan objective needs a number of workers')
+        if not 0.0 <= self.makespan_weight <= 1.0:
+            raise ValueError('makespan_weight must be in [0, 1]')
+
+    @property
+    def compute_only(self):
+        '''True if the score is plain compute time.'''
+        return not (
+            self.makespan_weight or self.incremental or self.cache is not None or
+            self.storage_aware or self.nodes is not None
+        )
+
+    @property
+    def storage_aware(self):
+        '''True if the score depends on how much disk layers take.'''
+        return self.budget is not None or bool(self.storage_weight)
+
+    def __call__(self, problem, schedule):
+        if self.nodes is None:
+            parts = [schedule]
+        else:
+            parts = split(schedule, self.nodes).values()
+        trees = [LayerTree(problem, part, self.cache) for part in parts]
+
+        if self.incremental:
+            loads = [tree.expected_rebuild_time() for tree in trees]
+        else:
+            loads = [tree.weighted_time for tree in trees]
+        compute = sum(loads)
+        if self.balance and loads:
+            compute = (1 - self.balance) * compute + self.balance * len(loads) * max(loads)
+
+        churn = 0
+        if self.cache is not None:
+            churn = self.cache.penalty(schedule)
+
+        w = self.makespan_weight
+        if w:
+            makespan = max(
+                Simulation(problem, part, self.workers, tree).makespan
+                for part, tree in zip(parts, trees)
+            )
+            score = (1 - w) * compute + w * makespan + churn
+        else:
+            score = compute + churn
+
+        if not self.storage_aware:
+            return score
+
+        storage = sum(tree.storage for tree in trees)
+        score += self.storage_weight * storage
+        if self.budget is None:
+            return score
+        return max(0, storage - self.budget), score
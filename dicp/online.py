@@ -0,0 +1,201 @@
+'''Online scheduling of images that arrive one at a time.
+
+The offline solvers see every image before ordering any of them. In CI,
+build requests arrive over time and images that are already built can't
+be reordered. OnlineScheduler keeps the layer trie of everything built
+so far and orders each new image as it arrives:
+
+    1. Follow the existing trie as far as the image's commands allow,
+       taking the path that reuses the most command time.
+    2. Order the commands that have to be built anyway so that the ones
+       future images are most likely to share come first. How likely a
+       command is to be shared is estimated from how often it appeared
+       in images seen so far.
+
+Each request costs a walk over the part of the trie the image can reuse
+plus a sort of its new commands, so answers take well under a millisecond
+for typical images.
+
+replay feeds an arrival trace through a scheduler, so online schedules
+can be compared against the offline solvers on the same instance.
+'''
+from timeit import default_timer as clock
+import json
+import random
+
+ROOT = 0
+
+
+class OnlineScheduler(object):
+    '''Orders arriving images against the layer trie of earlier ones.
+
+    times maps commands to their durations. Commands it doesn't know are
+    given default_time, and a problem's commands can be passed directly.
+    '''
+
+    def __init__(self, times=None, default_time=1):
+        self.times = dict(times or {})
+        self.default_time = default_time
+        self.children = [{}]    # node -> {command: child node}
+        self.command = [None]   # node -> command that built it
+        self.seen = {}          # command -> number of images that ran it
+        self.images = 0
+        self.built_time = 0     # time spent building new layers
+        self.reused_time = 0    # time saved by reusing layers
+
+    def __len__(self):
+        '''Number of layers built so far.'''
+        return len(self.command) - 1
+
+    def time(self, c):
+        return self.times.get(c, self.default_time)
+
+    def schedule(self, cmds):
+        '''Returns the order to build an image with commands cmds in.
+
+        The image's layers are added to the trie, so later images can
+        reuse them.'''
+        remaining = set(cmds)
+        path, reused = self._reuse(remaining)
+        order = [self.command[n] for n in path]
+        remaining.difference_update(order)
+
+        # New commands run most widely shared first. Ties go to longer
+        # commands, then by name so orders are deterministic.
+        self.images += 1
+        for c in cmds:
+            self.seen[c] = self.seen.get(c, 0) + 1
+        tail = sorted(remaining, key=lambda c: (-self.seen[c] * self.time(c), -self.time(c), c))
+
+        node = path[-1] if path else ROOT
+        for c in tail:
+            child = len(self.command)
+            self.children[node][c] = child
+            self.children.append({})
+            self.command.append(c)
+            node = child
+            self.built_time += self.time(c)
+        self.reused_time += reused
+
+        return order + tail
+
+    def _reuse(self, cmds):
+        '''Returns the trie path through cmds reusing the most time.'''
+        best_path, best_time = [], 0
+
+        # Depth first over the part of the trie the image can use.
+        stack = [(ROOT, [], 0)]
+        while stack:
+            node, path, total = stack.pop()
+            if total > best_time or (total == best_time and len(path) > len(best_path)):
+                best_path, best_time = path, total
+            children = self.children[node]
+            if len(children) <= len(cmds):
+                steps = [(c, n) for c, n in children.items() if c in cmds]
+            else:
+                steps = [(c, children[c]) for c in cmds if c in children]
+            for c, child in steps:
+                stack.append((child, path + [child], total + self.time(c)))
+
+        return best_path, best_time
+
+    def to_dict(self):
+        return {
+            'times': self.times,
+            'default_time': self.default_time,
+            'command': self.command,
+            'parent': self._parents(),
+            'seen': self.seen,
+            'images': self.images,
+            'built_time': self.built_time,
+            'reused_time': self.reused_time
+        }
+
+    def _parents(self):
+        parent = [None] * len(self.command)
+        for node, children in enumerate(self.children):
+            for child in children.values():
+                parent[child] = node
+        return parent
+
+    def save(self, path):
+        '''Saves the scheduler's state so a later process can resume it.'''
+        with open(path, 'w') as fp:
+            json.dump(self.to_dict(), fp)
+
+    @staticmethod
+    def load(path):
+        with open(path) as fp:
+            data = json.load(fp)
+
+        sched = OnlineScheduler(data['times'], data['default_time'])
+        sched.command = data['command']
+        sched.children = [{} for _ in sched.command]
+        for node, parent in enumerate(data['parent']):
+            if parent is not None:
+                sched.children[parent][sched.command[node]] = node
+        sched.seen = data['seen']
+        sched.images = data['images']
+        sched.built_time = data['built_time']
+        sched.reused_time = data['reused_time']
+        return sched
+
+
+def load_trace(path):
+    '''Reads image names in arrival order from a trace file.
+
+    Lines are either image names or json objects with an "image" key and
+    optionally an arrival "time", by which they are sorted.'''
+    arrivals = []
+    with open(path) as fp:
+        for n, line in enumerate(fp):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                entry = json.loads(line)
+                arrivals.append((entry.get('time', n), n, entry['image']))
+            else:
+                arrivals.append((n, n, line))
+    return [img for _, _, img in sorted(arrivals)]
+
+
+def random_trace(problem, seed=None):
+    '''Returns the problem's images in a random arrival order.'''
+    images = list(problem.images)
+    random.Random(seed).shuffle(images)
+    return images
+
+
+class Replay(object):
+    '''Result of replaying an arrival trace through an online scheduler'''
+
+    def __init__(self, schedule, latencies, scheduler):
+        self.schedule = schedule
+        self.latencies = latencies  # seconds per request
+        self.scheduler = scheduler
+
+    def latency(self, q):
+        '''Returns the q quantile of request latency in seconds.'''
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def replay(problem, arrivals, scheduler=None):
+    '''Schedules problem's images online in the order of arrivals.
+
+    A scheduler resumed from earlier requests can be passed in; otherwise
+    replay starts from an empty trie.'''
+    if scheduler is None:
+        scheduler = OnlineScheduler(problem.commands)
+
+    schedule = {}
+    latencies = []
+    for img in arrivals:
+        start = clock()
+        schedule[img] = scheduler.schedule(problem.images[img])
+        latencies.append(clock() - start)
+
+    return Replay(schedule, latencies, scheduler)
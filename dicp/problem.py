@@ -1,52 +1,64 @@
+from . import trace
 from collections import OrderedDict, defaultdict
 from itertools import combinations
-from igraph import Graph
 from operator import itemgetter
 import json
-import math
-import numpy as np
-import random
 
-class Problem(object):
-    @staticmethod
-    def generate(num_images, num_cmds, max_time):
-        '''Generates a random instance of the DICP.'''
-        img_fmt = '%%0%sd' % len(str(num_images))
-        cmd_fmt = '%%0%sd' % len(str(num_cmds))
+# Compact instances start with this. Checking for it here means loading
+# json instances doesn't need NumPy.
+MAGIC = b'DICPBIN1'
+
 
-        # Each command has an expected amount of time it will take to execute.
-        commands = {
-            cmd_fmt % c: int(math.ceil(np.random.exponential(max_time)))
-            for c in range(1, num_cmds+1)
-        }
+def is_compact(path):
+    '''Returns True if path holds a compact instance.'''
+    with open(path, 'rb') as fp:
+        return fp.read(len(MAGIC)) == MAGIC
 
-        # Each image is comprised of the commands required to construct it.
-        images = {}
-        for i in range(1, num_images+1):
-            size = np.random.poisson(num_cmds/4)
-            images[img_fmt % i] = list(sorted(random.sample(commands, size)))
 
-        return Problem(commands, images)
+class Problem(object):
+    @staticmethod
+    def generate(num_images, num_cmds, max_time, seed=None):
+        '''Generates a random instance of the DICP.'''
+        from .generate import generate_problem
+        return generate_problem(num_images, num_cmds, max_time, seed=seed)
 
     @staticmethod
     def load(path):
-        '''Loads an instance of the DICP from a json file.'''
-        p = json.load(open(path))
-        return Problem(p['commands'], p['images'])
-
-    def __init__(self, commands, images):
+        '''Loads an instance of the DICP from a json or compact file.'''
+        with trace.phase('problem.load'):
+            if is_compact(path):
+                from . import compact
+                return compact.load(path)
+            p = json.load(open(path))
+            return Problem(
+                p['commands'], p['images'], p.get('weights'), p.get('changes'), p.get('sizes')
+            )
+
+    def __init__(self, commands, images, weights=None, changes=None, sizes=None):
         self.images = OrderedDict(sorted(images.items(), key=itemgetter(0)))
 
+        # Images are rebuilt weights[i] times as often as a baseline image.
+        weights = weights or {}
+        self.weights = OrderedDict((i, weights.get(i, 1)) for i in self.images)
+
         # If a command isn't used, we can ignore it.
         used_cmds = set()
         for cmds in self.images.values():
-            used_cmds = used_cmds.union(set(cmds))
+            used_cmds.update(cmds)
 
         self.commands = OrderedDict(sorted(
             [(c, t) for c, t in commands.items() if c in used_cmds],
             key=itemgetter(0)
         ))
 
+        # Probability each command changes in a commit, invalidating its layer.
+        changes = changes or {}
+        self.changes = OrderedDict((c, changes.get(c, 0.0)) for c in self.commands)
+
+        # Bytes each command's layer adds to disk.
+        sizes = sizes or {}
+        self.sizes = OrderedDict((c, sizes.get(c, 0)) for c in self.commands)
+
         self.images_by_command = OrderedDict((c, set()) for c in self.commands)
         for i, cmds in self.images.items():
             for c in cmds:
@@ -63,7 +75,7 @@ class Problem(object):
                     end = '\n'
                 else:
                     end = ',\n'
-                fp.write(('        "%s": %r%s' % (i, v, end)).replace("'", '"'))
+                fp.write('        %s: %s%s' % (json.dumps(i), json.dumps(v), end))
             fp.write('    },\n')
 
             fp.write('    "commands": {\n')
@@ -72,10 +84,45 @@ class Problem(object):
                     end = '\n'
                 else:
                     end = ',\n'
-                fp.write('        "%s": %d%s' % (c, v, end))
+                fp.write('        %s: %d%s' % (json.dumps(c), v, end))
+
+            if self.weighted:
+                fp.write('    },\n')
+                fp.write('    "weights": {\n')
+                for j, (i, w) in enumerate(self.weights.items()):
+                    end = '\n' if j == len(self.weights)-1 else ',\n'
+                    fp.write('        %s: %s%s' % (json.dumps(i), json.dumps(w), end))
+
+            if self.changing:
+                fp.write('    },\n')
+                fp.write('    "changes": {\n')
+                for j, (c, p) in enumerate(self.changes.items()):
+                    end = '\n' if j == len(self.changes)-1 else ',\n'
+                    fp.write('        %s: %s%s' % (json.dumps(c), json.dumps(p), end))
+
+            if self.sized:
+                fp.write('    },\n')
+                fp.write('    "sizes": {\n')
+                for j, (c, b) in enumerate(self.sizes.items()):
+                    end = '\n' if j == len(self.sizes)-1 else ',\n'
+                    fp.write('        %s: %d%s' % (json.dumps(c), b, end))
+
             fp.write('    }\n')
             fp.write('}\n')
 
+    def save_compact(self, path):
+        '''Saves a DICP instance to a compact binary file'''
+        from . import compact
+        compact.save(self, path)
+
+    def update_times(self, times):
+        '''Replaces the times of any commands in times, e.g. measured ones.'''
+        for c, t in times.items():
+            if c in self.commands:
+                self.commands[c] = t
+        for cached in ('_total_time', '_weighted_time', '_lower_bound_triples', '_lower_bound_pairs'):
+            self.__dict__.pop(cached, None)
+
     @property
     def all_stages(self):
         '''Property providing all stages in the problem.'''
@@ -109,22 +156,81 @@ class Problem(object):
         try:
             return self._shared_cmds
         except AttributeError:
-            self._shared_cmds = {}
-            images = self.images.items()
-            for i, (img_i, cmds_i) in enumerate(images):
-                for img_j, cmds_j in images[i+1:]:
-                    self._shared_cmds[img_i, img_j] = set(cmds_i) & set(cmds_j)
+            with trace.phase('problem.shared_cmds'):
+                self._shared_cmds = {}
+                images = self.images.items()
+                for i, (img_i, cmds_i) in enumerate(images):
+                    for img_j, cmds_j in images[i+1:]:
+                        self._shared_cmds[img_i, img_j] = set(cmds_i) & set(cmds_j)
             return self._shared_cmds
 
+    @property
+    def total_time(self):
+        '''Property giving the compute time if no commands are shared.'''
+        try:
+            return self._total_time
+        except AttributeError:
+            self._total_time = sum(
+                self.commands[c] for cmds in self.images.values() for c in cmds
+            )
+            return self._total_time
+
+    @property
+    def weighted(self):
+        '''Property that is True if any image has a rebuild weight besides 1.'''
+        return any(w != 1 for w in self.weights.values())
+
+    @property
+    def weighted_time(self):
+        '''Property giving the weighted compute time if no commands are shared.'''
+        try:
+            return self._weighted_time
+        except AttributeError:
+            self._weighted_time = sum(
+                self.weights[i] * self.commands[c]
+                for i, cmds in self.images.items() for c in cmds
+            )
+            return self._weighted_time
+
+    @property
+    def changing(self):
+        '''Property that is True if any command has a change probability.'''
+        return any(self.changes.values())
+
+    @property
+    def sized(self):
+        '''Property that is True if any command has an output size.'''
+        return any(self.sizes.values())
+
+    def rebuild_priority(self, c):
+        '''How early command c should run to keep later layers cached.
+
+        Ordering a single image's commands by decreasing priority, which is
+        time kept per unit of change probability, minimizes its expected
+        rebuild time.'''
+        p = self.changes[c]
+        if not p:
+            return float('inf')
+        return self.commands[c] * (1 - p) / p
+
+    def pair_weight(self, ip, iq):
+        '''Weight of time shared by two images.
+
+        A layer is rebuilt as often as the most frequently rebuilt image
+        that runs it, so sharing it saves the rebuilds of the other one.'''
+        return min(self.weights[ip], self.weights[iq])
+
     @property
     def num_pairs(self):
         return sum(len(cmds) for cmds in self.images.values())
 
     def cliques(self):
         '''Returns all maximal cliques with 2+ images & their intersections'''
-        return self._cliques(self.images)
+        with trace.phase('problem.cliques'):
+            return self._cliques(self.images)
 
     def _cliques(self, images, prefix='c'):
+        from igraph import Graph
         g = Graph()
         vertices = {}
         image_to_vert = {}
@@ -178,6 +284,7 @@ class Problem(object):
                 if vertices[x].startswith('cmd-')
             ])
             if len(imgs) > 1 and cmds:
+                trace.count('cliques')
                 total_time = sum(self.commands[c] for c in cmds)
 
                 name = '%s%d' % (prefix, num)
@@ -0,0 +1,91 @@
+from .layers import LayerTree
+import heapq
+
+
+class Simulation(object):
+    '''List scheduling simulation of building a schedule on k workers.
+
+    A layer can start once its parent layer is built. Whenever a worker is
+    free it takes the ready layer with the longest remaining path to a
+    leaf, which keeps the critical path moving.
+    '''
+
+    def __init__(self, problem, schedule, workers, tree=None):
+        if workers < 1:
+            raise ValueError('need at least one worker')
+
+        self.workers = workers
+        self.tree = tree = tree or LayerTree(problem, schedule)
+        self.level = level = tree.bottom_levels()
+
+        n = len(tree)
+        self.start = [None] * n
+        self.finish = [None] * n
+        self.worker = [None] * n
+        self.busy = [0] * workers
+
+        ready = [(-level[l], l) for l in tree.roots]
+        heapq.heapify(ready)
+        running = []  # (finish, layer)
+        free = list(range(workers - 1, -1, -1))
+        now = 0
+
+        while ready or running:
+            while ready and free:
+                _, layer = heapq.heappop(ready)
+                w = free.pop()
+                self.start[layer] = now
+                self.finish[layer] = now + tree.time[layer]
+                self.worker[layer] = w
+                self.busy[w] += tree.time[layer]
+                heapq.heappush(running, (self.finish[layer], layer))
+
+            # Advance to the next completion and release everything that
+            # finishes at that time.
+            now, layer = heapq.heappop(running)
+            done = [layer]
+            while running and running[0][0] == now:
+                done.append(heapq.heappop(running)[1])
+            for layer in done:
+                free.append(self.worker[layer])
+                for child in tree.children[layer]:
+                    heapq.heappush(ready, (-level[child], child))
+
+        self.makespan = now
+
+    @property
+    def work(self):
+        '''Total compute time over all layers.'''
+        return self.tree.total_time
+
+    @property
+    def utilization(self):
+        '''Fraction of worker time spent building layers.'''
+        if not self.makespan:
+            return 0.0
+        return self.work / float(self.workers * self.makespan)
+
+    @property
+    def critical_path(self):
+        '''Length of the longest chain of dependent layers.'''
+        return max([self.level[l] for l in self.tree.roots] or [0])
+
+    @property
+    def critical_layers(self):
+        '''Layers along the longest chain, from the bottom up.'''
+        layers = []
+        candidates = self.tree.roots
+        while candidates:
+            layer = max(candidates, key=lambda l: self.level[l])
+            layers.append(layer)
+            candidates = self.tree.children[layer]
+        return layers
+
+    @property
+    def lower_bound(self):
+        '''No schedule of these layers can finish faster than this.'''
+        return max(self.critical_path, self.work / float(self.workers))
+
+    def stats(self):
+        '''Returns (makespan, utilization, critical path length).'''
+        return self.makespan, self.utilization, self.critical_path
@@ -1,27 +1,94 @@
+from . import trace
+from .bounds import gap, lower_bound
+from .layers import LayerTree, split
+from .simulate import Simulation
+from collections import OrderedDict
 from operator import itemgetter
+import json
 
 
 class Solution(object):
-    def __init__(self, problem, schedule, elapsed_time):
+    def __init__(self, problem, schedule, elapsed_time, bound=None, workers=None, cache=None,
+                 nodes=None):
         self.problem = problem
         self.schedule = schedule
         self.elapsed_time = elapsed_time  # time to find the solution
+        self.bound = bound  # lower bound on compute time, if known
+        self.workers = workers  # parallel builders to report makespan for
+        self.cache = cache  # WarmCache builders already hold, if any
+        self.nodes = nodes  # build node of each image, if they don't share a cache
 
     def stats(self):
-        '''Returns (# of unique images, total compute time) of schedule'''
-        seen = set()
-        time = 0
-        for sched in self.schedule.values():
+        '''Returns (# of unique images, total compute time) of schedule
+
+        Compute time is weighted by how often images are rebuilt: each layer
+        counts as often as the most frequently rebuilt image using it.
+        Images on different nodes share nothing.'''
+        if self.nodes is None:
+            return self._stats(self.schedule)
+
+        unique, time = 0, 0
+        for u, t in self.node_loads().values():
+            unique += u
+            time += t
+        return unique, time
+
+    def node_loads(self):
+        '''Maps each build node to (# of unique images, compute time) on it'''
+        parts = split(self.schedule, self.nodes)
+        return {n: self._stats(part) for n, part in parts.items()}
+
+    def _parts(self):
+        if self.nodes is None:
+            return [self.schedule]
+        return split(self.schedule, self.nodes).values()
+
+    def _stats(self, schedule):
+        weight = {}
+        for img, sched in schedule.items():
+            w = self.problem.weights.get(img, 1)
             for i in range(len(sched)):
                 commands = tuple(sched[:i+1])
-                if commands not in seen:
-                    seen.add(commands)
-                    time += self.problem.commands[sched[i]]
+                weight[commands] = max(weight.get(commands, w), w)
+
+        time = sum(self.problem.commands[cmds[-1]] * w for cmds, w in weight.items())
+        return len(weight), time
 
-        return len(seen), time
+    def warm_time(self):
+        '''Returns the weighted compute time given the warm cache'''
+        return sum(LayerTree(self.problem, p, self.cache).weighted_time for p in self._parts())
+
+    def storage(self):
+        '''Returns the bytes needed to keep every layer cached'''
+        return sum(LayerTree(self.problem, p).storage for p in self._parts())
+
+    def rebuild_time(self):
+        '''Returns the expected time to rebuild the schedule after a commit'''
+        return sum(LayerTree(self.problem, p).expected_rebuild_time() for p in self._parts())
+
+    def simulate(self, workers=None):
+        '''Simulates building the schedule on parallel workers'''
+        tree = LayerTree(self.problem, self.schedule, self.cache)
+        return Simulation(self.problem, self.schedule, workers or self.workers or 1, tree)
+
+    def lower_bound(self):
+        '''Returns the best known lower bound on compute time'''
+        cheap = lower_bound(self.problem)
+        if self.bound is None:
+            return cheap
+        return max(self.bound, cheap)
+
+    def gap(self):
+        '''Returns the relative gap between compute time and its lower bound'''
+        _, time = self.stats()
+        return gap(time, self.lower_bound())
 
     def save(self, path):
         '''Saves a DICP solution to a json file'''
+        with trace.phase('solution.save'):
+            self._save(path)
+
+    def _save(self, path):
         # json formatting doen't make it very human readable, so we do our own.
         unique, time = self.stats()
 
@@ -29,13 +96,38 @@ class Solution(object):
             fp.write('{\n')
             fp.write('    "elapsed_time": %f,\n' % self.elapsed_time.total_seconds())
             fp.write('    "unique_images": %d,\n' % unique)
-            fp.write('    "compute_time": %d,\n' % time)
+            fp.write('    "compute_time": %s,\n' % json.dumps(time))
+            if self.cache is not None:
+                fp.write('    "warm_compute_time": %s,\n' % json.dumps(self.warm_time()))
+                fp.write('    "changed_images": %d,\n' % self.cache.changed(self.schedule))
+            if self.nodes is not None:
+                loads = sorted(self.node_loads().items())
+                fp.write('    "nodes": {\n')
+                for j, (n, (_, t)) in enumerate(loads):
+                    end = '\n' if j == len(loads)-1 else ',\n'
+                    fp.write('        %s: %s%s' % (json.dumps(str(n)), json.dumps(t), end))
+                fp.write('    },\n')
+                fp.write('    "assignment": %s,\n' % json.dumps(
+                    OrderedDict(sorted(self.nodes.items()))
+                ))
+            if self.problem.sized:
+                fp.write('    "storage": %d,\n' % self.storage())
+            if self.problem.changing:
+                fp.write('    "rebuild_time": %f,\n' % self.rebuild_time())
+            fp.write('    "bound": %s,\n' % json.dumps(self.lower_bound()))
+            fp.write('    "gap": %f,\n' % gap(time, self.lower_bound()))
+            if self.workers is not None:
+                makespan, utilization, critical_path = self.simulate().stats()
+                fp.write('    "workers": %d,\n' % self.workers)
+                fp.write('    "makespan": %d,\n' % makespan)
+                fp.write('    "utilization": %f,\n' % utilization)
+                fp.write('    "critical_path": %d,\n' % critical_path)
             fp.write('    "schedule": {\n')
             for j, (i, v) in enumerate(sorted(self.schedule.items(), key=itemgetter(0))):
                 if j == len(self.schedule)-1:
                     end = '\n'
                 else:
                     end = ',\n'
-                fp.write(('        "%s": %r%s' % (i, v, end)).replace("'", '"').replace('u', ''))
+                fp.write('        %s: %s%s' % (json.dumps(i), json.dumps(list(v)), end))
             fp.write('    }\n')
             fp.write('}\n')
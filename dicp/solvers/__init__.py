@@ -1,17 +1,151 @@
-from .benders_model_gurobi import BendersModelGurobi
-from .bip_model_gurobi import BIPModelGurobi
-from .bip_model_mosek import BIPModelMosek
-from .clique_model_gurobi import CliqueModelGurobi
-from .clique_model_mosek import CliqueModelMosek
-from .colgen_model_gurobi import ColgenModelGurobi
-from .most_common import MostCommonHeuristic
-from .most_time import MostTimeHeuristic
-from .network_mosek import NetworkMosek
-
-ALL_SOLVERS = (
-    BendersModelGurobi, BIPModelGurobi, BIPModelMosek, CliqueModelGurobi,
-    CliqueModelMosek, ColgenModelGurobi, MostCommonHeuristic, MostTimeHeuristic,
-    NetworkMosek
-)
+'''Registry of DICP solvers, keyed by slug.
+
+Solver modules are imported only when their solver is asked for, so the
+heuristics run without gurobipy, mosek or igraph installed and without
+paying for importing them. Other packages can add solvers through the
+dicp.solvers entry point group, naming each entry point after its slug:
+
+    entry_points={'dicp.solvers': ['my-solver = mypkg.solver:MySolver']}
+'''
+from .base import CancelToken, Solver
+from collections import OrderedDict
+from importlib import import_module
+import pkgutil
+
+# Solver slug -> (module, class name, backends the module needs).
+BUILTIN_SOLVERS = OrderedDict([
+    ('beam-search', ('.beam_search', 'BeamSearch', ())),
+    ('benders-model-gurobi', ('.benders_model_gurobi', 'BendersModelGurobi', ('gurobi',))),
+    ('bip-model-gurobi', ('.bip_model_gurobi', 'BIPModelGurobi', ('gurobi',))),
+    ('bip-model-mosek', ('.bip_model_mosek', 'BIPModelMosek', ('mosek',))),
+    ('clique-model-gurobi', ('.clique_model_gurobi', 'CliqueModelGurobi', ('gurobi', 'igraph'))),
+    ('clique-model-mosek', ('.clique_model_mosek', 'CliqueModelMosek', ('mosek', 'igraph'))),
+    ('colgen-model-gurobi', ('.colgen_model_gurobi', 'ColgenModelGurobi', ('gurobi',))),
+    ('grasp', ('.grasp', 'GRASP', ())),
+    ('local-search', ('.local_search', 'LocalSearch', ())),
+    ('most-common', ('.most_common', 'MostCommonHeuristic', ())),
+    ('most-time', ('.most_time', 'MostTimeHeuristic', ())),
+    ('network-mosek', ('.network_mosek', 'NetworkMosek', ('mosek',))),
+    ('partition', ('.partition', 'PartitionHeuristic', ())),
+    ('portfolio', ('.portfolio', 'Portfolio', ())),
+])
+
+# Backend -> top level module that provides it.
+BACKENDS = OrderedDict([('gurobi', 'gurobipy'), ('igraph', 'igraph'), ('mosek', 'mosek')])
+
+ENTRY_POINT_GROUP = 'dicp.solvers'
+
+_registered = OrderedDict()  # slug -> solver class
+_entry_points = None
+
+
+def register(solverclass):
+    '''Registers a solver class under its _slug. Returns the class, so
+    this can be used as a decorator.'''
+    _registered[solverclass._slug] = solverclass
+    return solverclass
+
+
+def _plugins():
+    '''Maps slugs to entry points of installed third party solvers.'''
+    global _entry_points
+    if _entry_points is None:
+        _entry_points = OrderedDict()
+        try:
+            import pkg_resources
+        except ImportError:
+            return _entry_points
+        for ep in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP):
+            _entry_points.setdefault(ep.name, ep)
+    return _entry_points
+
+
+def backend_available(backend):
+    '''Returns whether a backend's module can be imported, without importing it.'''
+    return pkgutil.find_loader(BACKENDS[backend]) is not None
+
+
+def available_backends():
+    '''Returns the names of the backends that are installed.'''
+    return [b for b in BACKENDS if backend_available(b)]
+
+
+def solver_slugs():
+    '''Returns the slugs of all known solvers, installed or not.'''
+    slugs = list(BUILTIN_SOLVERS)
+    slugs.extend(s for s in _registered if s not in BUILTIN_SOLVERS)
+    slugs.extend(s for s in _plugins() if s not in slugs)
+    return slugs
+
+
+def available_solvers():
+    '''Returns the slugs of solvers whose backends are installed.
+
+    Third party solvers are assumed to be available.'''
+    return [
+        slug for slug in solver_slugs()
+        if slug not in BUILTIN_SOLVERS or all(backend_available(b) for b in BUILTIN_SOLVERS[slug][2])
+    ]
 
-__all__ = 'ALL_SOLVERS',
+
+def get_solver(slug):
+    '''Returns the solver class for a slug, importing its module.
+
+    Raises KeyError for unknown slugs, and ImportError naming the missing
+    backends if the solver can't be imported.'''
+    if slug in _registered:
+        return _registered[slug]
+
+    if slug in BUILTIN_SOLVERS:
+        module, name, backends = BUILTIN_SOLVERS[slug]
+        missing = [b for b in backends if not backend_available(b)]
+        if missing:
+            raise ImportError('solver %s needs %s' % (slug, ', '.join(BACKENDS[b] for b in missing)))
+        solverclass = getattr(import_module(module, __name__), name)
+
+    elif slug in _plugins():
+        solverclass = _plugins()[slug].load()
+
+    else:
+        raise KeyError(slug)
+
+    _registered[slug] = solverclass
+    return solverclass
+
+
+class _SolverClasses(object):
+    '''Sequence of the installed solver classes, imported on first use.
+
+    This keeps ALL_SOLVERS working for code written before the registry
+    without importing every backend when dicp.solvers is imported.'''
+
+    def __init__(self):
+        self._classes = None
+
+    def _load(self):
+        if self._classes is None:
+            self._classes = tuple(get_solver(slug) for slug in available_solvers())
+        return self._classes
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __getitem__(self, k):
+        return self._load()[k]
+
+    def __contains__(self, solverclass):
+        return solverclass in self._load()
+
+    def __repr__(self):
+        return repr(self._load())
+
+
+ALL_SOLVERS = _SolverClasses()
+
+__all__ = (
+    'ALL_SOLVERS', 'CancelToken', 'Solver', 'available_backends', 'available_solvers',
+    'get_solver', 'register', 'solver_slugs'
+)
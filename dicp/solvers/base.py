@@ -0,0 +1,225 @@
+from dicp import trace
+from dicp.bounds import lower_bound
+from dicp.objective import Objective
+import time
+
+# Storage weights the greedy heuristics try when disk usage matters.
+STORAGE_MIXES = 0.0, 0.25, 0.5, 0.75, 1.0
+
+TRUE_WORDS = '1', 'true', 'yes', 'on'
+FALSE_WORDS = '0', 'false', 'no', 'off'
+
+
+def flag(value):
+    '''Reads a boolean solver argument, which may be a command line string.'''
+    try:
+        word = value.strip().lower()
+    except AttributeError:
+        return bool(value)
+    if word in TRUE_WORDS:
+        return True
+    if word in FALSE_WORDS:
+        return False
+    raise ValueError('not a boolean: %s' % value)
+
+
+class CancelToken(object):
+    '''Cooperative cancellation flag shared between a solver and its caller'''
+
+    def __init__(self):
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+
+class Incumbent(object):
+    '''Tracks the best schedule found so far and forwards improvements'''
+
+    def __init__(self, problem, saver, objective=None):
+        self.problem = problem
+        self.saver = saver
+        self.objective = objective or Objective()
+        self.schedule = None
+        self.value = None  # objective value of the best schedule
+        self.bound = None  # best known lower bound on the objective
+
+    def update(self, schedule):
+        '''Saves schedule if it beats the incumbent. Returns True if it did.'''
+        trace.count('incumbents')
+        value = self.objective(self.problem, schedule)
+        if self.value is not None and value >= self.value:
+            return False
+
+        trace.count('improvements')
+
+        self.schedule = {i: list(cmds) for i, cmds in schedule.items()}
+        self.value = value
+        self.saver(self.schedule)
+        return True
+
+    def update_bound(self, bound):
+        '''Records a lower bound on the objective if it is tighter.'''
+        if self.bound is None or bound > self.bound:
+            self.bound = bound
+
+    @property
+    def gap(self):
+        '''Relative gap between the incumbent and the bound, or None.'''
+        if self.value is None or self.bound is None:
+            return None
+        if self.value == 0:
+            return 0.0
+        return max(0.0, (self.value - self.bound) / float(self.value))
+
+
+class Solver(object):
+    '''Base class for DICP solvers.
+
+    Subclasses implement _solve(problem). They report schedules through
+    _save, which forwards only improving ones to the saver, and lower
+    bounds on compute time through _bound. Long running solvers should
+    poll stopped() or pass time_left() on to the underlying optimizer so
+    they respect the wall-clock budget and cancellation.
+
+    Schedules are ranked by self.objective, which is compute time unless
+    the solver was given workers for a makespan objective, or asked to
+    minimize expected incremental rebuild time. Given a WarmCache, layers
+    builders already hold cost nothing. The greedy heuristics, local
+    search and bip-model-gurobi plan around it; other solvers construct
+    schedules on cold times and the cache only ranks them. A disk budget
+    or storage weight also accounts for the bytes cached layers take.
+    '''
+    _slug = None
+
+    # Solvers that can use schedules found elsewhere while they run set
+    # this and implement suggest(schedule).
+    accepts_starts = False
+
+    def __init__(self, time=None, workers=None, makespan_weight=None, incremental=False,
+                 budget=None, storage_weight=None):
+        self.time = time  # in minutes
+        self.objective = Objective(
+            workers, makespan_weight, flag(incremental), budget, storage_weight
+        )
+        self.token = CancelToken()
+        self.deadline = None
+        self.incumbent = None
+
+    def slug(self):
+        return self._slug
+
+    def solve(self, problem, saver, cache=None):
+        '''Solves problem, passing improving schedules to saver.
+
+        Returns the best schedule found, or None if there isn't one.'''
+        self.problem = problem
+        self.objective.cache = cache
+        self.incumbent = Incumbent(problem, saver, self.objective)
+
+        if self.time is not None:
+            self.deadline = time.time() + 60 * float(self.time)
+
+        with trace.phase('solve', solver=self.slug()):
+            # A cheap bound up front gives every solver a gap, and lets
+            # exact ones stop as soon as they meet it.
+            self._bound(lower_bound(problem))
+            self._solve(problem)
+        return self.incumbent.schedule
+
+    def _solve(self, problem):
+        raise NotImplementedError
+
+    def _save(self, schedule):
+        return self.incumbent.update(schedule)
+
+    def _bound(self, bound):
+        # Bounds from the models are on compute time.
+        if self.objective.compute_only:
+            self.incumbent.update_bound(bound)
+
+    def _seed(self):
+        '''Saves a greedy schedule so there is an incumbent from the start.'''
+        from .most_common import MostCommonHeuristic
+        with trace.phase('seed'):
+            heur = self._heuristic(MostCommonHeuristic)
+            heur.solve(self.problem, self._save, self.objective.cache)
+
+    def _heuristic(self, solverclass):
+        '''Returns a heuristic solver that shares this solver's objective.'''
+        heur = solverclass()
+        heur.objective = self.objective
+        return heur
+
+    def _storage_mixes(self):
+        '''Weights on storage saved to try in the greedy heuristics.'''
+        if self.objective.storage_aware and self.problem.sized:
+            return STORAGE_MIXES
+        return 0.0,
+
+    def _storage_mix(self, by_cmd, key, mix):
+        '''Wraps a greedy key to also favor sharing large layers.
+
+        The key and the bytes sharing a command saves are each scaled by
+        their largest value among the candidates, then mixed.'''
+        if not mix:
+            return key
+
+        sizes = self.problem.sizes
+        stored = lambda c: sizes[c] * (len(by_cmd[c]) - 1)
+        primary = lambda c: key(c)[0] if isinstance(key(c), tuple) else key(c)
+        top_key = float(max(primary(c) for c in by_cmd)) or 1.0
+        top_stored = float(max(stored(c) for c in by_cmd)) or 1.0
+
+        def mixed(c):
+            k = key(c)
+            rest = k[1:] if isinstance(k, tuple) else ()
+            value = (1 - mix) * primary(c) / top_key + mix * stored(c) / top_stored
+            return (value,) + rest
+        return mixed
+
+    def _warm_first(self, remaining, order, key):
+        '''Wraps a greedy key to prefer extending layers already cached.
+
+        Images in remaining share the prefix they have in order so far.'''
+        cache = self.objective.cache
+        if cache is None:
+            return key
+        prefix = tuple(order[next(iter(remaining))])
+        return lambda c: (prefix + (c,) in cache, key(c))
+
+    def suggest(self, schedule):
+        '''Offers a schedule found elsewhere, e.g. by another solver.'''
+        raise NotImplementedError
+
+    def cancel(self):
+        '''Asks a running solve to stop at its next opportunity.'''
+        self.token.cancel()
+
+    def time_left(self):
+        '''Seconds until the deadline, or None if there isn't one.'''
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.time())
+
+    def stopped(self):
+        '''True if the solver has been cancelled or is out of time.'''
+        if self.token.cancelled:
+            return True
+        return self.deadline is not None and time.time() >= self.deadline
+
+    @property
+    def bound(self):
+        if self.incumbent is None:
+            return None
+        return self.incumbent.bound
+
+    @property
+    def gap(self):
+        if self.incumbent is None:
+            return None
+        return self.incumbent.gap
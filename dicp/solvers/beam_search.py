@@ -0,0 +1,267 @@
+from .base import Solver
+from .most_common import MostCommonHeuristic
+from .most_time import MostTimeHeuristic
+from dicp import trace
+from multiprocessing import Pool
+
+# Ways to rank the commands a group of images could share next. Each takes
+# the expander, the group's commands mapped to the images running them,
+# and a command, and returns a key where larger is better. lookahead
+# instead ranks commands by what the split would cost after completing
+# both halves greedily by time.
+SCORES = {
+    'count': lambda ex, by_cmd, c: ex.weight(by_cmd[c]),
+    'time': lambda ex, by_cmd, c: ex.saved(by_cmd, c),
+    'count-time': lambda ex, by_cmd, c: ex.weight(by_cmd[c]) * ex.times[c],
+}
+LOOKAHEAD = 'lookahead'
+
+
+class Expander(object):
+    '''Expands partial schedules of the recursive split tree.
+
+    A partial schedule is (cost, estimate, schedule, pending). schedule
+    maps images to the commands ordered for them so far, and pending is a
+    list of groups, tuples of images sharing everything ordered so far.
+    cost is the weighted time of the layers built so far, and estimate is
+    what completing the pending groups greedily would add. Greedy
+    completions are remembered, so following the greedy choice costs
+    nothing to evaluate.
+    '''
+
+    def __init__(self, problem, scoring, branch, incremental=False):
+        self.problem = problem
+        self.times = problem.commands
+        self.weights = problem.weights
+        self.score = SCORES['time' if scoring == LOOKAHEAD else scoring]
+        self.lookahead = scoring == LOOKAHEAD
+        self.branch = branch
+        self.incremental = incremental
+        self.commands = {i: frozenset(cmds) for i, cmds in problem.images.items()}
+        if not problem.weighted:
+            self.weight = len
+            self.heaviest = lambda images: 1
+        self.completions = {}  # (group, commands done) -> cost of completing it greedily
+        self.learned = {}  # completions since learned was last reset
+
+    def weight(self, images):
+        return sum(self.weights[i] for i in images)
+
+    def heaviest(self, images):
+        return max(self.weights[i] for i in images)
+
+    def saved(self, by_cmd, c):
+        '''Time saved by sharing c, as in the most time heuristic.'''
+        return self.times[c] * (self.weight(by_cmd[c]) - self.heaviest(by_cmd[c]))
+
+    def by_cmd(self, group, done):
+        '''Maps the commands left in a group to the images running them.'''
+        by_cmd = {}
+        for i in group:
+            for c in self.commands[i] - done:
+                by_cmd.setdefault(c, set()).add(i)
+        return by_cmd
+
+    def common(self, group, by_cmd):
+        '''Removes and returns the commands every image in group runs, in
+        run order. Sharing them first never loses anything.'''
+        common = [c for c, images in by_cmd.items() if len(images) == len(group)]
+        for c in common:
+            del by_cmd[c]
+        if self.incremental:
+            priority = self.problem.rebuild_priority
+            return sorted(common, key=lambda c: (-priority(c), c))
+        return sorted(common, key=lambda c: (-self.times[c], c))
+
+    def split(self, group, by_cmd, c):
+        '''Returns the images in group that run c, and those that don't.'''
+        inside = by_cmd[c]
+        return tuple(i for i in group if i in inside), tuple(i for i in group if i not in inside)
+
+    def complete(self, group, done):
+        '''Returns the cost of completing group greedily after done.'''
+        key = group, done
+        if key in self.completions:
+            return self.completions[key]
+
+        by_cmd = self.by_cmd(group, done)
+        common = self.common(group, by_cmd)
+        cost = self.heaviest(group) * sum(self.times[c] for c in common)
+        if by_cmd:
+            done = done.union(common)
+            c = max(by_cmd, key=lambda c: (self.score(self, by_cmd, c), c))
+            inside, outside = self.split(group, by_cmd, c)
+            cost += self.times[c] * self.heaviest(inside)
+            cost += self.complete(inside, done.union([c]))
+            cost += self.complete(outside, done)
+
+        self.completions[key] = self.learned[key] = cost
+        return cost
+
+    def __call__(self, state):
+        '''Returns the partial schedules one split below state.'''
+        cost, estimate, schedule, pending = state
+        schedule = dict(schedule)
+        pending = list(pending)
+
+        # Commands every image in a group runs, including all of a lone
+        # image's, are ordered without choosing anything.
+        while pending:
+            group = pending.pop()
+            done = frozenset(schedule[group[0]])
+            estimate -= self.complete(group, done)
+
+            by_cmd = self.by_cmd(group, done)
+            common = self.common(group, by_cmd)
+            if common:
+                cost += self.heaviest(group) * sum(self.times[c] for c in common)
+                for i in group:
+                    schedule[i] += tuple(common)
+                done = done.union(common)
+
+            if by_cmd:
+                break
+        else:
+            return [(cost, estimate, schedule, [])]
+
+        # Branch on the best few commands for the group.
+        trace.count('beam.splits')
+        candidates = list(by_cmd)
+        if not self.lookahead:
+            candidates.sort(key=lambda c: (self.score(self, by_cmd, c), c), reverse=True)
+            candidates = candidates[:self.branch]
+
+        children = []
+        for c in candidates:
+            inside, outside = self.split(group, by_cmd, c)
+            child_cost = cost + self.times[c] * self.heaviest(inside)
+            child_estimate = estimate + self.complete(inside, done.union([c]))
+            if outside:
+                child_estimate += self.complete(outside, done)
+            children.append((child_cost, child_estimate, c, inside, outside))
+        if self.lookahead:
+            children.sort(key=lambda child: (child[0] + child[1], child[2]))
+
+        states = []
+        for child_cost, child_estimate, c, inside, outside in children[:self.branch]:
+            child = dict(schedule)
+            for i in inside:
+                child[i] += (c,)
+            child_pending = list(pending)
+            if outside:
+                child_pending.append(outside)
+            child_pending.append(inside)
+            states.append((child_cost, child_estimate, child, child_pending))
+        return states
+
+
+_expander = None
+
+
+def _start(expander):
+    global _expander
+    _expander = expander
+
+
+def _expand(task):
+    '''Expands a chunk of the beam in a worker process.
+
+    Workers share the greedy completions they learn through the parent,
+    which sends each one what every worker learned at the last level.'''
+    states, known = task
+    _expander.completions.update(known)
+    _expander.learned = {}
+    return [_expander(state) for state in states], _expander.learned
+
+
+class BeamSearch(Solver):
+    '''Beam search over the recursive split tree of the greedy heuristics
+
+    Like the greedy heuristics, each step picks a command for a group of
+    images sharing a prefix, splitting the group into the images that run
+    it next and the rest. Rather than committing to the best command, it
+    tries the best branch commands and keeps the width partial schedules
+    whose cost so far plus greedy completion is lowest.
+    scoring ranks commands: count, time or count-time like the greedy
+    heuristics, or lookahead, which completes the split on every command
+    and is slower but usually better.
+    Each level of the beam is expanded on processes worker processes.
+    The search minimizes weighted compute time, running commands a whole
+    group shares in rebuild priority order if incremental is set. The
+    solver's objective judges the schedules it finds, starting from both
+    greedy heuristics.
+    '''
+    _slug = 'beam-search'
+
+    def __init__(self, width=10, branch=3, scoring='time', processes=1, time=None,
+                 workers=None, makespan_weight=None, incremental=False, budget=None,
+                 storage_weight=None):
+        super(BeamSearch, self).__init__(
+            time, workers, makespan_weight, incremental, budget, storage_weight
+        )
+        if scoring not in SCORES and scoring != LOOKAHEAD:
+            raise ValueError('scoring must be one of %s' % ', '.join(sorted(SCORES) + [LOOKAHEAD]))
+        self.width = int(width)
+        self.branch = int(branch)
+        self.scoring = scoring
+        self.processes = int(processes)
+
+    def _solve(self, problem):
+        with trace.phase('seed'):
+            for solverclass in (MostCommonHeuristic, MostTimeHeuristic):
+                self._heuristic(solverclass).solve(problem, self._save, self.objective.cache)
+
+        expander = Expander(problem, self.scoring, self.branch, self.objective.incremental)
+        images = tuple(sorted(problem.images))
+        start = {i: () for i in images}
+        beam = [(0, expander.complete(images, frozenset()), start, [images])]
+
+        pool = None
+        expand = lambda states: map(expander, states)
+        if self.processes > 1:
+            pool = Pool(self.processes, initializer=_start, initargs=(expander,))
+            expand = lambda states: self._expand_parallel(pool, expander, states)
+
+        try:
+            with trace.phase('search'):
+                self._search(beam, expand)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def _expand_parallel(self, pool, expander, states):
+        chunks = [states[k::self.processes] for k in range(self.processes)]
+        known, expander.learned = expander.learned, {}
+        results = pool.map(_expand, [(chunk, known) for chunk in chunks if chunk])
+
+        children = [None] * len(states)
+        for k, (expanded, learned) in enumerate(results):
+            children[k::self.processes] = expanded
+            expander.completions.update(learned)
+            expander.learned.update(learned)
+        return children
+
+    def _search(self, beam, expand):
+        best = None
+        while beam and not self.stopped():
+            trace.count('beam.levels')
+            children = []
+            for states in expand(beam):
+                children.extend(states)
+
+            # Different splits can reach the same partial schedule.
+            beam, seen = [], set()
+            for state in children:
+                cost, estimate, schedule, pending = state
+                if pending:
+                    key = cost, estimate, tuple(pending)
+                    if key not in seen:
+                        seen.add(key)
+                        beam.append(state)
+                elif best is None or cost < best:
+                    best = cost
+                    self._save({i: list(cmds) for i, cmds in schedule.items()})
+
+            beam.sort(key=lambda s: (s[0] + s[1], s[0]))
+            beam = beam[:self.width]
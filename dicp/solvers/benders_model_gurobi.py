@@ -1,10 +1,12 @@
+from .base import Solver
 from .most_common import MostCommonHeuristic
 from collections import defaultdict
+from dicp import trace
 from itertools import product
 from gurobipy import GRB, Model, quicksum as sum
 import sys
 
-class BendersModelGurobi(object):
+class BendersModelGurobi(Solver):
     '''Benders Decomposition of the original BIP using Gurobi'''
     _slug = 'benders-model-gurobi'
 
@@ -12,36 +14,35 @@ class BendersModelGurobi(object):
         # TODO: presol, presol+sos1, heuristic initial sol'n
         return BendersModelGurobi._slug
 
-    def solve(self, problem, saver):
-        # TODO: time limits
+    def _solve(self, problem):
         # TODO: symmetry?
 
         # Construct master model.
-        self.problem = problem
-        self.model = model = Model()
-        model.params.LazyConstraints = 1
+        with trace.phase('build'):
+            self.model = model = Model()
+            model.params.LazyConstraints = 1
 
-        self.theta = theta = model.addVar(lb=-GRB.INFINITY, name='theta')
+            self.theta = theta = model.addVar(lb=-GRB.INFINITY, name='theta')
 
-        # x[i,s,c] = 1 if image i runs command c during stage s, 0 otherwise
-        self.x = x = {}
-        for i, cmds in problem.images.items():
-            for s, c in product(problem.stages[i], cmds):
-                x[i,s,c] = model.addVar(vtype=GRB.BINARY, name='x[%s,%s,%s]' % (i,s,c))
+            # x[i,s,c] = 1 if image i runs command c during stage s, 0 otherwise
+            self.x = x = {}
+            for i, cmds in problem.images.items():
+                for s, c in product(problem.stages[i], cmds):
+                    x[i,s,c] = model.addVar(vtype=GRB.BINARY, name='x[%s,%s,%s]' % (i,s,c))
 
-        model.update()
+            model.update()
 
-        # Need to reference vars by their indices later.
-        self.xind = {xvar: isc for isc, xvar in x.items()}
+            # Need to reference vars by their indices later.
+            self.xind = {xvar: isc for isc, xvar in x.items()}
 
-        # Each image one command per stage, and each command once.
-        for i in problem.images:
-            for s in problem.stages[i]:
-                model.addConstr(sum(x[i,s,c] for c in problem.images[i]) == 1)
-            for c in problem.images[i]:
-                model.addConstr(sum(x[i,s,c] for s in problem.stages[i]) == 1)
+            # Each image one command per stage, and each command once.
+            for i in problem.images:
+                for s in problem.stages[i]:
+                    model.addConstr(sum(x[i,s,c] for c in problem.images[i]) == 1)
+                for c in problem.images[i]:
+                    model.addConstr(sum(x[i,s,c] for s in problem.stages[i]) == 1)
 
-        model.setObjective(theta, GRB.MINIMIZE)
+            model.setObjective(theta, GRB.MINIMIZE)
 
         # Optimize until we can longer add optimality cuts.
         iteration = 1
@@ -70,19 +71,27 @@ class BendersModelGurobi(object):
                         return 0
 
             else:
-                model.optimize(lambda *args: self._callback(saver, *args))
+                if self.time is not None:
+                    model.params.TimeLimit = self.time_left()
+                with trace.phase('optimize'):
+                    model.optimize(trace.wrap('callback', self._callback))
+                if model.SolCount < 1:
+                    break
+
+                # The master is a relaxation of the full model, which doesn't
+                # know about rebuild weights.
+                if model.ObjBound > -GRB.INFINITY and not problem.weighted:
+                    self._bound(problem.total_time + model.ObjBound)
                 val_func = lambda m, xvar: xvar.x
 
             cut_func = lambda m, cons: m.addConstr(cons)
-            saver(self._schedule(val_func))
+            self._save(self._schedule(val_func))
 
-            if not self._cut(model, val_func, cut_func):
+            if self.stopped() or not self._cut(model, val_func, cut_func):
                 break
 
             iteration += 1
 
-        saver(self._schedule(val_func))
-
     def _schedule(self, val_func):
         # Save schedule.
         schedule = defaultdict(list)
@@ -95,7 +104,11 @@ class BendersModelGurobi(object):
 
         return schedule
 
-    def _callback(self, saver, model, where):
+    def _callback(self, model, where):
+        if self.stopped():
+            model.terminate()
+            return
+
         # Save incumbent solutions as they are found.
         if where != GRB.callback.MIPSOL:
             return
@@ -104,7 +117,7 @@ class BendersModelGurobi(object):
         cut_func = lambda m, cons: m.cbLazy(cons)
 
         # Save the incumbent.
-        saver(self._schedule(val_func))
+        self._save(self._schedule(val_func))
 
         try:
             self._cut(model, val_func, cut_func)
@@ -143,7 +156,8 @@ class BendersModelGurobi(object):
             -sum(problem.commands[c] * y[ip,iq,s,c] for ip,iq,s,c in y),
             GRB.MINIMIZE
         )
-        sub.optimize()
+        with trace.phase('subproblem'):
+            sub.optimize()
 
         # Add the dual prices for each variable
         pi = defaultdict(float)
@@ -1,17 +1,36 @@
+from .base import Solver
 from .most_common import MostCommonHeuristic
 from .most_time import MostTimeHeuristic
 from collections import defaultdict
+from dicp import trace
 from itertools import product
+from math import fsum
 from gurobipy import GRB, Model, quicksum as sum
 
-class BIPModelGurobi(object):
-    '''Reference binary integer program: full model with no decomposition'''
+class BIPModelGurobi(Solver):
+    '''Reference binary integer program: full model with no decomposition
+
+    Given workers, the model minimizes a mix of compute time and a lower
+    bound on the makespan of building on that many workers instead of
+    maximizing shared time. Compute time is weighted by the heaviest image
+    using each layer, as in the objective. With incremental set, it is
+    replaced by a linear estimate of the expected rebuild time after a
+    commit. Bytes of layers built over a disk budget are minimized ahead
+    of everything else, and a storage weight charges for them in the
+    objective. Given a warm cache, cached layers cost no time and changing
+    an image's order costs the cache's churn penalty.
+    '''
     _slug = 'bip-model-gurobi'
+    accepts_starts = True
 
-    def __init__(self, presol=None, heur=None, time=None):
+    def __init__(self, presol=None, heur=None, time=None, workers=None,
+                 makespan_weight=None, incremental=False, budget=None, storage_weight=None):
+        super(BIPModelGurobi, self).__init__(
+            time, workers, makespan_weight, incremental, budget, storage_weight
+        )
         self.presol = presol
         self.heur = heur
-        self.time = time # in minutes
+        self.suggested = None
 
     def slug(self):
         slug = BIPModelGurobi._slug
@@ -19,63 +38,88 @@ class BIPModelGurobi(object):
             slug = '%s-presol-%s' % (slug, self.presol)
         if self.heur is not None:
             slug = '%s-heur-%s' % (slug, self.heur)
+        if self.objective.makespan_weight:
+            slug = '%s-makespan-%s' % (slug, self.objective.workers)
+        if self.objective.incremental:
+            slug = '%s-incremental' % slug
+        if self.objective.budget is not None:
+            slug = '%s-budget-%d' % (slug, self.objective.budget)
         return slug
 
-    def solve(self, problem, saver):
+    def _solve(self, problem):
+        # Without a heuristic start there is still an incumbent, e.g. if
+        # the model runs out of time.
+        if self.heur is None:
+            self._seed()
+
         # Construct model.
-        self.problem = problem
-        self.model = model = Model()
-        if self.time is not None:
-            model.params.TimeLimit = 60 * int(self.time)
+        self.over = None
+        with trace.phase('build'):
+            self.model = model = Model()
+            if self.time is not None:
+                model.params.TimeLimit = self.time_left()
 
-        # x[i,s,c] = 1 if image i runs command c during stage s, 0 otherwise.
-        self.x = x = {}
-        for i, cmds in problem.images.items():
-            for s, c in product(problem.stages[i], cmds):
-                x[i,s,c] = model.addVar(vtype=GRB.BINARY, name='x[%s,%s,%s]' % (i,s,c))
+            # x[i,s,c] = 1 if image i runs command c during stage s, 0 otherwise.
+            self.x = x = {}
+            for i, cmds in problem.images.items():
+                for s, c in product(problem.stages[i], cmds):
+                    x[i,s,c] = model.addVar(vtype=GRB.BINARY, name='x[%s,%s,%s]' % (i,s,c))
 
-        # y[ip,iq,s,c] = 1 if images ip & iq have a shared path through stage
-        #                s by running command c during s, 0 otherwise.
-        y = {}
-        for (ip, iq), cmds in problem.shared_cmds.items():
-            for s, c in product(problem.shared_stages[ip, iq], cmds):
-                y[ip,iq,s,c] = model.addVar(vtype=GRB.BINARY, name='y[%s,%s,%s,%s]' % (ip,iq,s,c))
+            # y[ip,iq,s,c] = 1 if images ip & iq have a shared path through stage
+            #                s by running command c during s, 0 otherwise.
+            self.y = y = {}
+            for (ip, iq), cmds in problem.shared_cmds.items():
+                for s, c in product(problem.shared_stages[ip, iq], cmds):
+                    y[ip,iq,s,c] = model.addVar(vtype=GRB.BINARY, name='y[%s,%s,%s,%s]' % (ip,iq,s,c))
 
-        model.update()
+            model.update()
 
-        # TODO: need to remove presolved commands so the heuristic doesn't try them.
+            # TODO: need to remove presolved commands so the heuristic doesn't try them.
 
-        # Add a heuristic initial solution.
-        if self.heur is not None:
-            self._heur()
+            # Add a heuristic initial solution.
+            if self.heur is not None:
+                self._heur()
 
-        # Presolving
-        if self.presol in ('all', 'unshared'):
-            self._presol_unshared()
-        if self.presol in ('all', 'shared'):
-            self._presol_shared()
+            # Presolving
+            if self.presol in ('all', 'unshared'):
+                self._presol_unshared()
+            if self.presol in ('all', 'shared'):
+                self._presol_shared()
 
-        # Each image one command per stage, and each command once.
-        for i in problem.images:
-            for s in problem.stages[i]:
-                model.addConstr(sum(x[i,s,c] for c in problem.images[i]) == 1)
-            for c in problem.images[i]:
-                model.addConstr(sum(x[i,s,c] for s in problem.stages[i]) == 1)
+            # Each image one command per stage, and each command once.
+            for i in problem.images:
+                for s in problem.stages[i]:
+                    model.addConstr(sum(x[i,s,c] for c in problem.images[i]) == 1)
+                for c in problem.images[i]:
+                    model.addConstr(sum(x[i,s,c] for s in problem.stages[i]) == 1)
 
-        # Find shared paths among image pairs.
-        for (ip, iq), cmds in problem.shared_cmds.items():
-            for s in problem.shared_stages[ip,iq]:
-                for c in cmds:
-                    model.addConstr(y[ip,iq,s,c] <= x[ip,s,c])
-                    model.addConstr(y[ip,iq,s,c] <= x[iq,s,c])
-                if s > 1:
-                    model.addConstr(sum(y[ip,iq,s,c] for c in cmds) <= sum(y[ip,iq,s-1,c] for c in cmds))
-
-        model.setObjective(
-            sum(problem.commands[c] * y[ip,iq,s,c] for ip,iq,s,c in y),
-            GRB.MAXIMIZE
-        )
-        model.optimize(lambda *args: self._callback(saver, *args))
+            # Find shared paths among image pairs.
+            for (ip, iq), cmds in problem.shared_cmds.items():
+                for s in problem.shared_stages[ip,iq]:
+                    for c in cmds:
+                        model.addConstr(y[ip,iq,s,c] <= x[ip,s,c])
+                        model.addConstr(y[ip,iq,s,c] <= x[iq,s,c])
+                    if s > 1:
+                        model.addConstr(sum(y[ip,iq,s,c] for c in cmds) <= sum(y[ip,iq,s-1,c] for c in cmds))
+
+            if self.objective.compute_only:
+                model.setObjective(
+                    sum(
+                        problem.pair_weight(ip, iq) * problem.commands[c] * y[ip,iq,s,c]
+                        for ip,iq,s,c in y
+                    ),
+                    GRB.MAXIMIZE
+                )
+            else:
+                self._layer_objective()
+        with trace.phase('optimize'):
+            model.optimize(trace.wrap('callback', self._callback))
+        if model.SolCount < 1:
+            return
+
+        # Shared time can't exceed the objective bound.
+        if self.objective.compute_only:
+            self._bound(problem.weighted_time - model.ObjBound)
 
         # Create optimal schedule.
         schedule = defaultdict(list)
@@ -86,13 +130,33 @@ class BIPModelGurobi(object):
                         schedule[i].append(c)
                         break
 
-        saver(schedule)
+        self._save(schedule)
+
+    def suggest(self, schedule):
+        # Picked up by the callback at the next node.
+        self.suggested = schedule
+
+    def _callback(self, model, where):
+        if self.stopped():
+            model.terminate()
+            return
+
+        # Hand schedules found elsewhere to the model. Gurobi completes the
+        # y variables from the x values.
+        if where == GRB.callback.MIPNODE and self.suggested is not None:
+            schedule, self.suggested = self.suggested, None
+            for (i, s, c), v in self.x.items():
+                model.cbSetSolution(v, 1.0 if schedule[i][s-1] == c else 0.0)
+            model.cbUseSolution()
+            return
 
-    def _callback(self, saver, model, where):
         # Save incumbent solutions as they are found.
         if where != GRB.callback.MIPSOL:
             return
 
+        if self.objective.compute_only:
+            self._bound(self.problem.weighted_time - model.cbGet(GRB.callback.MIPSOL_OBJBND))
+
         schedule = defaultdict(list)
         for i, stages in self.problem.stages.items():
             for s in stages:
@@ -101,21 +165,221 @@ class BIPModelGurobi(object):
                         schedule[i].append(c)
                         break
 
-        saver(schedule)
+        self._save(schedule)
+
+    def _layer_objective(self):
+        problem, model, x = self.problem, self.model, self.x
+        times = problem.commands
+
+        # z[i,s] = 1 if image i builds its own layer at stage s, meaning it
+        #          shares its path through s with no heavier image, or an
+        #          earlier one of the same weight. Layers are then paid for
+        #          by the image that rebuilds them most often.
+        # w[i,s,c] >= 1 if image i pays for running command c at stage s.
+        weights = problem.weights
+        earlier = defaultdict(list)
+        for (ip, iq, s, c), v in self.y.items():
+            if weights[iq] > weights[ip]:
+                earlier[ip, s].append(v)
+            else:
+                earlier[iq, s].append(v)
+
+        z = {}
+        w = {}
+        for i, cmds in problem.images.items():
+            for s in problem.stages[i]:
+                z[i,s] = model.addVar(vtype=GRB.BINARY, name='z[%s,%s]' % (i,s))
+                for c in cmds:
+                    w[i,s,c] = model.addVar(ub=1.0, name='w[%s,%s,%s]' % (i,s,c))
+
+        model.update()
+
+        for (i, s), v in z.items():
+            model.addConstr(v >= 1 - sum(earlier[i,s]))
+            for c in problem.images[i]:
+                model.addConstr(w[i,s,c] >= x[i,s,c] + v - 1)
+
+        # Layers already in a warm cache take up disk but no time.
+        cache = self.objective.cache
+        paid = w if cache is None else self._warm(w)
+
+        # Compute time of layers at each stage.
+        cost = {
+            (i,s): sum(times[c] * paid[i,s,c] for c in problem.images[i])
+            for i, s in z
+        }
+        work = sum(cost.values())
+
+        if self.objective.incremental:
+            compute = self._rebuild_time(paid)
+        elif problem.weighted:
+            compute = sum(weights[i] * c for (i, s), c in cost.items())
+        else:
+            compute = work
+
+        # Terms charged on top of the makespan mix, as in the objective.
+        extra = 0
+
+        # Bytes of the layers images pay for.
+        if self.objective.storage_aware:
+            storage = sum(problem.sizes[c] * v for (i, s, c), v in w.items())
+            if self.objective.budget is not None:
+                # Bytes over the budget come before everything else, as in
+                # the objective, so the best schedule over budget is still found.
+                self.over = model.addVar(name='over')
+                model.update()
+                model.addConstr(self.over >= storage - self.objective.budget, name='budget')
+            extra = self.objective.storage_weight * storage
+
+        if cache is not None and cache.churn:
+            extra = extra + self._churn(cache)
+
+        weight = self.objective.makespan_weight
+        if not weight:
+            self._minimize(compute + extra)
+            return
+
+        # The makespan is at least the longest image, the total work spread
+        # over the workers, and for every stage d, the earliest time any
+        # image can finish its first d-1 commands plus the work of all layers
+        # at stage d or later spread over the workers. Images and prefixes
+        # take less than their cold time if their layers are cached, so only
+        # the bound on work holds then.
+        k = self.objective.workers
+        makespan = model.addVar(name='makespan')
+        model.update()
+
+        model.addConstr(k * makespan >= work)
+        if cache is not None:
+            self._minimize((1 - weight) * compute + weight * makespan + extra)
+            return
+
+        # Cold build time of each image. sum is quicksum here, which would
+        # make these expressions.
+        image_time = {i: fsum(times[c] for c in cmds) for i, cmds in problem.images.items()}
+        model.addConstr(makespan >= max(image_time.values()))
+
+        for d in problem.all_stages[1:]:
+            imgs = [i for i in problem.images if len(problem.images[i]) >= d]
+            if not imgs:
+                break
+
+            # ready[d] <= the prefix time of some image through stage d-1.
+            ready = model.addVar(name='ready[%s]' % d)
+            pick = {i: model.addVar(vtype=GRB.BINARY) for i in imgs}
+            model.update()
+
+            model.addConstr(sum(pick.values()) == 1)
+            for i in imgs:
+                big = image_time[i]
+                prefix = sum(
+                    times[c] * x[i,s,c] for s in range(1, d) for c in problem.images[i]
+                )
+                model.addConstr(ready >= prefix - big * (1 - pick[i]))
+
+            late = sum(cost[i,s] for i, s in z if s >= d)
+            model.addConstr(k * makespan >= k * ready + late)
+
+        self._minimize((1 - weight) * compute + weight * makespan + extra)
+
+    def _minimize(self, score):
+        model = self.model
+        if self.over is None:
+            model.setObjective(score, GRB.MINIMIZE)
+            return
+
+        model.ModelSense = GRB.MINIMIZE
+        model.setObjectiveN(self.over, 0, priority=1, name='over')
+        model.setObjectiveN(score, 1, priority=0, name='score')
+
+    def _warm(self, w):
+        # u[i,p] = 1 only if image i starts with the cached prefix p. Then
+        #          the layer at the end of p costs image i no time.
+        # v[i,s,c] >= 1 if image i pays time for running command c at stage
+        #             s, meaning it pays for the layer and it isn't cached.
+        problem, model, x = self.problem, self.model, self.x
+        cache = self.objective.cache
+
+        hits = defaultdict(list)
+        starts = []
+        for i, cmds in problem.images.items():
+            for p in cache.prefixes:
+                if len(p) > len(cmds) or not set(p) <= set(cmds) or len(set(p)) < len(p):
+                    continue
+                u = model.addVar(vtype=GRB.BINARY, name='u[%s,%s]' % (i, ','.join(p)))
+                hits[i, len(p), p[-1]].append(u)
+                starts.append((i, p, u))
+
+        v = {}
+        for key in w:
+            v[key] = model.addVar(ub=1.0, name='v[%s,%s,%s]' % key)
+        model.update()
+
+        for i, p, u in starts:
+            for s, c in enumerate(p, 1):
+                model.addConstr(u <= x[i,s,c])
+        for key, wv in w.items():
+            model.addConstr(v[key] >= wv - sum(hits[key]))
+
+        return v
+
+    def _churn(self, cache):
+        # d[i] = 1 if image i runs its commands in a different order than
+        #        it did when the cache was built.
+        problem, model, x = self.problem, self.model, self.x
+
+        d = {}
+        for i, old in cache.orders.items():
+            if sorted(problem.images.get(i, ())) != sorted(old):
+                continue  # a different set of commands can't keep its order
+            d[i] = model.addVar(vtype=GRB.BINARY, name='d[%s]' % i)
+        model.update()
+
+        for i, v in d.items():
+            for s, c in enumerate(cache.orders[i], 1):
+                model.addConstr(v >= 1 - x[i,s,c])
+
+        return cache.churn * sum(d.values())
+
+    def _rebuild_time(self, w):
+        # A layer is rebuilt if any command up to it changes. The sum of the
+        # change probabilities through a stage bounds that from above and is
+        # linear in x, so the model charges each layer an image pays for
+        # its weighted time times that sum.
+        #
+        # r[i,s,c] >= change probability through stage s if image i pays
+        #             for running command c at stage s.
+        problem, model, x = self.problem, self.model, self.x
+        changes = problem.changes
+
+        r = {}
+        for key in w:
+            r[key] = model.addVar(name='r[%s,%s,%s]' % key)
+        model.update()
+
+        for i, cmds in problem.images.items():
+            big = sum(changes[c] for c in cmds)
+            if not big:
+                continue
+            for s in problem.stages[i]:
+                prefix = sum(changes[c] * x[i,t,c] for t in range(1, s+1) for c in cmds)
+                for c in cmds:
+                    model.addConstr(r[i,s,c] >= prefix - big * (1 - w[i,s,c]))
+
+        return sum(
+            problem.weights[i] * problem.commands[c] * v for (i, s, c), v in r.items()
+        )
 
     def _heur(self):
         # Find the heuristic we're supported to use.
         heur = None
         for h in (MostCommonHeuristic, MostTimeHeuristic):
             if self.heur == h._slug:
-                heur = h()
-
-        # Use heuristic for initial feasible solution.
-        soln = []
-        def save_initial(schedule):
-            soln.append(schedule)
-        heur.solve(self.problem, save_initial)
-        init = soln.pop()
+                heur = self._heuristic(h)
+
+        # Use heuristic for initial feasible solution. It is also our
+        # first incumbent in case the model doesn't find anything better.
+        init = heur.solve(self.problem, self._save, self.objective.cache)
 
         # Inform the BIP model of this solution.
         for i,s,c in self.x:
@@ -1,66 +1,76 @@
+from .base import Solver
 from collections import defaultdict
+from dicp import trace
 from itertools import product
 from gurobipy import GRB, Model, quicksum as sum
 
 
-class CliqueModelGurobi(object):
+class CliqueModelGurobi(Solver):
     '''Transformed set packing model over maximal cliques'''
     _slug = 'clique-model-gurobi'
 
-    def __init__(self, time=None):
-        self.time = time  # in minutes
-
-    def slug(self):
-        return CliqueModelGurobi._slug
-
-    def solve(self, problem, saver):
-        # Construct model.
-        self.problem = problem
+    def _solve(self, problem):
+        self._seed()
 
         # Do recursive maximal clique detection.
         self.clique_data = clique_data = problem.cliques()
-        self.model = model = Model()
-        if self.time is not None:
-            model.params.TimeLimit = 60 * int(self.time)
-
-        # Each image needs to run all its commands. This keep track of
-        # what variables run each command for each image.
-        self.by_img_cmd = by_img_cmd = defaultdict(list)
-
-        # Objective is the total cost of all the commands we run.
-        self._obj = []
-
-        # x[i,c] = 1 if image i incurs the cost of command c directly
-        self.x = x = {}
-        for img, cmds in problem.images.items():
-            for cmd in cmds:
-                name = 'x[%s,%s]' % (img, cmd)
-                x[name] = v = model.addVar(vtype=GRB.BINARY, name=name)
-                self._obj.append(problem.commands[cmd] * v)
-                by_img_cmd[img, cmd].append(v)
-
-        # cliques[i] = 1 if clique i is used, 0 otherwise
-        self.cliques = {}
-        self._update(clique_data)
-
-        for c in clique_data['cliques']:
-            print c
-        # Each image has to run each of its commands.
-        for img_cmd, vlist in by_img_cmd.items():
-            self.model.addConstr(sum(vlist) == 1)
-
-        model.setObjective(sum(self._obj), GRB.MINIMIZE)
-        model.optimize()  # lambda *args: self._callback(saver, *args))
-
-        # TODO: callback
+        with trace.phase('build'):
+            self.model = model = Model()
+            if self.time is not None:
+                model.params.TimeLimit = self.time_left()
+
+            # Each image needs to run all its commands. This keep track of
+            # what variables run each command for each image.
+            self.by_img_cmd = by_img_cmd = defaultdict(list)
+
+            # Objective is the total cost of all the commands we run.
+            self._obj = []
+
+            # x[i,c] = 1 if image i incurs the cost of command c directly
+            self.x = x = {}
+            for img, cmds in problem.images.items():
+                for cmd in cmds:
+                    name = 'x[%s,%s]' % (img, cmd)
+                    x[name] = v = model.addVar(vtype=GRB.BINARY, name=name)
+                    self._obj.append(problem.commands[cmd] * v)
+                    by_img_cmd[img, cmd].append(v)
+
+            # cliques[i] = 1 if clique i is used, 0 otherwise
+            self.cliques = {}
+            self._update(clique_data)
+
+            for c in clique_data['cliques']:
+                print c
+            # Each image has to run each of its commands.
+            for img_cmd, vlist in by_img_cmd.items():
+                self.model.addConstr(sum(vlist) == 1)
+
+            model.setObjective(sum(self._obj), GRB.MINIMIZE)
+        with trace.phase('optimize'):
+            model.optimize(trace.wrap('callback', self._callback))
+        if model.SolCount < 1:
+            return
+
+        self._save(self._schedule(lambda v: v.x))
+
+    def _callback(self, model, where):
+        if self.stopped():
+            model.terminate()
+            return
+
+        # Save incumbent solutions as they are found.
+        if where == GRB.callback.MIPSOL:
+            self._save(self._schedule(model.cbGetSolution))
+
+    def _schedule(self, val_func):
         # Translate the output of this to a schedule.
         schedule = defaultdict(list)
-        self._translate(schedule, clique_data)
-        for name, v in x.items():
+        self._translate(schedule, self.clique_data, val_func)
+        for name, v in self.x.items():
             img, cmd = name.replace('x[', '').replace(']', '').split(',')
-            if v.x > 0.5:
+            if val_func(v) > 0.5:
                 schedule[img].append(cmd)
-        saver(schedule)
+        return schedule
 
     def _update(self, clique_data, parent=None):
         for c in clique_data['cliques']:
@@ -84,10 +94,10 @@ class CliqueModelGurobi(object):
         for inter in clique_data['intersections']:
             self.model.addConstr(sum(self.cliques[i] for i in inter) <= 1)
 
-    def _translate(self, schedule, data):
+    def _translate(self, schedule, data, val_func):
         for c in data['cliques']:
-            if self.cliques[c['name']].x > 0.5:
+            if val_func(self.cliques[c['name']]) > 0.5:
                 for img, cmd in product(c['images'], c['commands']):
                     schedule[img].append(cmd)
                 for child in c['children']:
-                    self._translate(schedule, child)
+                    self._translate(schedule, child, val_func)
@@ -1,66 +1,66 @@
+from .base import Solver
 from collections import defaultdict
+from dicp import trace
 from itertools import product
-from mosek.fusion import Model, Domain, Expr, ObjectiveSense, AccSolutionStatus
+from mosek.fusion import Model, Domain, Expr, ObjectiveSense, AccSolutionStatus, SolutionStatus
 import sys
 
-class CliqueModelMosek(object):
+class CliqueModelMosek(Solver):
     '''Transformed set packing model over maximal cliques'''
     _slug = 'clique-model-mosek'
 
-    def __init__(self, time=None):
-        self.time = time # in minutes
-
-    def slug(self):
-        return CliqueModelMosek._slug
-
-    def solve(self, problem, saver):
-        # Construct model.
-        self.problem = problem
+    def _solve(self, problem):
+        self._seed()
 
         # Do recursive maximal clique detection.
         self.clique_data = clique_data = problem.cliques()
-        self.model = model = Model()
-        if self.time is not None:
-            model.setSolverParam('mioMaxTime', 60.0  * int(self.time))
-
-        # Each image needs to run all its commands. This keep track of
-        # what variables run each command for each image.
-        self.by_img_cmd = by_img_cmd = defaultdict(list)
-
-        # Objective is the total cost of all the commands we run.
-        self._obj = []
-
-        # x[i,c] = 1 if image i incurs the cost of command c directly
-        self.x = x = {}
-        for img, cmds in problem.images.items():
-            for cmd in cmds:
-                name = 'x[%s,%s]' % (img, cmd)
-                x[name] = v = self.model.variable(
+        with trace.phase('build'):
+            self.model = model = Model()
+            if self.time is not None:
+                model.setSolverParam('mioMaxTime', self.time_left())
+
+            # Each image needs to run all its commands. This keep track of
+            # what variables run each command for each image.
+            self.by_img_cmd = by_img_cmd = defaultdict(list)
+
+            # Objective is the total cost of all the commands we run.
+            self._obj = []
+
+            # x[i,c] = 1 if image i incurs the cost of command c directly
+            self.x = x = {}
+            for img, cmds in problem.images.items():
+                for cmd in cmds:
+                    name = 'x[%s,%s]' % (img, cmd)
+                    x[name] = v = self.model.variable(
+                        name,
+                        Domain.inRange(0.0, 1.0),
+                        Domain.isInteger()
+                    )
+                    self._obj.append(Expr.mul(float(problem.commands[cmd]), v))
+                    by_img_cmd[img,cmd].append(v)
+
+            # cliques[i] = 1 if clique i is used, 0 otherwise
+            self.cliques = {}
+            self._inter = 1
+            self._update(clique_data)
+
+            # Each image has to run each of its commands.
+            for img_cmd, vlist in by_img_cmd.items():
+                name = 'img-cmd-%s-%s' % img_cmd
+                self.model.constraint(
                     name,
-                    Domain.inRange(0.0, 1.0),
-                    Domain.isInteger()
+                    Expr.add(vlist),
+                    Domain.equalsTo(1.0)
                 )
-                self._obj.append(Expr.mul(float(problem.commands[cmd]), v))
-                by_img_cmd[img,cmd].append(v)
-
-        # cliques[i] = 1 if clique i is used, 0 otherwise
-        self.cliques = {}
-        self._inter = 1
-        self._update(clique_data)
-
-        # Each image has to run each of its commands.
-        for img_cmd, vlist in by_img_cmd.items():
-            name = 'img-cmd-%s-%s' % img_cmd
-            self.model.constraint(
-                name,
-                Expr.add(vlist),
-                Domain.equalsTo(1.0)
-            )
 
-        model.objective('z', ObjectiveSense.Minimize, Expr.add(self._obj))
+            model.objective('z', ObjectiveSense.Minimize, Expr.add(self._obj))
         model.setLogHandler(sys.stdout)
         model.acceptedSolutionStatus(AccSolutionStatus.Feasible)
-        model.solve()
+        model.setDataCallbackHandler(lambda *args: int(self.stopped()))
+        with trace.phase('optimize'):
+            model.solve()
+        if model.getPrimalSolutionStatus() not in (SolutionStatus.Optimal, SolutionStatus.Feasible):
+            return
 
         # Translate the output of this to a schedule.
         schedule = defaultdict(list)
@@ -69,7 +69,7 @@ class CliqueModelMosek(object):
             img, cmd = name.replace('x[','').replace(']','').split(',')
             if v.level()[0] > 0.5:
                 schedule[img].append(cmd)
-        saver(schedule)
+        self._save(schedule)
 
 
     def _update(self, clique_data, parent=None):
@@ -1,22 +1,18 @@
+from .base import Solver
 from collections import defaultdict
+from dicp import trace
 from dicp.clique import Clique
 from gurobipy import GRB, Model, quicksum
 from itertools import combinations, product
 import time
 
 
-class ColgenModelGurobi(object):
+class ColgenModelGurobi(Solver):
     '''Column Generation model'''
     _slug = 'colgen-model-gurobi'
 
-    def __init__(self, time=None):
-        self.time = time  # in minutes
-
-    def slug(self):
-        return ColgenModelGurobi._slug
-
-    def solve(self, problem, saver):
-        self.problem = problem
+    def _solve(self, problem):
+        self._seed()
 
         # Starting cliques
         self.cliques = set()
@@ -45,11 +41,17 @@ class ColgenModelGurobi(object):
             self._test_intersection(c1, c2)
 
         for iteration in range(1000):
+            if self.stopped():
+                break
+
             print '[iteration %02d / %s]' % (iteration + 1, time.asctime())
 
             done = True
             self._master()
-            for clique in self._subproblem():
+            with trace.phase('pricing'):
+                new_cliques = self._subproblem()
+
+            for clique in new_cliques:
                 if clique is not None and clique not in self.cliques:
                     print '[new clique] %s' % clique
 
@@ -64,31 +66,53 @@ class ColgenModelGurobi(object):
                         self.img_to_cliques[img].append(clique)
 
             if done:
-                solution = self._master(final=True)
-
-                print '\n[solution]'
-                for clique in sorted(solution):
-                    if len(clique.images) > 1:
-                        print clique
-
-                print '\n[cliques]'
-                for clique in sorted(self.cliques):
-                    if len(clique.images) > 1:
-                        print clique
                 break
             print
 
+        # Solve the master over whatever columns we have, even if we ran
+        # out of time before pricing finished.
+        solution = self._master(final=True)
+        if solution is None:
+            return
+
+        print '\n[solution]'
+        for clique in sorted(solution):
+            if len(clique.images) > 1:
+                print clique
+
+        print '\n[cliques]'
+        for clique in sorted(self.cliques):
+            if len(clique.images) > 1:
+                print clique
+
+        self._save(self._schedule(solution))
+
+    def _schedule(self, solution):
+        # Each image runs the commands of its cliques, largest groups of
+        # images first so shared cliques form common prefixes.
+        by_img = defaultdict(list)
+        for clique in solution:
+            for img in clique.images:
+                by_img[img].append(clique)
+
+        schedule = defaultdict(list)
+        for img, cliques in by_img.items():
+            for clique in sorted(cliques, key=lambda c: (-len(c.images), c.commands)):
+                schedule[img].extend(clique.commands)
+
+        return schedule
+
     def _test_intersection(self, c1, c2):
         c1, c2 = tuple(sorted([c1, c2]))
         if (c1, c2) in self.intersections:
             return
 
-        overlapping_images = bool(c1.images_set.intersection(c2.images_set))
+        overlapping_images = bool(c1.image_mask & c2.image_mask)
         if not overlapping_images:
             return
 
-        disjoint_images = bool(c1.images_set - c2.images_set and c2.images_set - c1.images_set)
-        overlapping_commands = bool(c1.commands_set.intersection(c2.commands_set))
+        disjoint_images = bool(c1.image_mask & ~c2.image_mask and c2.image_mask & ~c1.image_mask)
+        overlapping_commands = bool(c1.command_mask & c2.command_mask)
 
         if disjoint_images or (overlapping_images and overlapping_commands):
             self.intersections.add((c1, c2))
@@ -99,6 +123,8 @@ class ColgenModelGurobi(object):
 
         model = Model()
         model.params.OutputFlag = False
+        if final and self.time is not None:
+            model.params.TimeLimit = self.time_left()
         obj = []
 
         # x[i,c] = 1 if clique c is used
@@ -128,9 +154,12 @@ class ColgenModelGurobi(object):
             clique_inter_constraints[c1, c2] = model.addConstr(x[c1] + x[c2] <= 1)
 
         model.setObjective(quicksum(obj), GRB.MINIMIZE)
-        model.optimize()
+        with trace.phase('master', final=final):
+            model.optimize()
 
         if final:
+            if model.SolCount < 1:
+                return None
             print '\n[final master obj: %.02f]' % model.objVal
             return [c for c in self.cliques if x[c].x > 0.5]
 
@@ -225,7 +254,8 @@ class ColgenModelGurobi(object):
                     model.addConstr(q2[i] <= 1 - r2[i])
 
             model.setObjective(sum(obj), GRB.MINIMIZE)
-            model.optimize()
+            with trace.phase('pricing.optimize'):
+                model.optimize()
 
             if model.objVal >= 0:
                 continue
@@ -0,0 +1,160 @@
+from .base import Incumbent, Solver, flag
+from .beam_search import Expander
+from .local_search import LocalSearch
+from .most_common import MostCommonHeuristic
+from .most_time import MostTimeHeuristic
+from dicp import trace
+from multiprocessing import Pool, cpu_count
+import random
+import time
+
+# Restarts are seeded with seed * RESTART_STRIDE + restart number.
+RESTART_STRIDE = 1000003
+
+
+class Restarts(object):
+    '''Builds and polishes the schedule of one numbered restart.
+
+    Restarts only return schedules that beat every earlier restart they
+    built, as nothing else can improve the global best when results are
+    taken in restart order.
+    '''
+
+    def __init__(self, problem, objective, alpha, seed, polish, iterations, deadline):
+        self.problem = problem
+        self.objective = objective
+        self.alpha = alpha
+        self.seed = seed
+        self.polish = polish
+        self.iterations = iterations
+        self.deadline = deadline
+        self.expander = Expander(problem, 'time', 1, objective.incremental)
+        self.best = None
+
+    def __call__(self, restart):
+        if self.deadline is not None and time.time() >= self.deadline:
+            return None, None
+
+        rng = random.Random(self.seed * RESTART_STRIDE + restart)
+        schedule = self.construct(rng)
+        if self.polish:
+            schedule = self.improve(schedule, rng)
+
+        value = self.objective(self.problem, schedule)
+        if self.best is not None and value >= self.best:
+            return value, None
+        self.best = value
+        return value, schedule
+
+    def construct(self, rng):
+        '''Splits images like the most time heuristic, but shares a random
+        command among those saving at least 1 - alpha of the range of
+        time saved between the best and worst.'''
+        ex = self.expander
+        images = tuple(sorted(self.problem.images))
+        schedule = {i: [] for i in images}
+
+        stack = [(images, frozenset())]
+        while stack:
+            group, done = stack.pop()
+            by_cmd = ex.by_cmd(group, done)
+            common = ex.common(group, by_cmd)
+            for i in group:
+                schedule[i].extend(common)
+            if not by_cmd:
+                continue
+            done = done.union(common)
+
+            saved = {c: ex.saved(by_cmd, c) for c in by_cmd}
+            ranked = sorted(by_cmd, key=lambda c: (-saved[c], c))
+            best, worst = saved[ranked[0]], saved[ranked[-1]]
+            threshold = best - self.alpha * (best - worst)
+            c = rng.choice([c for c in ranked if saved[c] >= threshold])
+
+            inside, outside = ex.split(group, by_cmd, c)
+            for i in inside:
+                schedule[i].append(c)
+            if outside:
+                stack.append((outside, done))
+            stack.append((inside, done.union([c])))
+
+        return schedule
+
+    def improve(self, schedule, rng):
+        search = LocalSearch(iterations=self.iterations, seed=rng.random())
+        search.objective = self.objective
+        search.deadline = self.deadline
+        search.incumbent = Incumbent(self.problem, lambda schedule: None, self.objective)
+        return search.improve(self.problem, schedule)
+
+
+_restarts = None
+
+
+def _start(restarts):
+    global _restarts
+    _restarts = restarts
+
+
+def _restart(restart):
+    return _restarts(restart)
+
+
+class GRASP(Solver):
+    '''Greedy randomized adaptive search over many seeded restarts
+
+    Each restart splits images like the most time heuristic, but picks
+    the command to share at random from those within alpha of the best,
+    and polish runs local search on the result for iterations steps.
+    Restarts run on processes worker processes, and the global best is
+    saved as results come in. Results are taken in restart order and
+    each restart has its own seed, so a given seed gives the same
+    schedules however many processes there are. Restarts are judged by
+    the solver's objective, and with incremental set, commands a whole
+    group shares run in rebuild priority order.
+    '''
+    _slug = 'grasp'
+
+    def __init__(self, restarts=1000, alpha=0.2, polish=False, iterations=200, seed=0,
+                 processes=None, time=None, workers=None, makespan_weight=None,
+                 incremental=False, budget=None, storage_weight=None):
+        super(GRASP, self).__init__(
+            time, workers, makespan_weight, incremental, budget, storage_weight
+        )
+        self.restarts = int(restarts)
+        self.alpha = float(alpha)
+        self.polish = flag(polish)
+        self.iterations = int(iterations)
+        self.seed = int(seed)
+        self.processes = int(processes) if processes is not None else cpu_count()
+
+    def _solve(self, problem):
+        with trace.phase('seed'):
+            for solverclass in (MostCommonHeuristic, MostTimeHeuristic):
+                self._heuristic(solverclass).solve(problem, self._save, self.objective.cache)
+
+        restarts = Restarts(
+            problem, self.objective, self.alpha, self.seed, self.polish, self.iterations,
+            self.deadline
+        )
+
+        pool = None
+        if self.processes > 1:
+            pool = Pool(self.processes, initializer=_start, initargs=(restarts,))
+            chunk = max(1, self.restarts // (16 * self.processes))
+            results = pool.imap(_restart, range(self.restarts), chunk)
+        else:
+            results = (restarts(r) for r in range(self.restarts))
+
+        try:
+            with trace.phase('restarts'):
+                for value, schedule in results:
+                    if self.stopped():
+                        break
+                    trace.count('restarts')
+                    if schedule is not None:
+                        self._save(schedule)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
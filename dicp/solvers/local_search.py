@@ -0,0 +1,106 @@
+from .base import Solver
+from .most_common import MostCommonHeuristic
+from .most_time import MostTimeHeuristic
+from dicp import trace
+import random
+
+
+class LocalSearch(Solver):
+    '''Hill climbing over command orders, starting from the greedy heuristics
+
+    Each step changes the order of one image, either by moving one of its
+    commands or by adopting the longest prefix it can share with another
+    image. Steps that don't make the objective worse are kept.
+    '''
+    _slug = 'local-search'
+    accepts_starts = True
+
+    def __init__(self, time=None, workers=None, makespan_weight=None, incremental=False,
+                 budget=None, storage_weight=None, iterations=2000, seed=None):
+        super(LocalSearch, self).__init__(
+            time, workers, makespan_weight, incremental, budget, storage_weight
+        )
+        self.iterations = int(iterations)
+        self.seed = seed
+        self.suggested = None
+
+    def suggest(self, schedule):
+        # Picked up by improve() at its next step.
+        self.suggested = schedule
+
+    def _solve(self, problem):
+        for heur in (MostCommonHeuristic, MostTimeHeuristic):
+            with trace.phase('seed', heuristic=heur._slug):
+                self._heuristic(heur).solve(problem, self._save, self.objective.cache)
+
+        schedule = {i: list(cmds) for i, cmds in self.incumbent.schedule.items()}
+        self.improve(problem, schedule)
+
+    def improve(self, problem, schedule):
+        '''Improves schedule in place, saving improvements as they are found.'''
+        rng = random.Random(self.seed)
+        images = sorted(i for i, cmds in schedule.items() if len(cmds) > 1)
+        if not images:
+            return schedule
+
+        value = self.objective(problem, schedule)
+        for _ in range(self.iterations):
+            if self.stopped():
+                break
+
+            # Continue from a better schedule found elsewhere.
+            if self.suggested is not None:
+                suggested, self.suggested = self.suggested, None
+                suggested_value = self.objective(problem, suggested)
+                if suggested_value < value:
+                    schedule.clear()
+                    schedule.update((i, list(cmds)) for i, cmds in suggested.items())
+                    value = suggested_value
+
+            img = rng.choice(images)
+            old = schedule[img]
+            if rng.random() < 0.5:
+                new = self._adopt(problem, schedule, img, rng)
+            else:
+                new = self._move(old, rng)
+            if new is None or new == old:
+                continue
+
+            schedule[img] = new
+            new_value = self.objective(problem, schedule)
+            trace.count('moves')
+            if new_value <= value:
+                if new_value < value:
+                    self._save(schedule)
+                value = new_value
+            else:
+                schedule[img] = old
+
+        return schedule
+
+    def _move(self, cmds, rng):
+        cmds = list(cmds)
+        c = cmds.pop(rng.randrange(len(cmds)))
+        cmds.insert(rng.randrange(len(cmds) + 1), c)
+        return cmds
+
+    def _adopt(self, problem, schedule, img, rng):
+        # Share as long a prefix as possible with another image that has
+        # some of the same commands.
+        others = set()
+        for c in schedule[img]:
+            others.update(problem.images_by_command[c])
+        others.discard(img)
+        if not others:
+            return None
+
+        other = schedule[rng.choice(sorted(others))]
+        mine = set(schedule[img])
+        prefix = []
+        for c in other:
+            if c not in mine:
+                break
+            prefix.append(c)
+
+        shared = set(prefix)
+        return prefix + [c for c in schedule[img] if c not in shared]
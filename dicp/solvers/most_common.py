@@ -1,30 +1,57 @@
+from .base import Solver
 from collections import defaultdict
+from dicp import trace
 
-class MostCommonHeuristic(object):
-    '''Heuristic that shares the most common command at any point'''
-    _slug = 'most-common'
+class MostCommonHeuristic(Solver):
+    '''Heuristic that shares the most common command at any point
 
-    def slug(self):
-        return MostCommonHeuristic._slug
+    When minimizing expected rebuild time, a lone image's commands run in
+    order of rebuild priority:
 
-    def solve(self, problem, saver):
-        # Keep track of what hasn't been assigned and how many of each thing there are.
-        remaining = {i: set(problem.images[i]) for i in problem.images}
-        order = defaultdict(list)
-        self._assign(remaining, order)
-        saver(order)
+    >>> from dicp.problem import Problem
+    >>> p = Problem({'A': 100, 'B': 1}, {'i': ['A', 'B']}, changes={'A': 0.5, 'B': 0.1})
+    >>> solver = MostCommonHeuristic(incremental=True)
+    >>> solver.solve(p, lambda schedule: None)
+    {'i': ['A', 'B']}
+    >>> solver.incumbent.value
+    50.55
+    '''
+    _slug = 'most-common'
+
+    def _solve(self, problem):
+        for self.mix in self._storage_mixes():
+            # Keep track of what hasn't been assigned and how many of each thing there are.
+            remaining = {i: set(problem.images[i]) for i in problem.images}
+            order = defaultdict(list)
+            self._assign(remaining, order)
+            self._save(order)
 
     def _assign(self, remaining, order):
         if not remaining:
             return
 
+        trace.count('splits')
+
         # Figure the most common command.
         by_cmd = defaultdict(set)
         for i, cmds in remaining.items():
             for c in cmds:
                 by_cmd[c].add(i)
 
-        most_common = max(by_cmd, key=lambda p: len(by_cmd[p]))
+        weights = self.problem.weights
+        if self.objective.incremental:
+            # Prefer stable commands, and run volatile ones late. Sharing only
+            # saves rebuilds for all but the heaviest image, so a lone image,
+            # or a tie, is ordered by rebuild priority.
+            problem = self.problem
+
+            def key(p):
+                w = [weights[i] for i in by_cmd[p]]
+                return (sum(w) - max(w)) * (1 - problem.changes[p]), problem.rebuild_priority(p)
+        else:
+            key = lambda p: sum(weights[i] for i in by_cmd[p])
+        key = self._storage_mix(by_cmd, key, self.mix)
+        most_common = max(by_cmd, key=self._warm_first(remaining, order, key))
 
         # Add this to the schedule for any it applies to.
         new_remain = {}
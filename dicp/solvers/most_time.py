@@ -1,30 +1,43 @@
+from .base import Solver
 from collections import defaultdict
+from dicp import trace
 
-class MostTimeHeuristic(object):
+class MostTimeHeuristic(Solver):
     '''Heuristic that shares the most time consuming command at any point'''
     _slug = 'most-time'
 
-    def slug(self):
-        return MostTimeHeuristic._slug
-
-    def solve(self, problem, saver):
-        # Keep track of what hasn't been assigned and how many of each thing there are.
-        remaining = {i: set(problem.images[i]) for i in problem.images}
-        order = defaultdict(list)
-        self._assign(problem, remaining, order)
-        saver(order)
+    def _solve(self, problem):
+        for self.mix in self._storage_mixes():
+            # Keep track of what hasn't been assigned and how many of each thing there are.
+            remaining = {i: set(problem.images[i]) for i in problem.images}
+            order = defaultdict(list)
+            self._assign(problem, remaining, order)
+            self._save(order)
 
     def _assign(self, problem, remaining, order):
         if not remaining:
             return
 
+        trace.count('splits')
+
         # Figure the most common command.
         by_cmd = defaultdict(set)
         for i, cmds in remaining.items():
             for c in cmds:
                 by_cmd[c].add(i)
 
-        most_time = max(by_cmd, key=lambda c: sum(problem.commands[c] for _ in range(1, len(by_cmd[c]))))
+        # Sharing a command saves running it for all but the heaviest image.
+        def saved(c):
+            weights = [problem.weights[i] for i in by_cmd[c]]
+            return problem.commands[c] * (sum(weights) - max(weights))
+
+        if self.objective.incremental:
+            # Prefer stable commands, and run volatile ones late.
+            key = lambda c: (saved(c) * (1 - problem.changes[c]), problem.rebuild_priority(c))
+        else:
+            key = saved
+        key = self._storage_mix(by_cmd, key, self.mix)
+        most_time = max(by_cmd, key=self._warm_first(remaining, order, key))
 
         # Add this to the schedule for any it applies to.
         new_remain = {}
@@ -1,162 +1,126 @@
+from .base import Solver
 from .most_common import MostCommonHeuristic
 from .most_time import MostTimeHeuristic
 from collections import defaultdict
+from dicp import trace
 from itertools import product
-from mosek.fusion import Model, Domain, Expr, ObjectiveSense, AccSolutionStatus
+from mosek.fusion import Model, Domain, Expr, Matrix, ObjectiveSense, AccSolutionStatus, SolutionStatus
 import sys
 
-class NetworkMosek(object):
+class NetworkMosek(Solver):
     '''Network binary integer program: full model with no decomposition'''
     _slug = 'network-mosek'
 
     def __init__(self, presol=None, heur=None, time=None):
+        super(NetworkMosek, self).__init__(time)
         self.presol = presol
         self.heur = heur
-        self.time = time # in minutes
 
-    def slug(self):
-        return NetworkMosek._slug
+    def _solve(self, problem):
+        self._seed()
 
-    def solve(self, problem, saver):
         # Construct model.
-        self.problem = problem
-        self.model = model = Model()
-        if self.time is not None:
-            model.setSolverParam('mioMaxTime', 60.0  * int(self.time))
-
-        # x[1,c] = 1 if the master schedule has (null, c) in its first stage
-        # x[s,c1,c2] = 1 if the master schedule has (c1, c2) in stage s > 1
-        x = {}
-        for s in problem.all_stages:
-            if s == 1:
-                # First arc in the individual image path.
-                for c in problem.commands:
-                    x[1,c] = model.variable(
-                        'x[1,%s]' % c, 1,
-                        Domain.inRange(0.0, 1.0),
-                        Domain.isInteger()
-                    )
-
-            else:
-                # Other arcs.
-                for c1, c2 in product(problem.commands, problem.commands):
-                    if c1 == c2:
-                        continue
-                    x[s,c1,c2] = model.variable(
-                        'x[%s,%s,%s]' % (s,c1,c2), 1,
-                        Domain.inRange(0.0, 1.0),
-                        Domain.isInteger()
-                    )
-
-        smax = max(problem.all_stages)
-        obj = [0.0]
-
-        # TODO: deal with images that do not have the same number of commands.
-        # t[s,c] is the total time incurred at command c in stage s
-        t = {}
-        for s in problem.all_stages:
-            for c in problem.commands:
-                t[s,c] = model.variable(
-                    't[%s,%s]' % (c,s), 1,
-                    Domain.greaterThan(0.0)
-                )
-                if s == 1:
-                    model.constraint('t[1,%s]' % c,
-                        Expr.sub(t[1,c], Expr.mul(float(problem.commands[c]), x[1,c])),
-                        Domain.greaterThan(0.0)
-                    )
-                else:
-                    rhs = [0.0]
-                    for c1, coeff in problem.commands.items():
+        with trace.phase('build'):
+            self.model = model = Model()
+            if self.time is not None:
+                model.setSolverParam('mioMaxTime', self.time_left())
+
+            # y[i,1,c] = 1 if image i starts by going to c
+            # y[i,s,c1,c2] = 1 if image i goes from command c1 to c2 in stage s > 1
+            # Only arcs between an image's own commands are possible, so y
+            # is indexed by the arcs each image can actually take.
+            y_index = {}
+            for i, cmds in sorted(problem.images.items()):
+                for s in problem.stages[i]:
+                    if s == 1:
+                        for c in cmds:
+                            y_index[i,1,c] = len(y_index)
+                    else:
+                        for c1, c2 in product(cmds, cmds):
+                            if c1 != c2:
+                                y_index[i,s,c1,c2] = len(y_index)
+
+            # x[1,c] = 1 if the master schedule has (null, c) in its first stage
+            # x[s,c1,c2] = 1 if the master schedule has (c1, c2) in stage s > 1
+            # An arc exists in the master schedule only if some image can use it.
+            x_index = {}
+            for key in sorted(y_index, key=y_index.get):
+                arc = key[1:]
+                if arc not in x_index:
+                    x_index[arc] = len(x_index)
+            trace.count('arcs', len(x_index))
+
+            x = model.variable('x', len(x_index), Domain.inRange(0.0, 1.0), Domain.isInteger())
+            y = model.variable('y', len(y_index), Domain.inRange(0.0, 1.0), Domain.isInteger())
+
+            # An image can only use arcs in the master schedule: x >= y.
+            rows, cols = [], []
+            for key, j in y_index.items():
+                rows.append(j)
+                cols.append(x_index[key[1:]])
+            arcs = Matrix.sparse(len(y_index), len(x_index), rows, cols, [1.0] * len(rows))
+            model.constraint('x_y', Expr.sub(Expr.mul(arcs, x), y), Domain.greaterThan(0.0))
+
+            # Each command is an arc destination exactly once per image.
+            # Network balance (stages 1 to |stages|-1): sum of arcs in = sum of arcs out.
+            dest_rows, dest_cols = [], []
+            bal_rows, bal_cols, bal_vals = [], [], []
+            n_dest = n_bal = 0
+            for i, cmds in sorted(problem.images.items()):
+                stages = problem.stages[i]
+                for c in cmds:
+                    dest_rows.append(n_dest)
+                    dest_cols.append(y_index[i,1,c])
+                    for c1 in cmds:
                         if c1 == c:
                             continue
+                        for s in stages[1:]:
+                            dest_rows.append(n_dest)
+                            dest_cols.append(y_index[i,s,c1,c])
+                    n_dest += 1
+
+                    for s in stages[:-1]:
+                        if s == 1:
+                            arcs_in = [y_index[i,1,c]]
                         else:
-                            rhs = Expr.add(rhs, Expr.mulElm(t[s-1,c1], x[s,c1,c]))
-                    model.constraint('t[%s,%s]' % (s,c),
-                        Expr.sub(t[1,c], rhs),
-                        Domain.greaterThan(0.0)
-                    )
-
-                    # Objective function = sum of aggregate  comand times
-                    if s == smax:
-                        obj = Expr.add(obj, t[s,c])
-
-        # y[i,1,c] = 1 if image i starts by going to c
-        # y[i,s,c1,c2] = 1 if image i goes from command c1 to c2 in stage s > 1
-        y = {}
-        for i, cmds in problem.images.items():
-            for s in problem.stages[i]:
-                if s == 1:
-                    # First arc in the individual image path.
-                    for c in cmds:
-                        y[i,1,c] = model.variable(
-                            'y[%s,1,%s]' % (i,c), 1,
-                            Domain.inRange(0.0, 1.0),
-                            Domain.isInteger()
-                        )
-                        model.constraint('x_y[i%s,1,c%s]' % (i,c),
-                            Expr.sub(x[1,c], y[i,1,c]),
-                            Domain.greaterThan(0.0)
-                        )
-
-                else:
-                    # Other arcs.
-                    for c1, c2 in product(cmds, cmds):
-                        if c1 == c2:
-                            continue
-                        y[i,s,c1,c2] = model.variable(
-                            'y[%s,%s,%s,%s]' % (i,s,c1,c2), 1,
-                            Domain.inRange(0.0, 1.0),
-                            Domain.isInteger()
-                        )
-                        model.constraint('x_y[i%s,s%s,c%s,c%s]' % (i,s,c1,c2),
-                            Expr.sub(x[s,c1,c2], y[i,s,c1,c2]),
-                            Domain.greaterThan(0.0)
-                        )
-
-            for c in cmds:
-                # Each command is an arc destination exactly once.
-                arcs = [y[i,1,c]]
-                for c1 in cmds:
-                    if c1 == c:
-                        continue
-                    arcs.extend([y[i,s,c1,c] for s in problem.stages[i][1:]])
-
-                model.constraint('y[i%s,c%s]' % (i,c),
-                    Expr.add(arcs),
-                    Domain.equalsTo(1.0)
-                )
-
-                # Network balance equations (stages 2 to |stages|-1).
-                # Sum of arcs in = sum of arcs out.
-                for s in problem.stages[i][:len(problem.stages[i])-1]:
-                    if s == 1:
-                        arcs_in = [y[i,1,c]]
-                    else:
-                        arcs_in = [y[i,s,c1,c] for c1 in cmds if c1 != c]
-
-                    arcs_out = [y[i,s+1,c,c2] for c2 in cmds if c2 != c]
-
-                    model.constraint('y[i%s,s%s,c%s]' % (i,s,c),
-                        Expr.sub(Expr.add(arcs_in), Expr.add(arcs_out)),
-                        Domain.equalsTo(0.0)
-                    )
-
+                            arcs_in = [y_index[i,s,c1,c] for c1 in cmds if c1 != c]
+                        arcs_out = [y_index[i,s+1,c,c2] for c2 in cmds if c2 != c]
+
+                        for j in arcs_in:
+                            bal_rows.append(n_bal)
+                            bal_cols.append(j)
+                            bal_vals.append(1.0)
+                        for j in arcs_out:
+                            bal_rows.append(n_bal)
+                            bal_cols.append(j)
+                            bal_vals.append(-1.0)
+                        n_bal += 1
+
+            dest = Matrix.sparse(n_dest, len(y_index), dest_rows, dest_cols, [1.0] * len(dest_rows))
+            model.constraint('dest', Expr.mul(dest, y), Domain.equalsTo(1.0))
+            if n_bal:
+                balance = Matrix.sparse(n_bal, len(y_index), bal_rows, bal_cols, bal_vals)
+                model.constraint('balance', Expr.mul(balance, y), Domain.equalsTo(0.0))
+
+            model.objective('z', ObjectiveSense.Minimize, Expr.sum(x))
 
-        model.objective('z', ObjectiveSense.Minimize, Expr.add(x.values()))
-#        model.objective('z', ObjectiveSense.Minimize, obj)
         model.setLogHandler(sys.stdout)
         model.acceptedSolutionStatus(AccSolutionStatus.Feasible)
-        model.solve()
+        model.setDataCallbackHandler(lambda *args: int(self.stopped()))
+        with trace.phase('optimize'):
+            model.solve()
+        if model.getPrimalSolutionStatus() not in (SolutionStatus.Optimal, SolutionStatus.Feasible):
+            return
 
         # Create optimal schedule.
+        level = y.level()
         schedule = defaultdict(list)
         for i, cmds in problem.images.items():
             for s in problem.stages[i]:
                 if s == 1:
                     # First stage starts our walk.
                     for c in cmds:
-                        if y[i,s,c].level()[0] > 0.5:
+                        if level[y_index[i,s,c]] > 0.5:
                             schedule[i].append(c)
                             break
                 else:
@@ -164,9 +128,9 @@ class NetworkMosek(object):
                     for c2 in cmds:
                         if c2 == c:
                             continue
-                        if y[i,s,c,c2].level()[0] > 0.5:
+                        if level[y_index[i,s,c,c2]] > 0.5:
                             schedule[i].append(c2)
                             c = c2
                             break
 
-        saver(schedule)
+        self._save(schedule)
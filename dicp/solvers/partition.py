@@ -0,0 +1,157 @@
+from .base import Solver
+from .most_time import MostTimeHeuristic
+from dicp import trace
+from dicp.layers import LayerTree
+from dicp.problem import Problem
+import random
+
+# Without a capacity, some weight on the busiest node is what spreads images.
+DEFAULT_BALANCE = 0.5
+
+
+class PartitionHeuristic(Solver):
+    '''Assigns images to build nodes that don't share a layer cache
+
+    Images are placed greedily, longest first, on the node where the
+    commands they don't share with it add the least to the score, then
+    moved between nodes by local search.
+    Each node's images are ordered by the most time heuristic, and only
+    sharing within a node counts. capacity limits the number of images on
+    a node, and balance weighs the load of the busiest node against total
+    compute time. Splitting images up only loses sharing, so with balance
+    0 and no capacity every image lands on one node.
+    '''
+    _slug = 'partition'
+
+    def __init__(self, nodes=2, capacity=None, balance=DEFAULT_BALANCE, iterations=1000,
+                 seed=None, time=None, workers=None, makespan_weight=None, incremental=False,
+                 budget=None, storage_weight=None):
+        super(PartitionHeuristic, self).__init__(
+            time, workers, makespan_weight, incremental, budget, storage_weight
+        )
+        self.num_nodes = int(nodes)
+        self.capacity = int(capacity) if capacity is not None else None
+        self.objective.balance = float(balance)
+        self.iterations = int(iterations)
+        self.seed = seed
+
+    def slug(self):
+        return '%s-%d' % (PartitionHeuristic._slug, self.num_nodes)
+
+    def _solve(self, problem):
+        if self.capacity is not None and self.capacity * self.num_nodes < len(problem.images):
+            raise ValueError('%d nodes with capacity %d cannot hold %d images' % (
+                self.num_nodes, self.capacity, len(problem.images)
+            ))
+
+        with trace.phase('greedy'):
+            assignment = self._greedy(problem)
+            members = [set() for _ in range(self.num_nodes)]
+            for img, n in assignment.items():
+                members[n].add(img)
+            nodes = [self._order(problem, imgs) for imgs in members]
+            self._save_nodes(assignment, nodes)
+
+        with trace.phase('improve'):
+            self._improve(problem, assignment, members, nodes)
+
+    def _greedy(self, problem):
+        times = problem.commands
+        length = lambda i: sum(times[c] for c in problem.images[i])
+        order = sorted(problem.images, key=lambda i: (-length(i), i))
+
+        present = [set() for _ in range(self.num_nodes)]
+        load = [0] * self.num_nodes
+        count = [0] * self.num_nodes
+        assignment = {}
+        balance = self.objective.balance
+        for img in order:
+            cmds = problem.images[img]
+            busiest = max(load)
+
+            # Place the image where it adds the least to the score, counting
+            # commands already on a node as shared.
+            best, best_key = None, None
+            for n in range(self.num_nodes):
+                if self.capacity is not None and count[n] >= self.capacity:
+                    continue
+                added = sum(times[c] for c in cmds if c not in present[n])
+                growth = max(0, load[n] + added - busiest)
+                key = ((1 - balance) * added + balance * self.num_nodes * growth, load[n])
+                if best_key is None or key < best_key:
+                    best, best_key = n, key
+
+            assignment[img] = best
+            load[best] += sum(times[c] for c in cmds if c not in present[best])
+            present[best].update(cmds)
+            count[best] += 1
+
+        return assignment
+
+    def _order(self, problem, images):
+        '''Orders the images on one node. Returns (schedule, compute time).'''
+        if not images:
+            return {}, 0
+
+        sub = Problem(
+            problem.commands, {i: problem.images[i] for i in images},
+            problem.weights, problem.changes, problem.sizes
+        )
+        schedule = MostTimeHeuristic().solve(sub, lambda schedule: None)
+        return schedule, LayerTree(sub, schedule).weighted_time
+
+    def _score(self, nodes):
+        loads = [cost for _, cost in nodes]
+        balance = self.objective.balance
+        return (1 - balance) * sum(loads) + balance * len(loads) * max(loads)
+
+    def _save_nodes(self, assignment, nodes):
+        schedule = {}
+        for part, _ in nodes:
+            schedule.update(part)
+        self.objective.nodes = dict(assignment)
+        return self._save(schedule)
+
+    def _improve(self, problem, assignment, members, nodes):
+        '''Moves images between nodes, or swaps them if a node is full.'''
+        if self.num_nodes < 2:
+            return
+
+        rng = random.Random(self.seed)
+        images = sorted(assignment)
+        score = self._score(nodes)
+
+        for _ in range(self.iterations):
+            if self.stopped():
+                break
+
+            img = rng.choice(images)
+            src = assignment[img]
+            dst = rng.choice([n for n in range(self.num_nodes) if n != src])
+
+            moved = [(img, src, dst)]
+            if self.capacity is not None and len(members[dst]) >= self.capacity:
+                other = rng.choice(sorted(members[dst]))
+                moved.append((other, dst, src))
+
+            for i, a, b in moved:
+                members[a].remove(i)
+                members[b].add(i)
+
+            trace.count('moves')
+            old = nodes[src], nodes[dst]
+            nodes[src] = self._order(problem, members[src])
+            nodes[dst] = self._order(problem, members[dst])
+            new_score = self._score(nodes)
+
+            if new_score <= score:
+                for i, a, b in moved:
+                    assignment[i] = b
+                if new_score < score:
+                    self._save_nodes(assignment, nodes)
+                score = new_score
+            else:
+                nodes[src], nodes[dst] = old
+                for i, a, b in moved:
+                    members[b].remove(i)
+                    members[a].add(i)
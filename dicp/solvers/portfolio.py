@@ -0,0 +1,166 @@
+from .base import Solver
+from dicp import trace
+from multiprocessing import Process, Queue
+from Queue import Empty
+from threading import Thread
+
+DEFAULT_SOLVERS = 'most-common,most-time,local-search,bip-model-gurobi,colgen-model-gurobi'
+
+# How often the portfolio checks on its solvers while none report.
+POLL_SECONDS = 0.1
+
+
+def parse_solvers(spec):
+    '''Parses "slug:key=value:...,slug,..." into (slug, kwargs) pairs.'''
+    solvers = []
+    for entry in spec.split(','):
+        parts = entry.strip().split(':')
+        kwargs = {}
+        for p in parts[1:]:
+            key, _, value = p.partition('=')
+            kwargs[key] = value if value else True
+        solvers.append((parts[0], kwargs))
+    return solvers
+
+
+def _listen(solver, starts):
+    while True:
+        schedule = starts.get()
+        if schedule is None:
+            return
+        solver.suggest(schedule)
+
+
+def _run(name, solver, problem, results, starts, cache):
+    '''Runs one solver of the portfolio in its own process.'''
+    if starts is not None:
+        listener = Thread(target=_listen, args=(solver, starts))
+        listener.daemon = True
+        listener.start()
+
+    def saver(schedule):
+        results.put(('incumbent', name, schedule, solver.bound))
+
+    try:
+        solver.solve(problem, saver, cache)
+    except Exception, e:
+        results.put(('error', name, '%s: %s' % (type(e).__name__, e), None))
+        return
+    results.put(('done', name, solver.bound, solver.gap))
+
+
+class Portfolio(Solver):
+    '''Races several solvers in parallel processes under one deadline
+
+    solvers is a comma separated list of solver slugs, each optionally
+    followed by colon separated arguments, e.g. bip-model-gurobi:heur=most-time.
+    Every solver's improving schedules go through this solver's saver.
+    Each new best schedule is offered to the other solvers that accept
+    starts. Once a solver proves its schedule optimal, or the best
+    schedule meets the best bound, the rest are stopped.
+    Objective arguments, like workers or incremental, and the warm cache
+    are passed on to every solver, unless its own arguments set them, so
+    they all optimize what the portfolio compares them on.
+    '''
+    _slug = 'portfolio'
+
+    def __init__(self, solvers=DEFAULT_SOLVERS, time=None, workers=None, makespan_weight=None,
+                 incremental=False, budget=None, storage_weight=None):
+        super(Portfolio, self).__init__(
+            time, workers, makespan_weight, incremental, budget, storage_weight
+        )
+        self.solvers = parse_solvers(solvers)
+
+        # Objective arguments given to the portfolio, to pass on as given.
+        self.shared = dict(
+            (k, v) for k, v in (
+                ('workers', workers), ('makespan_weight', makespan_weight),
+                ('incremental', incremental), ('budget', budget),
+                ('storage_weight', storage_weight)
+            ) if v is not None and v is not False
+        )
+
+    def _solve(self, problem):
+        from . import get_solver
+
+        results = Queue()
+        procs = {}
+        starts = {}
+        for slug, kwargs in self.solvers:
+            try:
+                solverclass = get_solver(slug)
+            except KeyError:
+                raise ValueError('unknown solver: %s' % slug)
+            except ImportError, e:
+                # Race whatever is installed, e.g. the default without gurobipy.
+                print '%s skipped: %s' % (slug, e)
+                continue
+            kwargs = dict(kwargs)
+            for key, value in self.shared.items():
+                kwargs.setdefault(key, value)
+            if self.time is not None:
+                kwargs.setdefault('time', self.time_left() / 60.0)
+            solver = solverclass(**kwargs)
+
+            name = solver.slug()
+            while name in procs:
+                name += "'"
+            if solver.accepts_starts:
+                starts[name] = Queue()
+            procs[name] = Process(
+                target=_run,
+                args=(name, solver, problem, results, starts.get(name), self.objective.cache)
+            )
+
+        if not procs:
+            raise ValueError('no solver in the portfolio can run')
+
+        for proc in procs.values():
+            proc.daemon = True
+            proc.start()
+
+        try:
+            self._collect(results, procs, starts)
+        finally:
+            for q in starts.values():
+                q.put(None)
+            for proc in procs.values():
+                if proc.is_alive():
+                    proc.terminate()
+                proc.join()
+
+    def _collect(self, results, procs, starts):
+        running = set(procs)
+        while running and not self.stopped():
+            try:
+                kind, name, payload, extra = results.get(timeout=POLL_SECONDS)
+            except Empty:
+                # Solvers that died without reporting are no longer running.
+                running = set(n for n in running if procs[n].is_alive())
+                continue
+
+            if kind == 'incumbent':
+                trace.count('portfolio.incumbents')
+                if extra is not None:
+                    self._bound(extra)
+                if self._save(payload):
+                    trace.count('portfolio.improvements')
+                    for other, q in starts.items():
+                        if other != name and other in running:
+                            q.put(self.incumbent.schedule)
+
+            elif kind == 'done':
+                running.discard(name)
+                if extra is not None:
+                    self._bound(payload)
+                if extra == 0:
+                    trace.count('portfolio.proven')
+                    break
+
+            else:
+                running.discard(name)
+                trace.count('portfolio.errors')
+                print '%s failed: %s' % (name, payload)
+
+            if self.gap == 0:
+                break
@@ -0,0 +1,212 @@
+'''Phase timers, counters and memory snapshots for solver runs.
+
+Tracing is off by default. While it is off, phase() hands back a shared
+no-op context manager and count() returns immediately, so instrumented
+code pays for little more than a function call.
+'''
+from collections import OrderedDict, defaultdict
+from timeit import default_timer as clock
+import json
+import os
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase(object):
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.depth = len(self.tracer._stack)
+        self.tracer._stack.append(self.name)
+        self.start = clock()
+        return self
+
+    def __exit__(self, *args):
+        end = clock()
+        self.tracer._stack.pop()
+
+        event = OrderedDict([
+            ('name', self.name),
+            ('start', self.start - self.tracer.started),
+            ('seconds', end - self.start),
+            ('depth', self.depth)
+        ])
+        if self.args:
+            event['args'] = self.args
+        if self.tracer.memory:
+            event['memory'] = _memory()
+
+        self.tracer.events.append(event)
+        return False
+
+
+def _memory():
+    '''Current and peak memory in bytes, as well as we can measure it.'''
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        return {'current': current, 'peak': peak}
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux.
+        return {'peak': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    return {}
+
+
+class Tracer(object):
+    '''Collects timed phases and counters for a single run'''
+
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.reset()
+
+    def reset(self):
+        self.events = []
+        self.counters = defaultdict(int)
+        self.started = clock()
+        self._stack = []
+
+    def enable(self, memory=False):
+        self.reset()
+        self.enabled = True
+        self.memory = memory
+        if memory and tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        self.enabled = False
+        if self.memory and tracemalloc is not None and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.memory = False
+
+    def phase(self, name, **args):
+        '''Context manager timing the enclosed block as a named phase.'''
+        if not self.enabled:
+            return _NULL_PHASE
+        return _Phase(self, name, args)
+
+    def count(self, name, n=1):
+        '''Adds n to a named counter.'''
+        if self.enabled:
+            self.counters[name] += n
+
+    def wrap(self, name, func):
+        '''Returns func, timed into counters if tracing is enabled.
+
+        This is meant for callbacks that run too often to record as
+        phases. Each call adds to the name.calls and name.seconds counters.'''
+        if not self.enabled:
+            return func
+
+        counters = self.counters
+
+        def wrapped(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                counters[name + '.calls'] += 1
+                counters[name + '.seconds'] += clock() - start
+
+        return wrapped
+
+    def totals(self):
+        '''Maps phase names to their number of calls and total seconds.'''
+        totals = OrderedDict()
+        for event in self.events:
+            t = totals.setdefault(event['name'], {'calls': 0, 'seconds': 0.0})
+            t['calls'] += 1
+            t['seconds'] += event['seconds']
+        return totals
+
+    def to_dict(self):
+        return OrderedDict([
+            ('totals', self.totals()),
+            ('counters', OrderedDict(sorted(self.counters.items()))),
+            ('phases', sorted(self.events, key=lambda e: e['start']))
+        ])
+
+    def to_chrome(self):
+        '''Returns the trace in Chrome trace-event format.'''
+        pid = os.getpid()
+        events = []
+        for event in self.events:
+            events.append({
+                'name': event['name'],
+                'ph': 'X',
+                'ts': event['start'] * 1e6,
+                'dur': event['seconds'] * 1e6,
+                'pid': pid,
+                'tid': 0,
+                'args': event.get('args', {})
+            })
+        for name, value in sorted(self.counters.items()):
+            events.append({
+                'name': name,
+                'ph': 'C',
+                'ts': (clock() - self.started) * 1e6,
+                'pid': pid,
+                'tid': 0,
+                'args': {name: value}
+            })
+        return {'traceEvents': events}
+
+    def save(self, path, format='json'):
+        '''Saves the trace to path as plain json or Chrome trace events.'''
+        if format == 'chrome':
+            data = self.to_chrome()
+        else:
+            data = self.to_dict()
+        with open(path, 'w') as fp:
+            json.dump(data, fp, indent=4)
+
+
+def aggregate(paths):
+    '''Sums phase totals and counters over plain json traces in paths.
+
+    Returns a dict mapping phase names to their total calls, total seconds
+    and the largest total seen in a single trace, and a dict of counters.'''
+    phases = OrderedDict()
+    counters = defaultdict(int)
+    for path in paths:
+        data = json.load(open(path))
+        for name, t in data['totals'].items():
+            agg = phases.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max': 0.0})
+            agg['calls'] += t['calls']
+            agg['seconds'] += t['seconds']
+            agg['max'] = max(agg['max'], t['seconds'])
+        for name, value in data['counters'].items():
+            counters[name] += value
+
+    return phases, dict(counters)
+
+
+# Module level tracer that instrumented code reports to.
+tracer = Tracer()
+enable = tracer.enable
+disable = tracer.disable
+phase = tracer.phase
+count = tracer.count
+wrap = tracer.wrap
+save = tracer.save
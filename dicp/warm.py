@@ -0,0 +1,64 @@
+'''Layer caches builders already hold from earlier schedules.
+
+A WarmCache is a set of command prefixes whose layers are already built.
+Building one of them again costs nothing, so a new schedule that keeps
+using them is cheaper to roll out than its cold-build time suggests.
+When the cache comes from a previous schedule, it also remembers each
+image's old order so the objective can charge for changing it.
+'''
+import json
+
+
+class WarmCache(object):
+    '''Cached layers as command prefixes, plus image orders they came from.
+
+    churn is charged, in units of command time, for every image whose
+    order differs from its old one.
+    '''
+
+    def __init__(self, prefixes=(), orders=None, churn=0):
+        self.prefixes = set()
+        for p in prefixes:
+            self.add(p)
+        self.orders = dict(orders or {})
+        self.churn = churn
+
+    @staticmethod
+    def from_schedule(schedule, churn=0):
+        '''Returns the cache that building schedule leaves behind.'''
+        orders = {i: list(cmds) for i, cmds in schedule.items()}
+        return WarmCache(orders.values(), orders, churn)
+
+    @staticmethod
+    def load(path, churn=0):
+        '''Loads a cache from a solution file or a json list of prefixes.'''
+        with open(path) as fp:
+            data = json.load(fp)
+        if isinstance(data, dict):
+            return WarmCache.from_schedule(data['schedule'], churn)
+        return WarmCache(data, churn=churn)
+
+    def add(self, prefix):
+        '''Adds a cached layer. Layers below it must be cached as well.'''
+        prefix = tuple(prefix)
+        for k in range(1, len(prefix) + 1):
+            self.prefixes.add(prefix[:k])
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def __contains__(self, prefix):
+        return tuple(prefix) in self.prefixes
+
+    def changed(self, schedule):
+        '''Returns the number of images whose order differs from before.'''
+        return sum(
+            1 for i, cmds in schedule.items()
+            if i in self.orders and list(cmds) != self.orders[i]
+        )
+
+    def penalty(self, schedule):
+        '''Returns the churn penalty of moving to schedule.'''
+        if not self.churn:
+            return 0
+        return self.churn * self.changed(schedule)